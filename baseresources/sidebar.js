@@ -13,6 +13,40 @@ btn.onclick = () => {
   }
 };
 
+// With 'sedrila author build --shared-toc', the toc comes from toc.js and gets collapsed here:
+if (typeof sedrila_toc !== "undefined") {
+  const sidebar = document.getElementById("sidebar");
+  sidebar.innerHTML = sedrila_toc;
+  collapseToc(sidebar, location.pathname.split("/").at(-1) || "index.html");
+}
+
+function collapseToc(sidebar, pagefile) {
+  // Show what the page would have embedded: the toc entries on the path to the page and their children.
+  // Entries are a flat sequence of divs of class indent0 (chapter), indent1 (taskgroup), indent2 (task).
+  const entries = Array.from(sidebar.children);
+  const level = entry => Number(entry.className.match(/indent(\d)/)[1]);
+  const current = entries.findIndex(entry => entry.querySelector("a")?.getAttribute("href") === pagefile);
+  if (current < 0) {
+    return;  // the course homepage shows the complete toc
+  }
+  entries[current].classList.add("toc-current");
+  const open = new Set([current]);  // indexes of the page's entry and its ancestors
+  for (let i = current, lvl = level(entries[current]); i >= 0 && lvl > 0; i--) {
+    if (level(entries[i]) < lvl) {
+      lvl = level(entries[i]);
+      open.add(i);
+    }
+  }
+  const isOpen = [];  // isOpen[lvl]: whether the most recent entry of level lvl is open
+  entries.forEach((entry, i) => {
+    const lvl = level(entry);
+    if (lvl > 0 && !isOpen[lvl - 1]) {
+      entry.style.display = "none";
+    }
+    isOpen[lvl] = open.has(i);
+  });
+}
+
 let filename = location.pathname.split("/").at(-1);
 if (filename) {
   filename = filename.substr(0, filename.length - 5);
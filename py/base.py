@@ -1,9 +1,13 @@
 """Shortcut typenames, global constants, basic helpers."""
 import collections
+import contextlib
 import enum
+import filecmp
 import json
 import logging
 import re
+import shutil
+import threading
 import time
 import os
 import typing as tg
@@ -22,6 +26,7 @@ starttime = time.time()
 num_errors = 0
 msgs_seen = set()
 _suppress_msg_duplicates = False
+_msg_collection = threading.local()  # if its .collector is set, rich_print() collects instead of printing
 loglevel = logging.ERROR
 loglevels = dict(DEBUG=logging.DEBUG, INFO=logging.INFO, WARNING=logging.WARNING,
                  ERROR=logging.ERROR, CRITICAL=logging.CRITICAL)
@@ -169,6 +174,31 @@ def spit_bytes(filename: str, content: bytes):
         f.write(content)
 
 
+def spit_if_changed(filename: str, content: str | bytes) -> bool:
+    """
+    Write content to filename unless the file has this very content already (then its mtime stays as is).
+    Compares by size first, then by content. Writes atomically. Returns whether it wrote.
+    """
+    data = content.encode('utf8') if isinstance(content, str) else content
+    if os.path.isfile(filename) and os.path.getsize(filename) == len(data) and slurp_bytes(filename) == data:
+        return False
+    with _tempfile_for(filename) as (tmpname, replace):
+        with open(tmpname, 'wb') as f:
+            f.write(data)
+        replace()
+    return True
+
+
+def copy_if_changed(sourcefile: str, filename: str) -> bool:
+    """Like spit_if_changed() for a copy of sourcefile."""
+    if os.path.isfile(filename) and filecmp.cmp(sourcefile, filename, shallow=False):
+        return False
+    with _tempfile_for(filename) as (tmpname, replace):
+        shutil.copyfile(sourcefile, tmpname)
+        replace()
+    return True
+
+
 def spit_json(filename: str, content: StrAnyDict):
     spit(filename, json.dumps(content))
 
@@ -184,6 +214,14 @@ def slugify(value: str) -> str:
     return re.sub(r'[{}\s]+'.format(separator), separator, value)
 
 
+def collect_msgs(collector: tg.Optional[list]):
+    """
+    Make rich_print() in the current thread append (msg, tag, count) triples to collector instead 
+    of printing them, e.g. in a worker that hands its messages over. None switches back to printing.
+    """
+    _msg_collection.collector = collector
+
+
 def suppress_msg_duplicates(suppression=True):
     global _suppress_msg_duplicates
     _suppress_msg_duplicates = suppression
@@ -217,6 +255,14 @@ def critical(msg: str, file: str = None, file2: str = None):
     raise CritialError(msg)
 
 
+def reset_msgs():
+    """Start counting errors, timing, and suppressing duplicates afresh, e.g. for another build."""
+    global num_errors, msgs_seen, starttime
+    starttime = time.time()
+    num_errors = 0
+    msgs_seen = set()
+
+
 def finalmessage():
     timing = "%.1f seconds" % (time.time() - starttime)
     if num_errors > 0:
@@ -281,6 +327,10 @@ def get_progressbar(maxcount: int) -> tg.Iterator[rich.progress.ProgressType]:
 def rich_print(msg: str, enclose_in_tag: tg.Optional[str] = None, count=0):
     """Print any message, but if _suppress_msg_duplicates, print each one only once."""
     global num_errors, msgs_seen, _suppress_msg_duplicates
+    collector = getattr(_msg_collection, 'collector', None)
+    if collector is not None:
+        collector.append((msg, enclose_in_tag, count))
+        return
     if msg in msgs_seen and _suppress_msg_duplicates:
         return
     if msg not in msgs_seen:
@@ -318,6 +368,20 @@ def problem_with_path(dirtypath: str) -> str:
     return ""
 
 
+@contextlib.contextmanager
+def _tempfile_for(filename: str):
+    """
+    Yields a temporary filename next to filename and the operation that renames it to filename,
+    so readers (e.g. a webserver or rsync) see either the old or the new file, never a partial one.
+    """
+    tmpname = f"{filename}.{os.getpid()}-{threading.get_ident()}.tmp"  # unique also across threads
+    try:
+        yield tmpname, lambda: os.replace(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+
 def _do_slurp(resource: str, resulttype: type) -> str | bytes:
     """Reads local file (via plain filename or 'file:' URL) or http resource (via URL)"""
     assert resulttype in (str, bytes)
@@ -354,9 +418,6 @@ def _process_params(msg: str, file: tg.Optional[str], file2: tg.Optional[str]):
 
 def _testmode_reset():
     """reset error counter; avoid text wrapping of b.error() etc."""
-    global num_errors, msgs_seen, starttime
-    starttime = time.time()
-    num_errors = 0
-    msgs_seen = set()
+    reset_msgs()
     rich.get_console()._width = 10000
     set_register_files_callback(lambda s: None)
\ No newline at end of file
@@ -1,20 +1,26 @@
 """Element cache for incremental build."""
 import dbm
 import enum
-import itertools
+import glob
+import hashlib
 import json
 import os
+import shutil
+import sqlite3
+import threading
 import time
 import typing as tg
 import zlib
 
 import base as b
+import memo
 
 
 UNCOMPRESSED_LIMIT = 40  # length of longest string to store uncompressed
 ZLIB_WBITS = -15
 Cacheable = str | list[str] | b.StrAnyDict  # what can be put in the cache
 CacheEntryType = None | Cacheable  # what cache queries can return
+Entry = tuple[str, str, str, bytes]  # key, typename, digest, compressed data
 
 
 class State(enum.StrEnum):
@@ -35,43 +41,76 @@ class SedrilaCache:
     There are four entry types:
     - files are reflected as a cache key with empty value.
       The has_changed reference time for files is stored in a single entry TIMESTAMP_KEY.
+      In hashmode, the value is a fingerprint of the file instead (see _fingerprint())
+      and a file has changed only if its content has. 
     - str are just that.
     - list[str] and set[str] are stored as a string using LIST_SEPARATOR.
     - dict[Any] are stored as json.
+    Each entry also has a digest of its value (see digest_of()), so that values can be compared
+    without reading them.
     Keys take the form partname__entrytype.
     Helper entries use __dunder__ keys.
-    The actual filename(s) depend(s) on the chosen DBM implementation, which depends on
-    what is installed on the system, which means cache files are not necessarily portable
-    to other computers.  The default plain-Python DBM will have a single *.db file.
+    The entries are kept by a backend, by default SqliteBackend.
+    Entries written during a run are compressed right away and go to the backend in batches (see commit()),
+    so that memory use stays bounded and an interrupted build keeps what it has finished.
+    The keys of such an unfinished run are recorded in UNFINISHED_KEY; the next run treats
+    them as HAS_CHANGED (see recovered), because the elements depending on them may not have been built.
+    Alongside the entries, a memo.Memo (in its own file) keeps values that are addressed by content
+    rather than by element, e.g. rendered Markdown blocks.
     """
     LIST_SEPARATOR = '|'  # separates entries in list-valued dbm entries. Symbol is forbidden in all names.
     TIMESTAMP_KEY = '__mtime__'  # unix timestamp: seconds since epoch
     DIRTYFILES_KEY = '__dirtyfileslist__'  # previous_dirtyfiles
+    UNFINISHED_KEY = '__unfinishedkeys__'  # keys written by a run that did not reach close()
+    PENDING_LIMIT = 4_000_000  # bytes of compressed pending data that trigger a commit()
+    COMMIT_INTERVAL = 10.0  # seconds after which a write triggers a commit()
+    MEMO_SUFFIX = '-memo'  # the memo file is cache_filename + MEMO_SUFFIX
 
-    db: dict  # in fact a dbm._Database
+    db: 'SqliteBackend | DbmBackend | DictBackend'
+    memo: memo.Memo
     persistent_mode: bool  # non-persistent mode for testing/student/instructor via cache_filename=""
-    written: b.StrAnyDict  # what was written into cache since start
+    hashmode: bool  # detect file changes by content hash rather than by mtime
+    written: dict[str, str]  # key -> typename of what was written into cache since start
+    previous_values: dict[str, str]  # file key -> its value from the previous run, see _previous_value()
+    pending: dict[str, Entry]  # key -> entry of what is not yet committed
+    pending_size: int  # total length of the compressed data in pending
+    last_commit: float  # time.time() of previous commit()
+    lock: threading.RLock  # for writes from the threads of Directory.build()
+    recovered: set[str]  # keys written by an interrupted previous run
+    changed_files: tg.Optional[set[str]]  # if known from elsewhere: the only files that may have changed
     timestamp_start: int  # when did the current build process begin -> the future reference time
     timestamp_cached: int  # when did the previous build process begin -> the current reference time
     previous_dirtyfiles: set[str]  # files marked dirty during last run
     new_dirtyfiles: set[str]  # files marked dirty during present run
 
-    def __init__(self, cache_filename: str, start_clean: bool):
+    def __init__(self, cache_filename: str, start_clean: bool, hashmode=False, backend: type = None):
         # self.timestamp_start = int(time.time() + 0.5)  # add half second in case filesystem mtime rounds, not truncates
         self.timestamp_start = round(time.time(), 3)  # milliseconds suffice for us
         self.persistent_mode = bool(cache_filename)
+        self.hashmode = hashmode
         if self.persistent_mode:
-            self.db = dbm.open(cache_filename, flag='n' if start_clean else 'c')  # open or create dbm file
+            self.db = (backend or SqliteBackend)(cache_filename, start_clean)
         else:
-            self.db = dict()
+            self.db = DictBackend()
+        self.memo = memo.Memo(cache_filename + self.MEMO_SUFFIX if self.persistent_mode else "", start_clean)
         self.written = dict()
+        self.previous_values = dict()
+        self.pending = dict()
+        self.pending_size = 0
+        self.last_commit = time.time()
+        self.lock = threading.RLock()
+        self.recovered = set()
+        self.changed_files = None
         tsk = self.TIMESTAMP_KEY
-        timestamp_cached = float(_decompress(self.db[tsk]) if tsk in self.db else "0")  # default: everything is old
+        timestamp_cached = float(self.db.get(tsk) if tsk in self.db else "0")  # default: everything is old
         self.timestamp_cached = round(timestamp_cached, 3)  # milliseconds suffice for us
         b.debug(f"cache.mtime/timestamp_cached: {self.timestamp_cached}")
         dirtyfiles, dirtyfiles_state = self.cached_list(self.DIRTYFILES_KEY)
         self.previous_dirtyfiles = set(dirtyfiles)
         self.new_dirtyfiles = set()
+        self.recovered = set(self.cached_list(self.UNFINISHED_KEY)[0])
+        if self.recovered:
+            b.debug(f"cache: previous build was interrupted, {len(self.recovered)} entries count as HAS_CHANGED")
         # self._dump(limit=256)  # debug, if needed
 
     def __contains__(self, key: str) -> bool:
@@ -79,13 +118,13 @@ class SedrilaCache:
 
     def __getitem__(self, key: str) -> tg.Any:
         if key in self.written:
-            return self.written[key]
+            return getattr(self, self.READERS[self.written[key]])(self._value(key))
         elif key in self.db:
-            return _decompress(self.db[key])
+            return getattr(self, self.READERS[self.db.typename(key)])(self._stored(key))
         raise ValueError(key)
 
     def __setitem__(self, key: str, value: tg.Any):
-        self.written[key] = value
+        self._put(key, value)
 
     def __getstate__(self):  # for pickle
         return None  # SedrilaCache has no state that should be pickled
@@ -97,6 +136,22 @@ class SedrilaCache:
     def mtime(self) -> int:
         return self.timestamp_cached
 
+    def prefetch(self, keys: tg.Iterable[str]):
+        """Tell the backend that the entries for keys will be read soon, so it can fetch them in bulk."""
+        empty = self.digest_of("")
+        self.db.prefetch([key for key in keys if key not in self.written and self.digest(key) != empty])
+
+    def digest(self, key: str) -> b.OStr:
+        """The digest of the value of key (as of now), or None if there is no entry."""
+        entry = self.pending.get(key)
+        if entry:
+            return entry[2]
+        return self.db.digest(key) if key in self.db else None
+
+    def digest_of(self, value: Cacheable) -> str:
+        """The digest the value would get in the cache. Equal values have equal digests."""
+        return self._serialize(value)[1]
+
     def cached_str(self, key: str) -> tuple[str, State]:
         return self._entry(key, self._as_is)
 
@@ -113,8 +168,8 @@ class SedrilaCache:
         """
         Non-existing file: MISSING.
         Before-unseen file: MISSING. **Special case!`**
-        Dirty file, or recent file: HAS_CHANGED.
-        Otherwise (file with old time): AS_BEFORE.
+        Dirty file, or changed file (see has_changed()): HAS_CHANGED.
+        Otherwise (file with old time or old content): AS_BEFORE.
         """
         if not os.path.exists(pathname):
             return State.MISSING
@@ -122,7 +177,7 @@ class SedrilaCache:
         if cache_state == State.MISSING:
             # b.debug(f"{pathname} not in cache")
             return State.MISSING
-        if self.is_recent(pathname) or self.is_dirty(pathname):
+        if self.has_changed(pathname, cache_key) or self.is_dirty(pathname):
             # b.debug(f"{pathname} has younger mtime")
             return State.HAS_CHANGED
         else:
@@ -134,7 +189,71 @@ class SedrilaCache:
         # assert cache_key not in self.written  # we should usually write everything only once
         # The above assertion is violated sometimes (quite rarely) and I do not understand why
         # despite debugging and tracing. But is should not be a problem.
-        self.written[cache_key] = ""  # file entries are empty because the file itself holds the data
+        previous = self._previous_value(cache_key)  # remember it before we overwrite it
+        if self.hashmode:
+            self._put(cache_key, self._fingerprint(path, previous))
+        else:
+            self._put(cache_key, "")  # file entries are empty because the file itself holds the data
+
+    def has_changed(self, pathname: str, cache_key: str) -> bool:
+        """
+        Whether the file is younger than the cache (is_recent()) or, in hashmode, has different content 
+        than when cache_key was recorded in the previous run.
+        Files lacking such a fingerprint (e.g. recorded in non-hashmode) fall back to is_recent().
+        Files recorded by an interrupted run have always changed.
+        Files not in changed_files (if that is known) have not changed.
+        """
+        if cache_key in self.recovered:
+            return True
+        if self.changed_files is not None and os.path.normpath(pathname) not in self.changed_files:
+            return False
+        previous = self._previous_value(cache_key)
+        if not self.hashmode:
+            it_is = self.is_recent(pathname)
+            if it_is and previous:
+                self._put(cache_key, "")  # the fingerprint is outdated, a later hashmode run must not use it
+            return it_is
+        fingerprint = self._fingerprint(pathname, previous)
+        if not previous:
+            it_is = self.is_recent(pathname)
+            (self._put if it_is else self._refresh)(cache_key, fingerprint)
+            return it_is
+        it_is = fingerprint.rsplit(':', 1)[-1] != previous.rsplit(':', 1)[-1]  # compare the digests
+        if it_is:
+            b.debug(f"cache.has_changed({pathname}): content differs")
+            self._put(cache_key, fingerprint)
+        elif fingerprint != previous:
+            self._refresh(cache_key, fingerprint)  # only the stat part differs: keep the fast path fast
+        return it_is
+
+    def group_has_changed(self, pathnames: list[str], cache_key: str) -> bool:
+        """
+        Whether any of the files has changed, as by has_changed(), e.g. for the files of a Zipdir.
+        In hashmode, their fingerprints are kept together as a dict in the single entry cache_key,
+        so files that leave the group leave no entries behind.
+        """
+        if cache_key in self.recovered:
+            return True
+        tocheck = [p for p in pathnames if self.changed_files is None or os.path.normpath(p) in self.changed_files]
+        previous = self._as_dict(self._previous_value(cache_key))
+        if not self.hashmode:
+            it_is = any(self.is_recent(pathname) for pathname in tocheck)
+            if it_is and previous:
+                self._put(cache_key, "")  # the fingerprints are outdated, a later hashmode run must not use them
+            return it_is
+        fingerprints = {pathname: previous.get(pathname, "") for pathname in pathnames}  # drops removed files
+        it_is = False
+        for pathname in tocheck:
+            old = fingerprints[pathname]
+            fingerprints[pathname] = self._fingerprint(pathname, old)
+            if not old:
+                it_is = it_is or self.is_recent(pathname)
+            elif fingerprints[pathname].rsplit(':', 1)[-1] != old.rsplit(':', 1)[-1]:
+                b.debug(f"cache.group_has_changed({pathname}): content differs")
+                it_is = True
+        if fingerprints != previous:
+            (self._put if it_is else self._refresh)(cache_key, fingerprints)
+        return it_is
 
     def is_recent(self, pathname: str) -> bool:
         """Whether pathname's mtime is larger than the cache's global mtime."""
@@ -162,43 +281,166 @@ class SedrilaCache:
 
     def write_str(self, key: str, value: str):
         assert key not in self.written  # we should write everything only once
-        self.written[key] = value
+        self._put(key, value)
 
     def write_list(self, key: str, value: list[str]):
         assert key not in self.written  # we should write everything only once
-        self.written[key] = value
+        self._put(key, value)
 
     def write_set(self, key: str, value: set[str]):
         assert key not in self.written  # we should write everything only once
-        self.written[key] = value
+        self._put(key, value)
 
     def write_dict(self, key: str, value: b.StrAnyDict):
         assert key not in self.written  # we should write everything only once
-        self.written[key] = value
+        self._put(key, value)
 
-    def close(self):
-        """Bring the persistent cache file up-to-date and close dbm."""
-        converters = {str: self._as_is, list: self._from_list, set: self._from_set, dict: self._from_dict}
-        self.db[self.TIMESTAMP_KEY] = _compress(str(self.timestamp_start))  # update mtime
-        self.write_list(self.DIRTYFILES_KEY, list(self.new_dirtyfiles))
-        for key, value in self.written.items():
-            if value is None:  # should not happen
-                b.debug(f"cache['{key}'] is None")
-                continue
-            converter = converters[type(value)]
-            data = converter(value)
-            self.db[key] = _compress(data)
-        if self.persistent_mode:
-            self.db.__exit__()  # dbm file context manager operation 
+    def commit(self):
+        """
+        Write the pending entries to the backend in a single transaction, 
+        along with the list of keys of this (so far unfinished) run.
+        """
+        with self.lock:
+            unfinished = sorted(self.recovered | self.written.keys())
+            self._commit([self._entry_of(self.UNFINISHED_KEY, unfinished)])
+
+    def close(self, finished=True):
+        """
+        Bring the persistent cache file up-to-date, mark the run as finished, and close it.
+        For an interrupted run, use finished=False.
+        """
+        with self.lock:
+            if finished:
+                self._finish_run()
+            else:
+                self.commit()
+            self.db.close()
+            self.memo.close()
+
+    def finish_run(self):
+        """Mark the run as finished, like close(), but keep the cache open for another run. See start_run()."""
+        with self.lock:
+            self._finish_run()
+            self.memo.commit()
+            self.timestamp_cached = self.timestamp_start
+            self.written = dict()
+            self.previous_values = dict()
+            self.recovered = set()
+            self.previous_dirtyfiles = self.new_dirtyfiles
+            self.new_dirtyfiles = set()
+
+    def start_run(self, changed_files: tg.Optional[set[str]] = None):
+        """
+        Begin another run after the previous one ended with finish_run() or was interrupted.
+        If the caller knows which files may have changed (e.g. from watching them), it can say so
+        in changed_files to save the checking of all others.
+        """
+        with self.lock:
+            self.recovered |= self.written.keys()  # nonempty if the previous run was interrupted
+            self.written = dict()
+            self.previous_values = dict()
+        self.timestamp_start = round(time.time(), 3)
+        self.changed_files = None if changed_files is None else {os.path.normpath(f) for f in changed_files}
 
     def state(self, key: str) -> State:
-        if key in self.written:
+        if key in self.written or key in self.recovered:
             return State.HAS_CHANGED
         elif key in self.db:
             return State.AS_BEFORE
         else:
             return State.MISSING
 
+    @staticmethod
+    def _fingerprint(pathname: str, previous: str) -> str:
+        """
+        'size:mtime_ns:inode:sha256hexdigest' of the file.
+        If size, mtime, and inode equal those in previous, the file is assumed to be unchanged 
+        and previous is returned without reading the file.
+        """
+        st = os.stat(pathname)
+        statpart = f"{st.st_size}:{st.st_mtime_ns}:{st.st_ino}"
+        if previous and previous.rsplit(':', 1)[0] == statpart:
+            return previous
+        with open(pathname, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        return f"{statpart}:{digest}"
+
+    def _previous_value(self, key: str) -> str:
+        """
+        The value of key from the previous run, ignoring what was written in this run,
+        even if commit() has already put that into the backend.
+        Remembered upon the first call, which must come before the first write of key in this run.
+        """
+        with self.lock:
+            if key not in self.previous_values:
+                assert key not in self.written  # callers must ask before they overwrite key
+                self.previous_values[key] = self._stored(key) if key in self.db else ""
+            return self.previous_values[key]
+
+    def _put(self, key: str, value: Cacheable):
+        """Compress value into pending and mark key as written in this run."""
+        if value is None:  # should not happen
+            b.debug(f"cache['{key}'] is None")
+            return
+        entry = self._entry_of(key, value)
+        with self.lock:
+            self.written[key] = entry[1]
+            self._add_pending(entry)
+
+    def _refresh(self, key: str, value: Cacheable):
+        """
+        Like _put(), but for a value that means the same as the present one (e.g. a file fingerprint
+        with new stat data but the same digest), so key does not count as written and stays AS_BEFORE.
+        """
+        entry = self._entry_of(key, value)
+        with self.lock:
+            self._add_pending(entry)
+
+    def _add_pending(self, entry: Entry):
+        """Put entry into pending; commit() if much is pending or the last commit() is old. Caller must hold lock."""
+        previous = self.pending.get(entry[0])
+        self.pending_size += len(entry[3]) - (len(previous[3]) if previous else 0)
+        self.pending[entry[0]] = entry
+        if (self.pending_size > self.PENDING_LIMIT or 
+                time.time() - self.last_commit > self.COMMIT_INTERVAL):
+            self.commit()
+
+    def _finish_run(self):
+        """Commit everything, including the items that mark the run as finished. Caller must hold lock."""
+        self.write_list(self.DIRTYFILES_KEY, list(self.new_dirtyfiles))
+        self._commit([self._entry_of(self.TIMESTAMP_KEY, str(self.timestamp_start)),  # update mtime
+                      self._entry_of(self.UNFINISHED_KEY, [])])
+
+    def _commit(self, entries: list[Entry]):
+        """Write pending plus entries to the backend. Caller must hold lock."""
+        pending = list(self.pending.values())
+        self.db.write(pending + entries)  # before clearing pending, so concurrent readers find each entry 
+        self.pending = dict()
+        self.pending_size = 0
+        self.last_commit = time.time()
+        b.debug(f"cache: committed {len(pending)} entries")
+
+    def _stored(self, key: str) -> str:
+        """The value of key in the backend. Empty values (e.g. file entries outside hashmode) need no query."""
+        return "" if self.db.digest(key) == self.digest_of("") else self.db.get(key)
+
+    def _value(self, key: str) -> str:
+        """The decompressed value written in this run."""
+        entry = self.pending.get(key)
+        return _decompress(entry[3]) if entry else self.db.get(key)
+
+    def _entry_of(self, key: str, value: Cacheable) -> Entry:
+        typename, digest, data = self._serialize(value)
+        return key, typename, digest, _compress(data)
+
+    def _serialize(self, value: Cacheable) -> tuple[str, str, str]:
+        """typename, digest, and string representation of value."""
+        typename = type(value).__name__
+        data = getattr(self, self.WRITERS[typename])(value)
+        canonical = json.dumps(value, sort_keys=True) if typename == 'dict' else data  # ignore key order
+        digest = hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+        return typename, digest, data
+
     @staticmethod
     def _as_is(e: str) -> str:
         return e
@@ -217,7 +459,7 @@ class SedrilaCache:
         return self.LIST_SEPARATOR.join(e)
 
     def _from_set(self, e: set[str]) -> str:
-        return self.LIST_SEPARATOR.join(e)
+        return self.LIST_SEPARATOR.join(sorted(e))  # canonical, for the digest
 
     @staticmethod
     def _from_dict(e: b.StrAnyDict) -> str:
@@ -226,21 +468,198 @@ class SedrilaCache:
     def _entry(self, key: str, converter: tg.Callable[[str], CacheEntryType]) -> tuple[CacheEntryType, State]:
         """The only internal cache accessor function"""
         if key in self.written:
-            return (self.written[key], State.HAS_CHANGED)
+            return (converter(self._value(key)), State.HAS_CHANGED)
+        elif key in self.recovered:
+            return (converter(self._stored(key)), State.HAS_CHANGED)
         elif key in self.db:
-            return (converter(_decompress(self.db[key])), State.AS_BEFORE)
+            return (converter(self._stored(key)), State.AS_BEFORE)
         else:
             return (converter(None), State.MISSING)
 
     def _dump(self, limit: int):
         keys = sorted(self.db.keys())
         for key in keys:
-            value = _decompress(self.db[key])
-            print(f"{key}:\t{value[:limit]}")
+            value = self.db.get(key)
+            print(f"{key}:\t{self.db.typename(key)}\t{value[:limit]}")
+
+    READERS = dict(str='_as_is', list='_as_list', set='_as_set', dict='_as_dict')  # typename -> converter method
+    WRITERS = dict(str='_as_is', list='_from_list', set='_from_set', dict='_from_dict')  # ditto, for writing
+
 
-    def _storefilelist(self, key: str, samefiles: list[str], newfiles: list[str]):
-        thelist = self.LIST_SEPARATOR.join(itertools.chain(samefiles, newfiles))
-        self.db[key] = thelist
+class SqliteBackend:
+    """
+    Default cache backend: a single SQLite file in WAL mode, which is portable across machines.
+    Each entry is a row (key, type, digest, value) with the compressed value.
+    The index of keys, types, and digests is read at opening time, so presence checks and
+    digest comparisons need no query.
+    Values are read individually upon access or in one query per batch via prefetch().
+    Each write() is a single transaction.
+    The threads of Directory.build() share the connection for reads and (via SedrilaCache.commit()) writes,
+    so each use of it holds lock.
+    A file in a different format (e.g. from an older sedrila or from dbm) gets replaced.
+    """
+    FORMAT_VERSION = 2  # kept in PRAGMA user_version
+    BATCHSIZE = 500  # keys per prefetch query, well below SQLite's limit for '?' parameters
+
+    conn: sqlite3.Connection
+    lock: threading.Lock  # serializes the uses of conn
+    index: dict[str, tuple[str, str]]  # key -> (typename, digest) of all entries
+    prefetched: dict[str, bytes]  # key -> compressed value
+
+    def __init__(self, filename: str, start_clean: bool):
+        if start_clean:
+            remove_cachefiles(filename)
+        try:
+            self._open(filename)
+        except sqlite3.DatabaseError as exc:
+            b.debug(f"cache file '{filename}' is unusable ({exc}), starting afresh")
+            remove_cachefiles(filename)
+            self._open(filename)
+        self.lock = threading.Lock()
+        self.prefetched = dict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def get(self, key: str) -> str:
+        with self.lock:
+            data = self.prefetched.pop(key, None)
+            if data is None:
+                data = self.conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()[0]
+        return _decompress(data)
+
+    def typename(self, key: str) -> str:
+        return self.index[key][0]
+
+    def digest(self, key: str) -> str:
+        return self.index[key][1]
+
+    def keys(self) -> tg.Iterable[str]:
+        return self.index.keys()
+
+    def prefetch(self, keys: list[str]):
+        with self.lock:
+            keys = [key for key in keys if key in self.index and key not in self.prefetched]
+            for start in range(0, len(keys), self.BATCHSIZE):
+                batch = keys[start:start+self.BATCHSIZE]
+                placeholders = ",".join("?" * len(batch))
+                query = f"SELECT key, value FROM entries WHERE key IN ({placeholders})"
+                self.prefetched.update(self.conn.execute(query, batch))
+
+    def write(self, entries: list[Entry]):
+        with self.lock:
+            with self.conn:  # one transaction
+                self.conn.executemany("INSERT OR REPLACE INTO entries (key, type, digest, value) "
+                                      "VALUES (?, ?, ?, ?)", entries)
+            for key, typename, digest, data in entries:
+                self.index[key] = (typename, digest)
+                self.prefetched.pop(key, None)  # now outdated
+
+    def close(self):
+        with self.lock:
+            self.conn.close()  # the last connection to close also merges the WAL into the main file
+
+    def _open(self, filename: str):
+        self.conn = sqlite3.connect(filename, check_same_thread=False)  # threads use it under self.lock
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]  # fails for non-SQLite files
+        if version != self.FORMAT_VERSION:
+            with self.conn:
+                self.conn.execute("DROP TABLE IF EXISTS entries")
+                self.conn.execute("CREATE TABLE entries (key TEXT PRIMARY KEY, type TEXT NOT NULL, "
+                                  "digest TEXT NOT NULL, value BLOB NOT NULL) WITHOUT ROWID")
+                self.conn.execute(f"PRAGMA user_version = {self.FORMAT_VERSION}")
+        self.conn.execute("PRAGMA journal_mode = WAL")  # readers do not block the writer and vice versa
+        self.conn.execute("PRAGMA synchronous = NORMAL")  # safe in WAL mode
+        self.index = {key: (typename, digest) 
+                      for key, typename, digest in self.conn.execute("SELECT key, type, digest FROM entries")}
+
+
+class DbmBackend:
+    """
+    Cache backend based on whatever dbm implementation the system has; files are not portable.
+    The typename and digest are stored in front of the value, each followed by TYPE_SEPARATOR.
+    Like SqliteBackend, it is used by several threads, so each access to db holds lock.
+    """
+    TYPE_SEPARATOR = b':'
+
+    def __init__(self, filename: str, start_clean: bool):
+        self.db = dbm.open(filename, flag='n' if start_clean else 'c')  # open or create dbm file
+        self.lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            return key in self.db
+
+    def get(self, key: str) -> str:
+        return _decompress(self._split(key)[2])
+
+    def typename(self, key: str) -> str:
+        return self._split(key)[0]
+
+    def digest(self, key: str) -> str:
+        return self._split(key)[1]
+
+    def keys(self) -> tg.Iterable[str]:
+        with self.lock:
+            return [key.decode() for key in self.db.keys()]
+
+    def prefetch(self, keys: list[str]):
+        pass  # dbm has no bulk access
+
+    def write(self, entries: list[Entry]):
+        sep = self.TYPE_SEPARATOR
+        with self.lock:
+            for key, typename, digest, data in entries:
+                self.db[key] = typename.encode() + sep + digest.encode() + sep + data
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _split(self, key: str) -> tuple[str, str, bytes]:
+        with self.lock:
+            stored = self.db[key]
+        typename, digest, data = stored.split(self.TYPE_SEPARATOR, 2)
+        return typename.decode(), digest.decode(), data
+
+
+class DictBackend:
+    """Non-persistent cache backend."""
+    def __init__(self):
+        self.entries: dict[str, Entry] = dict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def get(self, key: str) -> str:
+        return _decompress(self.entries[key][3])
+
+    def typename(self, key: str) -> str:
+        return self.entries[key][1]
+
+    def digest(self, key: str) -> str:
+        return self.entries[key][2]
+
+    def keys(self) -> tg.Iterable[str]:
+        return self.entries.keys()
+
+    def prefetch(self, keys: list[str]):
+        pass  # everything is in memory anyway
+
+    def write(self, entries: list[Entry]):
+        self.entries.update((entry[0], entry) for entry in entries)
+
+    def close(self):
+        pass
+
+
+def remove_cachefiles(cache_filename: str):
+    """Delete the cache file and its companion files (of SQLite or dbm) and directories."""
+    for path in glob.glob(f"{glob.escape(cache_filename)}*"):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
 
 
 def _compress(s: str) -> bytes:
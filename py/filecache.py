@@ -0,0 +1,111 @@
+"""
+Cache of the files that a build reads over and over, e.g. include files used by many pages:
+their metadata, their contents, and values derived from their contents.
+Metadata is valid for one build (see new_build()); contents and derived values are valid
+as long as the file's mtime and size stay the same, so they survive across builds in one process.
+"""
+import os
+import threading
+import typing as tg
+
+import base as b
+
+Stats = tuple[int, int]  # hits, misses
+
+
+class FileCache:
+    stats: dict[str, os.stat_result | None]  # normpath -> stat result (None: does not exist), for this build
+    values: dict[tuple[str, str], tuple[int, int, tg.Any]]  # (what, normpath) -> mtime_ns, size, value
+    hits: int  # number of lookups answered from the cache
+    misses: int  # number of lookups that needed the file system
+
+    def __init__(self):
+        self.stats = dict()
+        self.values = dict()
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def new_build(self):
+        """Forget the metadata (files may have changed since the previous build) and the statistics."""
+        with self.lock:
+            self.stats = dict()
+            self.hits = self.misses = 0
+
+    def stat(self, path: str) -> os.stat_result | None:
+        """os.stat(path), or None if there is no such file."""
+        result, was_known = self._stat(path)
+        with self.lock:
+            if was_known:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return result
+
+    def exists(self, path: str) -> bool:
+        return self.stat(path) is not None
+
+    def read(self, path: str) -> str:
+        """The contents of the text file path, as by b.slurp()."""
+        return self.derived(path, 'text', b.slurp)
+
+    def derived(self, path: str, what: str, func: tg.Callable[[str], tg.Any]) -> tg.Any:
+        """
+        func(path), computed anew only if the file has changed. what names the kind of func.
+        Counts as one lookup, whether or not the stat result was known already.
+        """
+        stat, _ = self._stat(path)
+        if stat is None:
+            return func(path)  # which will report the problem
+        key = (what, os.path.normpath(path))
+        with self.lock:
+            entry = self.values.get(key)
+            if entry and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        value = func(path)
+        with self.lock:
+            self.values[key] = (stat.st_mtime_ns, stat.st_size, value)
+        return value
+
+    def _stat(self, path: str) -> tuple[os.stat_result | None, bool]:
+        """stat(path) without counting the lookup, and whether the result was known already."""
+        path = os.path.normpath(path)
+        self._check_process()
+        with self.lock:
+            if path in self.stats:
+                return self.stats[path], True
+        try:
+            result = os.stat(path)
+        except OSError:
+            result = None
+        with self.lock:
+            self.stats[path] = result
+        return result, False
+
+    def take_stats(self) -> Stats:
+        """In a worker process: the statistics for the owner's add_stats(), as collected since the previous call."""
+        self._check_process()
+        with self.lock:
+            stats = (self.hits, self.misses)
+            self.hits = self.misses = 0
+            return stats
+
+    def add_stats(self, stats: Stats):
+        """Take over the statistics of a worker process."""
+        with self.lock:
+            self.hits += stats[0]
+            self.misses += stats[1]
+
+    def _check_process(self):
+        """In a freshly forked worker process, start with statistics of its own."""
+        if os.getpid() != self.pid:
+            self.lock = threading.Lock()  # the owner's may have been held by another thread at fork time
+            self.pid = os.getpid()
+            self.hits = self.misses = 0
+
+    def hitrate_msg(self) -> str:
+        lookups = self.hits + self.misses
+        percent = f" ({100 * self.hits / lookups:.0f}%)" if lookups else ""
+        return f"file cache: {self.hits} of {lookups} lookup{b.plural_s(lookups)} hit{percent}"
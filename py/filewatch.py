@@ -0,0 +1,175 @@
+"""
+Watch directory trees and single files for changes: via inotify on Linux, via polling elsewhere.
+Use make_watcher(); its wait() blocks until something changes and reports what.
+"""
+import contextlib
+import ctypes
+import ctypes.util
+import dataclasses
+import os
+import select
+import struct
+import time
+import typing as tg
+
+import base as b
+
+
+@dataclasses.dataclass
+class Changes:
+    """What happened to the watched files since the previous wait(). Paths are normalized."""
+    modified: set[str] = dataclasses.field(default_factory=set)  # files whose content was written
+    added: set[str] = dataclasses.field(default_factory=set)  # files that appeared, also via rename
+    removed: set[str] = dataclasses.field(default_factory=set)  # files that disappeared, also via rename
+    dirs: set[str] = dataclasses.field(default_factory=set)  # directories that appeared or disappeared
+    overflow: bool = False  # changes were lost, anything may have happened
+
+    def __bool__(self) -> bool:
+        return bool(self.modified or self.added or self.removed or self.dirs or self.overflow)
+
+    @property
+    def files(self) -> set[str]:
+        return self.modified | self.added | self.removed
+
+
+class InotifyWatcher:
+    """Watcher based on the Linux inotify API, called via ctypes. Raises OSError where unavailable."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_FORMAT = "iIII"  # struct inotify_event: wd, mask, cookie, len; name follows
+    EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+    QUIET_PERIOD = 0.1  # seconds without further events that end a burst of changes
+
+    fd: int
+    dirs: dict[int, str]  # watch descriptor -> directory path
+    treedirs: set[str]  # directories watched as part of a tree
+    files: set[str]  # single files to watch; events for their siblings are ignored
+
+    def __init__(self, roots: tg.Iterable[str], files: tg.Iterable[str] = ()):
+        libcname = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libcname, use_errno=True) if libcname else None
+        if not self.libc or not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = dict()
+        self.treedirs = set()
+        self.files = {os.path.normpath(f) for f in files}
+        for root in roots:
+            self._add_tree(os.path.normpath(root))
+        for singledir in {os.path.dirname(f) or "." for f in self.files}:
+            self._add_dir(singledir)
+
+    def wait(self, timeout: tg.Optional[float] = None) -> Changes:
+        """Block until changes occur (or timeout seconds have passed) and return them."""
+        changes = Changes()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        while readable:
+            self._read_events(changes)
+            readable, _, _ = select.select([self.fd], [], [], self.QUIET_PERIOD)
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+    def _add_tree(self, root: str):
+        for dirpath, dirnames, filenames in os.walk(root):
+            self._add_dir(dirpath)
+            self.treedirs.add(dirpath)
+
+    def _add_dir(self, path: str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            b.debug(f"cannot watch '{path}': {os.strerror(ctypes.get_errno())}")
+            return
+        self.dirs[wd] = path
+
+    def _read_events(self, changes: Changes):
+        buffer = os.read(self.fd, 64 * 1024)
+        pos = 0
+        while pos < len(buffer):
+            wd, mask, cookie, namelen = struct.unpack_from(self.EVENT_FORMAT, buffer, pos)
+            name = os.fsdecode(buffer[pos + self.EVENT_SIZE:pos + self.EVENT_SIZE + namelen].rstrip(b"\0"))
+            pos += self.EVENT_SIZE + namelen
+            if mask & self.IN_Q_OVERFLOW:
+                changes.overflow = True
+                continue
+            if wd not in self.dirs:
+                continue  # watch was removed with its directory
+            path = os.path.normpath(os.path.join(self.dirs[wd], name))
+            if self.dirs[wd] not in self.treedirs and path not in self.files:
+                continue  # a sibling of a watched single file
+            if mask & self.IN_ISDIR:
+                changes.dirs.add(path)
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self._add_tree(path)
+            elif mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                changes.added.add(path)
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                changes.removed.add(path)
+            elif mask & self.IN_CLOSE_WRITE:
+                changes.modified.add(path)
+
+
+class PollingWatcher:
+    """Watcher that compares snapshots of modification times every INTERVAL seconds."""
+    INTERVAL = 0.5  # seconds
+
+    snapshot: dict[str, int]  # path -> mtime_ns
+    dirnames: set[str]  # all directories below the roots
+
+    def __init__(self, roots: tg.Iterable[str], files: tg.Iterable[str] = ()):
+        self.roots = [os.path.normpath(root) for root in roots]
+        self.files = {os.path.normpath(f) for f in files}
+        self.snapshot, self.dirnames = self._take_snapshot()
+
+    def wait(self, timeout: tg.Optional[float] = None) -> Changes:
+        """Block until changes occur (or timeout seconds have passed) and return them."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            snapshot, dirnames = self._take_snapshot()
+            changes = Changes(
+                modified={path for path, mtime in snapshot.items()
+                          if path in self.snapshot and self.snapshot[path] != mtime},
+                added=snapshot.keys() - self.snapshot.keys(),
+                removed=self.snapshot.keys() - snapshot.keys(),
+                dirs=dirnames ^ self.dirnames)
+            self.snapshot, self.dirnames = snapshot, dirnames
+            if changes or (deadline is not None and time.time() >= deadline):
+                return changes
+            time.sleep(self.INTERVAL if deadline is None else min(self.INTERVAL, max(deadline - time.time(), 0)))
+
+    def close(self):
+        pass
+
+    def _take_snapshot(self) -> tuple[dict[str, int], set[str]]:
+        snapshot = dict()
+        dirnames = set()
+        for root in self.roots:
+            for dirpath, subdirs, filenames in os.walk(root):
+                dirnames.update(os.path.join(dirpath, subdir) for subdir in subdirs)
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    with contextlib.suppress(OSError):  # file may vanish meanwhile
+                        snapshot[path] = os.stat(path).st_mtime_ns
+        for path in self.files:
+            if os.path.exists(path):
+                snapshot[path] = os.stat(path).st_mtime_ns
+        return snapshot, dirnames
+
+
+def make_watcher(roots: tg.Iterable[str], files: tg.Iterable[str] = ()) -> InotifyWatcher | PollingWatcher:
+    """Watcher for the directory trees roots and the single files."""
+    roots = [root for root in roots if os.path.isdir(root)]
+    try:
+        return InotifyWatcher(roots, files)
+    except OSError as exc:
+        b.debug(f"filewatch: {exc}, polling instead")
+        return PollingWatcher(roots, files)
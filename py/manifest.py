@@ -0,0 +1,88 @@
+"""
+Manifest of a directory tree: for each file its size, content hash, and the producer that wrote it.
+A build keeps one up to date incrementally; comparing two manifests yields what a deployment must transfer.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import threading
+
+import base as b
+
+
+@dataclasses.dataclass
+class Entry:
+    size: int
+    sha256: str  # hex digest of the content
+    producer: str  # what wrote the file, e.g. 'Taskbuilder:task112'
+    mtime_ns: int = 0  # for recognizing files that nobody has touched since the Entry was made
+
+    @classmethod
+    def of_bytes(cls, path: str, data: bytes, producer: str) -> 'Entry':
+        """Entry for the file at path that has just been (or already was) written with content data."""
+        return cls(len(data), hashlib.sha256(data).hexdigest(), producer, os.stat(path).st_mtime_ns)
+
+    @classmethod
+    def of_file(cls, path: str, producer: str) -> 'Entry':
+        with open(path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        stat = os.stat(path)
+        return cls(stat.st_size, digest, producer, stat.st_mtime_ns)
+
+    def is_current_for(self, path: str) -> bool:
+        """Whether the file at path still has the size and mtime it had when self was made."""
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime_ns) == (self.size, self.mtime_ns)
+
+
+@dataclasses.dataclass
+class Delta:
+    added: list[str]
+    changed: list[str]
+    deleted: list[str]
+
+    def lines(self) -> list[str]:
+        """In the style of 'git diff --name-status': status letter, TAB, path."""
+        return ([f"A\t{path}" for path in self.added] + [f"M\t{path}" for path in self.changed] +
+                [f"D\t{path}" for path in self.deleted])
+
+
+class Manifest:
+    """Maps paths (relative to the manifest's directory tree, with '/' separators) to Entries."""
+    FORMAT_VERSION = 1
+    entries: dict[str, Entry]
+
+    def __init__(self, entries: dict[str, Entry] | None = None):
+        self.entries = entries or dict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def read(cls, filename: str) -> 'Manifest':
+        """The manifest stored in filename; empty if there is none or it is not readable."""
+        if not os.path.exists(filename):
+            return cls()
+        try:
+            data = b.slurp_json(filename)
+            if data.get('format') != cls.FORMAT_VERSION:
+                raise ValueError(f"unknown format {data.get('format')}")
+            return cls({path: Entry(**entry) for path, entry in data['files'].items()})
+        except (ValueError, KeyError, TypeError) as exc:
+            b.warning(f"ignoring unreadable manifest: {exc}", file=filename)
+            return cls()
+
+    def write(self, filename: str):
+        files = {path: dataclasses.asdict(self.entries[path]) for path in sorted(self.entries)}
+        b.spit_if_changed(filename, json.dumps(dict(format=self.FORMAT_VERSION, files=files), indent=1))
+
+    def put(self, path: str, entry: Entry):
+        """Threadsafe."""
+        with self.lock:
+            self.entries[path] = entry
+
+    def delta_since(self, old: 'Manifest') -> Delta:
+        """What has happened to the files between old and self."""
+        return Delta(added=sorted(path for path in self.entries if path not in old.entries),
+                     changed=sorted(path for path, entry in self.entries.items()
+                                    if path in old.entries and old.entries[path].sha256 != entry.sha256),
+                     deleted=sorted(path for path in old.entries if path not in self.entries))
@@ -0,0 +1,149 @@
+"""
+Persistent memo of derived values, keyed by a digest of everything they derive from,
+e.g. the HTML of a Markdown block keyed by the block's text.
+Since a key always stands for the same value, entries never become outdated and need no invalidation;
+an entry that has not been used for MAX_AGE seconds gets removed by commit(), so the file stays small.
+Worker processes forked from the process that owns a Memo can use it, too:
+they read through a connection of their own and hand their new entries and hits
+over to the owner (see take_news(), add_news()), which alone writes the file.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import base as b
+
+News = tuple[dict[str, str], set[str], int, int]  # new entries, keys of entries used, hitcount, misscount
+
+
+def key_of(*parts: str) -> str:
+    """Memo key for a value that derives from parts (and nothing else)."""
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\x00")  # so that ('ab', 'c') and ('a', 'bc') differ
+    return digest.hexdigest()
+
+
+class Memo:
+    FORMAT_VERSION = 1  # kept in PRAGMA user_version
+    MAX_AGE = 60 * 24 * 3600  # seconds
+
+    filename: str  # "" for a non-persistent Memo
+    pending: dict[str, str]  # key -> value, not yet in the file
+    hits: set[str]  # keys of entries from the file used since the last commit()
+    hitcount: int  # number of successful get() calls
+    misscount: int  # number of unsuccessful get() calls
+
+    def __init__(self, filename: str, start_clean=False):
+        self.filename = filename
+        self.pending = dict()
+        self.inherited = dict()  # in a worker process: the owner's pending entries at fork time
+        self.hits = set()
+        self.hitcount = self.misscount = 0
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.conn = None
+        if filename and start_clean:
+            self._remove_files()
+        if filename:
+            try:
+                self.conn = self._connect()
+            except sqlite3.DatabaseError as exc:
+                b.debug(f"memo file '{filename}' is unusable ({exc}), starting afresh")
+                self._remove_files()
+                self.conn = self._connect()
+
+    def get(self, key: str) -> str | None:
+        """The value stored for key, or None."""
+        if os.getpid() != self.pid:
+            self._become_worker()
+        with self.lock:
+            value = self.pending.get(key, self.inherited.get(key))
+            if value is None and self.conn:
+                row = self.conn.execute("SELECT value FROM memo WHERE key = ?", (key,)).fetchone()
+                if row:
+                    value = zlib.decompress(row[0]).decode()
+                    self.hits.add(key)
+            if value is None:
+                self.misscount += 1
+            else:
+                self.hitcount += 1
+            return value
+
+    def put(self, key: str, value: str):
+        with self.lock:
+            self.pending[key] = value
+
+    def take_news(self) -> News:
+        """In a worker process: what the owner must add_news() about, as collected since the previous call."""
+        if os.getpid() != self.pid:
+            self._become_worker()
+        with self.lock:
+            news = (self.pending, self.hits, self.hitcount, self.misscount)
+            self.pending, self.hits = dict(), set()
+            self.hitcount = self.misscount = 0
+            return news
+
+    def add_news(self, news: News):
+        """Take over what a worker process has found."""
+        entries, hits, hitcount, misscount = news
+        with self.lock:
+            self.pending.update(entries)
+            self.hits |= hits
+            self.hitcount += hitcount
+            self.misscount += misscount
+
+    def commit(self):
+        """
+        Write the pending entries, note the use of the others, remove those unused for too long.
+        Resets the statistics.
+        """
+        self.hitcount = self.misscount = 0
+        if not self.conn or os.getpid() != self.pid or not (self.pending or self.hits):
+            return
+        now = time.time()
+        with self.lock, self.conn:  # one transaction
+            self.conn.executemany("INSERT OR REPLACE INTO memo (key, value, used) VALUES (?, ?, ?)",
+                                  ((key, zlib.compress(value.encode()), now) for key, value in self.pending.items()))
+            self.conn.executemany("UPDATE memo SET used = ? WHERE key = ?", ((now, key) for key in self.hits))
+            self.conn.execute("DELETE FROM memo WHERE used < ?", (now - self.MAX_AGE,))
+            self.pending, self.hits = dict(), set()
+
+    def close(self):
+        self.commit()
+        if self.conn and os.getpid() == self.pid:
+            self.conn.close()
+            self.conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.filename, check_same_thread=False)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]  # fails for non-SQLite files
+        if version != self.FORMAT_VERSION:
+            with conn:
+                conn.execute("DROP TABLE IF EXISTS memo")
+                conn.execute("CREATE TABLE memo (key TEXT PRIMARY KEY, value BLOB NOT NULL, used REAL NOT NULL)"
+                             " WITHOUT ROWID")
+                conn.execute(f"PRAGMA user_version = {self.FORMAT_VERSION}")
+        conn.execute("PRAGMA journal_mode = WAL")  # workers can read while the owner writes
+        conn.execute("PRAGMA synchronous = NORMAL")  # safe in WAL mode
+        return conn
+
+    def _remove_files(self):
+        for path in (self.filename, self.filename + "-wal", self.filename + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _become_worker(self):
+        """Called in a freshly forked worker process: stop using the owner's state."""
+        self.lock = threading.Lock()  # the owner's may have been held by another thread at fork time
+        self.pid = os.getpid()
+        self.inherited = self.pending | self.inherited
+        self.pending, self.hits = dict(), set()
+        self.hitcount = self.misscount = 0
+        self.inherited_conn = self.conn  # keep it referenced, so it does not get closed from here
+        if self.filename:
+            self.conn = sqlite3.connect(self.filename, check_same_thread=False)
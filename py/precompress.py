@@ -0,0 +1,103 @@
+"""
+Precompressed siblings (page.html.gz, page.html.br) for the text files of a static website,
+so that the web server can deliver compressed files without compressing on the fly.
+Brotli is used only if the optional 'brotli' package is installed.
+By default, both compress at moderate levels that are fast; best=True gets the smallest files,
+but brotli's highest quality is about a hundred times slower.
+"""
+import concurrent.futures
+import functools
+import gzip
+import os
+import typing as tg
+
+import base as b
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIMETYPES = {  # suffix -> MIME type, for the text files that get compressed
+    '.css': "text/css",
+    '.html': "text/html",
+    '.js': "text/javascript",
+    '.json': "application/json",
+    '.md': "text/markdown",
+    '.svg': "image/svg+xml",
+    '.txt': "text/plain",
+}
+ENCODINGS = {'.br': "br", '.gz': "gzip"}  # sibling suffix -> HTTP Content-Encoding, in order of preference
+LEVELS = {False: {'.br': 5, '.gz': 6}, True: {'.br': 11, '.gz': 9}}  # best -> sibling suffix -> level/quality
+
+
+def compressors(best=False) -> dict[str, tg.Callable[[bytes], bytes]]:
+    """Sibling suffix -> compression function, for the compressions available here."""
+    levels = LEVELS[best]
+    result = dict()
+    if brotli:
+        result['.br'] = lambda data: brotli.compress(data, quality=levels['.br'])
+    result['.gz'] = lambda data: gzip.compress(data, compresslevel=levels['.gz'], mtime=0)  # same data, same bytes
+    return result
+
+
+def compress_tree(topdir: str, is_included: tg.Callable[[str], bool], jobs=1, best=False) -> int:
+    """
+    Give each text file in topdir a sibling per available compression, unless it has an up-to-date one.
+    is_included(name) filters the names of files and directories to consider.
+    best selects the slow, strongest compression (see LEVELS) for the siblings written now.
+    Returns the number of files compressed.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(topdir):
+        dirnames[:] = filter(is_included, dirnames)
+        paths.extend(os.path.join(dirpath, filename) for filename in filter(is_included, filenames)
+                     if os.path.splitext(filename)[1] in MIMETYPES)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:  # zlib and brotli release the GIL
+        return sum(executor.map(functools.partial(compress_file, best=best), paths))
+
+
+def compress_file(path: str, best=False) -> bool:
+    """
+    Write the siblings of path that are missing or outdated. Returns whether there were any.
+    Siblings get the mtime of their source file, so a different mtime means the source has changed.
+    """
+    stat = os.stat(path)
+    def is_current(sibling: str) -> bool:
+        return os.path.exists(sibling) and os.stat(sibling).st_mtime_ns == stat.st_mtime_ns
+
+    todo = {suffix: compress for suffix, compress in compressors(best).items() if not is_current(path + suffix)}
+    if not todo:
+        return False
+    data = b.slurp_bytes(path)
+    for suffix, compress in todo.items():
+        sibling = path + suffix
+        b.spit_if_changed(sibling, compress(data))
+        os.utime(sibling, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return True
+
+
+def htaccess_rules() -> str:
+    """Apache httpd configuration for delivering the siblings to clients that accept them."""
+    suffixes = "|".join(suffix[1:] for suffix in MIMETYPES)
+    lines = ["# deliver the precompressed files written by 'sedrila author build --compress':",
+             "<IfModule mod_rewrite.c>",
+             "  RewriteEngine On"]
+    for suffix, encoding in ENCODINGS.items():
+        lines += [f'  RewriteCond "%{{HTTP:Accept-Encoding}}" "{encoding}"',
+                  f'  RewriteCond "%{{REQUEST_FILENAME}}{suffix}" -s',
+                  f'  RewriteRule "^(.+)\\.({suffixes})$" "$1.$2{suffix}" [L]']
+    for suffix, mimetype in MIMETYPES.items():
+        lines.append(f'  RewriteRule "\\{suffix}\\.(br|gz)$" "-" [T={mimetype},E=no-gzip:1,E=no-brotli:1]')
+    lines += ["</IfModule>",
+              "<IfModule mod_headers.c>",
+              f'  <FilesMatch "\\.({suffixes})$">',
+              "    Header append Vary Accept-Encoding",
+              "  </FilesMatch>"]
+    for suffix, encoding in ENCODINGS.items():
+        lines += [f'  <FilesMatch "\\.({suffixes})\\{suffix}$">',
+                  f"    Header set Content-Encoding {encoding}",
+                  "    Header append Vary Accept-Encoding",
+                  "  </FilesMatch>"]
+    lines.append("</IfModule>")
+    return "\n".join(lines) + "\n"
@@ -4,6 +4,8 @@ AUTHOR_CONFIG_FILENAME = "sedrila.yaml"  # at top-level of source dir
 AUTHOR_GLOSSARY_BASENAME = "glossary"  # .md at top-level of chapterdir, .html in build directory
 AUTHOR_OUTPUT_INSTRUCTORS_DEFAULT_SUBDIR = "instructor"
 CACHE_FILENAME = ".sedrila_cache"  # author: in instructor target dir
+TEMPLATECACHE_DIRNAME = CACHE_FILENAME + "-templates"  # author: Jinja2 bytecode, next to CACHE_FILENAME
+MANIFEST_FILENAME = CACHE_FILENAME + "-manifest.json"  # author: of the build directory, next to CACHE_FILENAME
 EDITOR_CMD_DEFAULT = "/usr/bin/nano"
 EVENTCACHE_FILENAME = ".sedrila_events"  # evaluator: in respos_dir
 HTML_DIFFICULTY_SIGN = "&#x26ab;&#xfe0e;"  # &#x26ab; is an icon and always black, &#xfe0e; is the text-variant selector
@@ -31,3 +33,4 @@ SUBMISSION_STATE_FRESH = "FRESH"  # last commit indicates new submission
 SUBMISSION_STATE_CHECKING = "CHECKING"  # SUBMISSION_FILE modified, but not commited
 SUBMISSION_STATE_CHECKED = "CHECKED"  # last commit indicates checked submission
 SUBMISSION_STATE_OTHER = "OTHER"  # none of the above
+TOCSCRIPT_FILE = "toc.js"  # author: at top-level of build directory, with 'author build --shared-toc'
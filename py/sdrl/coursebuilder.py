@@ -6,6 +6,7 @@ import csv
 import functools
 import glob
 import graphlib
+import hashlib
 import importlib.resources
 import itertools
 import json
@@ -14,15 +15,19 @@ import os
 import re
 import typing as tg
 
+import jinja2
 import jsonschema
 
 import base as b
+import filecache
 import mycrypt
+import sdrl.argparser
 import sdrl.constants as c
 import sdrl.elements as el
 import sdrl.glossary as glossary
 import sdrl.html as h
 import sdrl.macros as macros
+import sdrl.markdown
 import sdrl.partbuilder
 from sdrl.course import Task, Taskgroup, Chapter, Course
 
@@ -238,6 +243,10 @@ class Taskgroupbuilder(sdrl.partbuilder.PartbuilderMixin, Taskgroup):
         diagram = self.directory.get_the(el.TaskgroupDiagram, self.name)
         return diagram.svg_style
 
+    def my_prerequisites(self) -> tg.Iterable[el.Element]:
+        diagram = self.directory.get_the(el.TaskgroupDiagram, self.name)  # diagram_style reads its file
+        return itertools.chain(super().my_prerequisites(), [diagram])
+
     @property
     def to_be_skipped(self) -> bool:
         return self.skipthis or self.chapter.to_be_skipped
@@ -314,13 +323,19 @@ class Coursebuilder(sdrl.partbuilder.PartbuilderMixin, Course):
     templatedir: str = f"{sedrila_libdir}/templates"
     htaccess_template: str = None  # structure of .htaccess file generated in instructor website
     stages: list[str]  # list of allowed values of stage in parts
+    fingerprint: bool = False  # copy baseresources also under content-hash names and refer to those
+    shared_toc: bool = False  # pages load the toc from TOCSCRIPT_FILE instead of embedding it
 
     course: 'Coursebuilder'
     chapters: list['Chapterbuilder']
     include_stage_index: int  # index in stages list, or len(stages) if include_stage is ""
     mtime: float  # in READ cache mode: tasks have changed if they are younger than this
     taskorder: list[Taskbuilder]  # If task B assumes or requires A, A will be before B in this list.
+    structureindex: sdrl.partbuilder.Structureindex  # for the tocs, set along with taskorder
     glossary: glossary.Glossary
+    templates: jinja2.Environment | None = None  # shared by all pages, created by template()
+    resources: 'Resourcenames'  # how pages refer to the baseresources
+    files: filecache.FileCache  # for the files that macros include or refer to
 
     def __init__(self, *, configfile: str, **kwargs):
         import datetime as dt
@@ -335,8 +350,11 @@ class Coursebuilder(sdrl.partbuilder.PartbuilderMixin, Course):
             if isinstance(self.configdict.get(key), dt.date):
                 self.configdict[key] = self.configdict[key].isoformat()
         super().__init__(**kwargs)
+        self.files = filecache.FileCache()
+        sdrl.markdown.md.course = self
         self.parttype = dict(Chapter=Chapterbuilder, Taskgroup=Taskgroupbuilder, Task=Taskbuilder)
         self._read_config(self.configdict)
+        self._make_configelements()
         self._init_parts(self.configdict, self.include_stage)
 
     @property
@@ -360,6 +378,15 @@ class Coursebuilder(sdrl.partbuilder.PartbuilderMixin, Course):
     def toc(self) -> str:
         return sdrl.partbuilder.toc(self)
 
+    def template(self, templatename: str) -> jinja2.Template:
+        """The compiled template; all pages share one Environment and its bytecode cache."""
+        if self.templates is None:
+            self.templates = sdrl.partbuilder.template_environment(
+                self.templatedir, os.path.join(self.targetdir_i, c.TEMPLATECACHE_DIRNAME))
+            self.templates.globals.update(sitetitle=self.title, resources=self.resources,  # set once
+                                          toc_script=c.TOCSCRIPT_FILE if self.shared_toc else "")
+        return self.templates.get_template(templatename)
+
     def add_inverse_links(self):
         """add Task.required_by/Task.assumed_by lists."""
         for taskname, task in self.taskdict.items():
@@ -424,14 +451,24 @@ class Coursebuilder(sdrl.partbuilder.PartbuilderMixin, Course):
         self.taskorder = self._taskordering_for_toc(graph)
 
     def _add_baseresources(self):
+        """Copy each baseresource; in fingerprint mode also to the name the pages refer to."""
         for direntry in os.scandir(self.baseresourcedir):
             if direntry.is_file():
                 self.directory.make_the(el.Sourcefile, direntry.path)
-                self.directory.make_the(el.CopiedFile, direntry.name, sourcefile=direntry.path,
-                                        targetdir_s=self.targetdir_s, targetdir_i=self.targetdir_i)
+                for name in {direntry.name, self.resources[direntry.name]}:
+                    self.directory.make_the(el.CopiedFile, name, sourcefile=direntry.path,
+                                            targetdir_s=self.targetdir_s, targetdir_i=self.targetdir_i)
             else:
                 b.warning("is not a plain file. Ignored.", file=direntry)
 
+    def _baseresource_names(self) -> 'Resourcenames':
+        """The plain name of each baseresource, or in fingerprint mode a name containing a hash of its content."""
+        result = Resourcenames()
+        for direntry in os.scandir(self.baseresourcedir):
+            if direntry.is_file():
+                result[direntry.name] = fingerprinted(direntry.path) if self.fingerprint else direntry.name
+        return result
+
     def _add_participantslist(self):
         if not self.has_participantslist:
             return  # nothing to do
@@ -581,6 +618,16 @@ class Coursebuilder(sdrl.partbuilder.PartbuilderMixin, Course):
                 pubkey_data[fp] = instructor['pubkey']
         return pubkey_data
 
+    def _make_configelements(self):
+        """Sources for the config settings, sedrila version, and build options that Bodies and Parts depend on."""
+        for key in (*el.Body.CONFIGKEYS, *self.CONFIGKEYS):
+            self.directory.make_the(el.Configelement, key, value=self.configdict.get(key))
+        self.directory.make_the(el.Configelement, el.Configelement.VERSION,
+                                value=sdrl.argparser.SedrilaArgParser.get_version())
+        self.resources = self._baseresource_names()
+        self.directory.make_the(el.Configelement, el.Configelement.RESOURCES, value=self.resources)
+        self.directory.make_the(el.Configelement, el.Configelement.SHARED_TOC, value=self.shared_toc)
+
     def _init_parts(self, configdict: dict, include_stage: str):
         self.directory.record_the(Course, self.name, self)
         self.namespace_add(self)
@@ -610,6 +657,9 @@ class Coursebuilder(sdrl.partbuilder.PartbuilderMixin, Course):
         # ----- create MetadataDerivation, validations, baseresources, participants list:
         self.directory.make_the(MetadataDerivation, self.name, part=self, course=self)
         self._add_baseresources()
+        if self.shared_toc:
+            self.directory.make_the(el.TocScript, c.TOCSCRIPT_FILE, part=self,
+                                    targetdir_s=self.targetdir_s, targetdir_i=self.targetdir_i)
         self._add_participantslist()
 
     @staticmethod
@@ -629,9 +679,12 @@ class Coursebuilder(sdrl.partbuilder.PartbuilderMixin, Course):
 
 
 class MetadataDerivation(el.Step):
-    """Copy Topmatter into Parts' attributes, compute assumedby/requiredby/taskorder, check links."""
+    """Copy Topmatter into Parts' attributes, compute assumedby/requiredby/taskorder/structureindex, check links."""
     course: Coursebuilder
 
+    def my_prerequisites(self) -> tg.Iterable[el.Element]:
+        return self.directory.get_all(el.Topmatter)  # we use their values
+
     def do_build(self):
         # ----- copy topmatter into Parts' attributes:
         dir = self.directory
@@ -643,6 +696,21 @@ class MetadataDerivation(el.Step):
         # ----- compute and check stuff:
         self.course.add_inverse_links()
         self.course.compute_taskorder()
+        self.course.structureindex = sdrl.partbuilder.Structureindex(self.course)
         self.course.check_links()
         import sdrl.programchecker as programchecker
         programchecker.check_test_spec_dependency_gaps(self.course)
+
+
+class Resourcenames(dict):
+    """baseresource name -> name by which pages refer to it. Unknown names (e.g. codehilite.css) stay as they are."""
+    def __missing__(self, name: str) -> str:
+        return name
+
+
+def fingerprinted(path: str, hashlength=10) -> str:
+    """Basename of path with a hash of the file's content before the suffix, e.g. 'sedrila.3f9a1c07e2.css'."""
+    with open(path, 'rb') as f:
+        digest = hashlib.file_digest(f, 'sha256').hexdigest()
+    stem, suffix = os.path.splitext(os.path.basename(path))
+    return f"{stem}.{digest[:hashlength]}{suffix}"
@@ -1,7 +1,14 @@
 """Combined Elements registry/factory and build orchestrator."""
+import concurrent.futures
+import heapq
 import itertools
+import multiprocessing
+import os.path
+import threading
 
 import base as b
+import manifest
+import tracing
 import typing as tg
 
 
@@ -10,29 +17,44 @@ class Directory:
     Each Element is registered here and can be accessed by type and name. 
     The Builder knows when to build each and builds them in an order such that 
     when a Product gets built, the state of all its dependencies is already known.
-    This order is also fully determined by the Element types alone.
+    See Scheduler for how this order is determined.
+    With jobs > 1, the Markdown rendering of Body_s/Body_i is spread over that many worker processes
+    and BUILD_IN_THREAD Elements are built in that many threads.
+    Each Element.build() is recorded in tracer (if that is enabled), see sdrl.report.print_build_profile().
     """
-    def __init__(self, cache):
+    jobs: int  # number of processes for rendering Markdown and of threads for other builds
+    tracer: tracing.Tracer
+    changed_outputs: int  # number of files written with new content during build(); unchanged ones are not written
+    outputs: dict[str, manifest.Entry]  # normalized filename -> Entry, for the files built during build()
+    includeindex: 'sdrl.elements.IncludeIndex'  # which Bodies include which files
+
+    def __init__(self, cache, jobs=1, tracer: tracing.Tracer = None):
         import sdrl.elements as el
         import sdrl.course as course
         import sdrl.coursebuilder as coursebuilder
         import sdrl.glossary as glossary
         self.cache = cache
+        self.jobs = jobs
+        self.tracer = tracer or tracing.Tracer(enabled=False)
+        self.changed_outputs = 0
+        self.outputs = dict()
+        self.lock = threading.Lock()
         self.managed_types = [
             # Each has a downcased dict attribute use by get_the()/make_the().
-            # The ordering is the build ordering:
-            el.Sourcefile, el.CopiedFile, el.ReportFile, el.ParticipantsList,
+            # The ordering is the build ordering for Elements that are ready at the same time:
+            el.Configelement, el.Sourcefile, el.CopiedFile, el.ReportFile, el.ParticipantsList,
             el.Zipdir, el.Zipfile,
-            el.Topmatter, el.Content, coursebuilder.MetadataDerivation, el.ProtFile,
-            el.IncludeList_s, el.IncludeList_i, el.TermrefList,
+            el.Topmatter, el.Content, coursebuilder.MetadataDerivation,
+            el.IncludeList_s, el.IncludeList_i, el.TermrefList, el.TermUse,
             el.Body_s, el.Body_i, el.Glossarybody,
             el.Toc, el.LinkslistBottom,
-            el.TaskgroupDiagram,
+            el.TocScript, el.TaskgroupDiagram, el.ProtFile,  # late, so they can run alongside the Body rendering
             course.Course, course.Chapter, course.Taskgroup, course.Task, glossary.Glossary,
         ]
         for thistype in self.managed_types:
             dictname = thistype.__name__.lower()
             setattr(self, dictname, dict())
+        self.includeindex = el.IncludeIndex(cache)
 
     def get_the(self, mytype: type, name: str) -> 'sdrl.elements.Element':
         """Retrieve existing object from the directory."""
@@ -67,11 +89,32 @@ class Directory:
         the_dict[name] = instance
 
     def build(self):
-        alldicts = ((mytype, self._getdict(mytype)) for mytype in self.managed_types)
-        for thistype, thisdict in alldicts:
-            b.debug(f"building all Elements of type {thistype.__name__}")
-            for elem in thisdict.values():
-                elem.build()
+        import sdrl.markdown as md
+        md.md.memo = self.cache.memo  # rendered Markdown blocks
+        try:
+            with self.tracer.span("Directory", "build"):
+                try:
+                    Scheduler(self).run()
+                finally:
+                    self.includeindex.save({body.cache_key for body in self.get_all_bodies()})
+        except BaseException:
+            self.cache.commit()  # keep what was built, e.g. upon Ctrl-C
+            raise
+        finally:
+            md.md.memo = None
+
+    def reset(self):
+        """Prepare all Elements for another build() in the same process."""
+        self.changed_outputs = 0
+        self.outputs = dict()
+        for elem in {id(elem): elem for thistype in self.managed_types for elem in self.get_all(thistype)}.values():
+            elem.reset()
+
+    def record_output(self, filename: str, entry: manifest.Entry, changed: bool):
+        """Record that an Outputfile has built filename, which has new content if changed. Threadsafe."""
+        with self.lock:
+            self.outputs[os.path.normpath(filename)] = entry
+            self.changed_outputs += changed
 
     def get_all(self, what: type | str) -> tg.Iterable:
         """All entries with a given type or with a given name (in any type)."""
@@ -85,6 +128,10 @@ class Directory:
                 result.append(candidate)
         return result
 
+    def get_all_bodies(self) -> tg.Iterator:
+        import sdrl.elements as el
+        return itertools.chain(self.get_all(el.Body_s), self.get_all(el.Body_i), self.get_all(el.Glossarybody))
+
     def get_all_outputfiles(self) -> tg.Iterator:
         import sdrl.elements as el
         iterators = [self.get_all(t) for t in self.managed_types
@@ -94,3 +141,148 @@ class Directory:
     def _getdict(self, thetype: type):
         dictname = thetype.__name__.lower()
         return getattr(self, dictname)
+
+
+class Scheduler:
+    """
+    Builds the Elements of a Directory in dependency order (topological order).
+    The graph's edges come from my_dependencies() and my_prerequisites() and all point forward
+    in managed_types order. Of the Elements whose predecessors are all built, the one that comes
+    first in managed_types (and in its dict) is built next, so a sequential build proceeds
+    type by type. Elements created during the build are not part of the graph and are not built.
+
+    With jobs > 1, work is started before an Element's turn comes and runs alongside:
+    - BUILD_IN_THREAD Elements are built in a thread as soon as their predecessors are built;
+    - the Markdown of all Body_s/Body_i that need building is rendered in worker processes
+      as soon as the first of them is due, see prerender_bodies().
+    The results and messages of such work are taken over when the Element's turn has come,
+    so that the build output does not depend on jobs.
+    The workers are forks of this process. Forking while other threads run is unsafe, so the
+    threads are drained and stopped before and restarted after.
+    """
+    directory: Directory
+    elems: list  # all Elements; the index of an Element is its priority
+    successors: list[list[int]]  # elems[i] must be built before each elems[successors[i][k]]
+    num_waiting: list[int]  # elems[i] has that many predecessors not yet built
+    ready: list[int]  # heap of the indexes of Elements whose predecessors are all built
+    threadpool: tg.Optional[concurrent.futures.ThreadPoolExecutor]
+    processpool: tg.Optional[concurrent.futures.ProcessPoolExecutor]
+    inthread: dict[int, concurrent.futures.Future]  # index -> future of build_in_thread()
+    prerendered: bool  # whether prerender_bodies() has happened
+
+    def __init__(self, directory: Directory):
+        self.directory = directory
+        self.elems = []
+        index = dict()  # id(elem) -> index in elems
+        for thistype in directory.managed_types:
+            for elem in directory.get_all(thistype):
+                if id(elem) not in index:
+                    index[id(elem)] = len(self.elems)
+                    self.elems.append(elem)
+        self.successors = [[] for elem in self.elems]
+        self.num_waiting = [0 for elem in self.elems]
+        for i, elem in enumerate(self.elems):
+            predecessors = {index[id(pred)] for pred in itertools.chain(elem.my_dependencies(), 
+                                                                        elem.my_prerequisites())
+                            if id(pred) in index} - {i}  # ignore Elements not in the directory
+            for pred in predecessors:
+                self.successors[pred].append(i)
+            self.num_waiting[i] = len(predecessors)
+        self.ready = [i for i, count in enumerate(self.num_waiting) if count == 0]  # sorted, hence a heap
+        self.threadpool = self.processpool = None
+        self.inthread = dict()
+        self.prerendered = False
+
+    def run(self):
+        import sdrl.elements as el
+        numbuilt = 0
+        self.directory.cache.prefetch([elem.cache_key for elem in self.elems 
+                                       if getattr(type(elem), 'PREFETCH', False)])
+        try:
+            self.start_threads()
+            while self.ready:
+                i = heapq.heappop(self.ready)
+                elem = self.elems[i]
+                if isinstance(elem, (el.Body_s, el.Body_i)) and not self.prerendered:
+                    self.prerender_bodies()
+                if i in self.inthread:
+                    self.use_thread_result(self.inthread.pop(i))
+                else:
+                    elem.build()
+                numbuilt += 1
+                for succ in self.successors[i]:
+                    self.num_waiting[succ] -= 1
+                    if self.num_waiting[succ] == 0:
+                        heapq.heappush(self.ready, succ)
+                        self.perhaps_start_in_thread(succ)
+        finally:
+            self.stop_threads()
+            if self.processpool:
+                self.processpool.shutdown(cancel_futures=True)
+        unbuilt = [self.elems[i] for i, count in enumerate(self.num_waiting) if count > 0]
+        assert numbuilt == len(self.elems), f"dependency cycle among {unbuilt}"
+
+    def start_threads(self):
+        if self.directory.jobs < 2:
+            return
+        self.threadpool = concurrent.futures.ThreadPoolExecutor(self.directory.jobs)
+        for i in self.ready:
+            self.perhaps_start_in_thread(i)
+
+    def stop_threads(self):
+        """Wait for the running builds, then end the threads. Their results get used later nevertheless."""
+        if self.threadpool:
+            self.threadpool.shutdown(wait=True)
+            self.threadpool = None
+
+    def perhaps_start_in_thread(self, i: int):
+        elem = self.elems[i]
+        if self.threadpool and getattr(type(elem), 'BUILD_IN_THREAD', False) and i not in self.inthread:
+            self.inthread[i] = self.threadpool.submit(build_in_thread, elem)
+
+    @staticmethod
+    def use_thread_result(future: concurrent.futures.Future):
+        msgs, exc = future.result()
+        for msg, tag, count in msgs:
+            b.rich_print(msg, tag, count)
+        if exc:
+            raise exc
+
+    def prerender_bodies(self):
+        """
+        Render the Markdown of all Body_s/Body_i that need building in a pool of worker processes.
+        Each Body picks up its result in render() when it gets built in normal order, so that
+        messages and cache writes occur as in a sequential build.
+        The workers are forks of this process and so start with the fully set-up course,
+        SedrilaMarkdown object, and macro registry.
+        """
+        import sdrl.elements as el
+        import sdrl.markdown as md
+        self.prerendered = True
+        if self.directory.jobs < 2:
+            return
+        bodies = [body for body in itertools.chain(self.directory.get_all(el.Body_s), 
+                                                   self.directory.get_all(el.Body_i))
+                  if body.needs_build()]
+        if len(bodies) < 2:
+            return  # not worth the process startup
+        b.debug(f"rendering {len(bodies)} bodies in {self.directory.jobs} processes")
+        self.stop_threads()
+        context = multiprocessing.get_context('fork')
+        self.processpool = concurrent.futures.ProcessPoolExecutor(self.directory.jobs, mp_context=context)
+        for body in bodies:
+            body.prerendered = self.processpool.submit(md.render_markdown_in_worker, body.prerender_args())
+        self.start_threads()
+
+
+def build_in_thread(elem) -> tuple[list, tg.Optional[Exception]]:
+    """elem.build() with messages collected and any exception caught, for use in Scheduler.use_thread_result()"""
+    msgs = []
+    b.collect_msgs(msgs)
+    try:
+        elem.build()
+        return msgs, None
+    except Exception as exc:
+        return msgs, exc
+    finally:
+        b.collect_msgs(None)
@@ -21,12 +21,14 @@ Element
         TermrefList
       FreshPiece
         LinkslistBottom
+        TermUse
         Toc
       Topmatter
     Outputfile
       CopiedFile
       ReportFile
       TaskgroupDiagram
+      TocScript
       Part
         Course
           CourseSI
@@ -68,6 +70,10 @@ which relies on three Element-type-specific methods:
 - `my_dependencies()` returns the Elements this Element depends on.
 - `do_build()` implements the actual build step for this particular type of element.
 
+`Directory.build()` calls `build()` in an order compatible with `my_dependencies()`
+and with `my_prerequisites()`, which returns Elements that must be built before this one
+for other reasons, e.g. because they set attributes that `do_build()` uses.
+
 
 ## How data are represented in the cache
 
@@ -75,13 +81,18 @@ which relies on three Element-type-specific methods:
 
 `Pieces` have a `value` that is stored in the cache;
 it is either a `str` or a `list[str]` or a `b.StrAnyDict`.
+The state of a `Piece` depends only on whether its cache entry exists;
+the entry itself is read only when `value` is first accessed.
 
 `Sources` are represented in the cache only by cache keys, with an empty value.
 This serves to determine their state:
 - cache key missing: `MISSING`.
 - cache key written to cache in the present run: `HAS_CHANGED`.
 - cache key is in persistent cache from a previous run: `AS_BEFORE` or `HAS_CHANGED`, 
-  depending on the file's mtime (or file tree's youngest mtime).
+  depending on the file's mtime (or file tree's youngest mtime)
+  or, with `SedrilaCache.hashmode`, on the file's content (or file tree's contents).
+`Configelements` are the exception: their entry holds their value,
+which is compared with the current one by digest.
 
 
 ## How data are represented in the build
@@ -112,15 +123,18 @@ However, some do it in an odd way:
 Instead, their `value` is set by some other `Piece`'s `do_build()`.
 
 `FreshPieces` do not use the cache to retrieve a previous value if they are `AS_BEFORE`.
-Instead, they _always_ retrieve the previous value, _always_ re-build themselves, and then compare
-the two in order to determine whether they are `AS_BEFORE` or `HAS_CHANGED`.
+Instead, they _always_ re-build themselves and then compare the digest of the new value with that of
+the cached one in order to determine whether they are `AS_BEFORE` or `HAS_CHANGED`.
 This means the build step happens in `check_existing_resource()` and `do_build()` only writes
 a changed outcome to the cache.
 """
 
+import concurrent.futures
+import io
+import itertools
+import json
 import os.path
 import re
-import shutil
 import typing as tg
 import zipfile
 
@@ -130,6 +144,8 @@ import yaml
 
 import base as b
 import cache as c
+import manifest
+import memo
 import sdrl.directory as dir
 import sdrl.macros as macros
 import sdrl.markdown as md
@@ -138,11 +154,14 @@ import sdrl.markdown as md
 class Element:  # abstract class
     """
     Common superclass of the stuff taking part in incremental build: Sources and Products.
-    Directory defines an ordering of these classes A, B, C such that if any B has any A as a dependency,
-    A will be before B in the ordering. This allows building Elements simply in order A, B, C, ...
+    Directory defines an ordering of these classes A, B, C such that if any B has any A as a dependency
+    or prerequisite, A will be before B in the ordering. Directory builds Elements in dependency order
+    and uses the type ordering to break ties, so a sequential build proceeds in order A, B, C, ...
     build() is mostly generic and consists of calls to the class-specific framework filler methods
     check_existing_resource(), my_dependencies() and do_build().
     """
+    BUILD_IN_THREAD = False  # whether Directory may build this in a thread (when jobs > 1)
+    PREFETCH = False  # whether Directory should bulk-load the cache entry before the build
     name: str  # path, filename, or partname
     part: 'Part'  # where to find inherited attrs, only set for non-Parts
     directory: dir.Directory  # inherited
@@ -173,25 +192,30 @@ class Element:  # abstract class
         return f"{self.state}{'*' if isinstance(self, Byproduct) else ''}"
 
     def build(self):
-        """Generic framework operation."""
-        def do_it():
-            self.do_build()
-            if self.state == c.State.MISSING:  # HAS_CHANGED and AS_BEFORE are acceptable
-                self.state = c.State.HAS_CHANGED
-
+        """Generic framework operation. Traced by the Directory's tracer."""
+        with self.directory.tracer.span(self.__class__.__name__, self.name) as span:
+            needs_build = self.needs_build()
+            span.set(found=self.statelabel, built=needs_build)  # not built: cache hit
+            if needs_build:
+                self.do_build()
+                if self.state == c.State.MISSING:  # HAS_CHANGED and AS_BEFORE are acceptable
+                    self.state = c.State.HAS_CHANGED
+                span.set(state=self.statelabel)
+
+    def needs_build(self) -> bool:
+        """Whether build() must call do_build(). Calls check_existing_resource() as a side effect."""
         # b.debug(f"{self.__class__.__name__}.build({self.name}) check_existing_resource()")
         self.check_existing_resource()  # some do_build() rely on this to have happened
         if self.state != c.State.AS_BEFORE:
             b.debug(f"{self.__class__.__name__}.build({self.name}) local state:\t{self.statelabel} ")
-            do_it()
-            return
+            return True
         for dep in self.my_dependencies():
             if dep.state != c.State.AS_BEFORE:
                 which = f"{dep.__class__.__name__}({dep.name})"
                 b.debug(f"{self.__class__.__name__}.build({self.name}) dependency {which} state:\t{dep.statelabel}")
-                do_it()
-                return
+                return True
         # b.debug(f"{self.__class__.__name__}.build({self.name}) state:\t{self.statelabel}")
+        return False
 
     def check_existing_resource(self):
         """
@@ -205,6 +229,17 @@ class Element:  # abstract class
     def my_dependencies(self) -> tg.Iterable['Element']:
         return self.dependencies
 
+    def reset(self):
+        """
+        Forget what the previous build() has left in self, so that another Directory.build() 
+        in the same process behaves as if self had just been created. 
+        """
+        pass
+
+    def my_prerequisites(self) -> tg.Iterable['Element']:
+        """Elements that must be built before this one although it does not depend on their state."""
+        return []
+
     def do_build(self):
         """Class-specific: perform actual build work."""
         assert False, f"{self.__class__.__name__}.do_build({self.name}) not defined"
@@ -250,85 +285,173 @@ class Product(Element):  # abstract class
     pass
 
 
+_NOVALUE = object()  # marker for Piece._value
+
+
 class Piece(Product):  # abstract class
     """
     Abstract superclass for an internal outcome of build, managed in the cache or with help of the cache.
     Pieces have a value that is set by check_existing_resource() (if in the cache) or by do_build()
     or both.
+    check_existing_resource() determines the state from the presence of the cache entry only;
+    the entry is read, decompressed, and parsed upon the first access of value, if any.
     """
     CACHED_TYPE = 'str'  # which kind of value is in the cache
     SC = c.SedrilaCache  # abbrev
     READFUNC = dict(str=SC.cached_str, list=SC.cached_list, set=SC.cached_set, dict=SC.cached_dict)
     WRITEFUNC = dict(str=SC.write_str, list=SC.write_list, set=SC.write_set, dict=SC.write_dict)
-    value: c.Cacheable  # build result, from Cache or from do_build()
-    
+    _value: c.Cacheable = _NOVALUE  # build result, from Cache or from do_build()
+    _value_in_cache: bool = False  # whether value is to be read from the cache upon first access
+
+    @property
+    def value(self) -> c.Cacheable:
+        if self._value is _NOVALUE and self._value_in_cache:
+            self._value = self.READFUNC[self.CACHED_TYPE](self.cache, self.cache_key)[0]
+            self._value_in_cache = False
+        if self._value is _NOVALUE:
+            raise AttributeError(f"{self.cache_key} has no value")
+        return self._value
+
+    @value.setter
+    def value(self, value: c.Cacheable):
+        self._value = value
+        self._value_in_cache = False
+
     def check_existing_resource(self):
-        value, self.state = self.READFUNC[self.CACHED_TYPE](self.cache, self.cache_key)
-        if value is not None:
-            self.value = value  # do not set it to None
+        self.state = self.cache.state(self.cache_key)
+        if self.state == c.State.MISSING:
+            value = self.READFUNC[self.CACHED_TYPE](self.cache, self.cache_key)[0]  # the type's empty value
+            if value is not None:
+                self.value = value  # do not set it to None
+        else:
+            self._value = _NOVALUE
+            self._value_in_cache = True
 
     def handle_value_and_state(self, value):
         """
         Where Outputfile elements directly produce an effect during do_build(),
         Pieces only live in the cache. This method puts them there and sets value.
-        However, a freshly built value is still AS_BEFORE if it is the same as in the cache.
+        However, a freshly built value is still AS_BEFORE if it is the same as in the cache
+        (unless the cache entry is from an interrupted build, whose dependents may not have been built).
+        Sameness is decided by digest, so the cached value need not be read.
         """
         self.value = value
-        cache_value, cache_state = self.READFUNC[self.CACHED_TYPE](self.cache, self.cache_key)
-        if cache_state != c.State.MISSING and self.value == cache_value:
+        cache_state = self.cache.state(self.cache_key)
+        is_same = self.has_same_value_as_cache()
+        if cache_state == c.State.AS_BEFORE and is_same:
             self.state = c.State.AS_BEFORE
         else: 
             self.state = c.State.HAS_CHANGED
             self.WRITEFUNC[self.CACHED_TYPE](self.cache, self.cache_key, self.value)
         b.debug(f"handle_value_and_state({self.cache_key}, c:{b.caller()}): "  # TODO 2: deactivate?
-                f"cache: {cache_state},{'same' if self.value == cache_value else 'different'}_value"
+                f"cache: {cache_state},{'same' if is_same else 'different'}_value"
                 f" --> {self.state}")
 
+    def has_same_value_as_cache(self) -> bool:
+        """Whether value equals the cached value, judged by their digests."""
+        return self.cache.digest(self.cache_key) == self.cache.digest_of(self.value)
+
     def has_value(self) -> bool:
-        return hasattr(self, 'value')
+        return self._value is not _NOVALUE or self._value_in_cache
+
+    def reset(self):
+        self._value = _NOVALUE
+        self._value_in_cache = False
 
 
 class Body(Piece):  # abstract class
+    CONFIGKEYS = ('blockmacro_topmatter', 'altdir', 'itreedir')  # config settings that rendering reads
     includelist_class: type
     termrefs: set[str]
+    prerendered: tg.Optional[concurrent.futures.Future] = None  # render() result from a worker process
 
     def __init__(self, name: str, **kwargs):
         super().__init__(name, **kwargs)
+        for configname in (Configelement.VERSION, *self.CONFIGKEYS):
+            self.add_dependency(self.directory.get_the(Configelement, configname))
         self.add_dependency(self.directory.make_or_get_the(Content, self.name, part=self))
         includelist = self.directory.make_the(self.includelist_class, self.name, part=self)
         self.add_dependency(includelist)
-        includelist.check_existing_resource()
-        if includelist.state == c.State.AS_BEFORE:  # a list is available
-            for fname in includelist.value:
-                self.make_or_get_dependency(Sourcefile, name=fname, posthoc=True)
+        index = self.directory.includeindex
+        includes = index.includes_of(self.cache_key)
+        if includes is None:  # cache from before the IncludeIndex: use our IncludeList
+            includelist.check_existing_resource()
+            includes = includelist.value if includelist.state == c.State.AS_BEFORE else set()
+            index.set_includes(self.cache_key, includes)
+        for fname in includes:
+            self.make_or_get_dependency(Sourcefile, name=fname, posthoc=True)
 
     def check_existing_resource(self):
         super().check_existing_resource()
         if self.cache.is_dirty(self.sourcefile):
             self.state = c.State.HAS_CHANGED  # force re-build for previous dirty files
 
+    def my_prerequisites(self) -> tg.Iterable[Element]:
+        import sdrl.coursebuilder
+        return self.directory.get_all(sdrl.coursebuilder.MetadataDerivation)  # macros need Part attributes
+
+    def reset(self):
+        super().reset()
+        self.prerendered = None
+
     def do_do_build(self, includelist_class: type, render_mode: b.Mode):
         # --- prepare:
         content = self.directory.get_the(Content, self.name)
         # --- build body and byproduct includeslist:
         # includeslist gets filled when building self, but is also a dependency of self!
-        # As a dependency, it gets built earlier, so the includes found here will come into effect
-        # only during the next run, via the cache.
+        # As a dependency, it gets built earlier; the includes found here become our
+        # Sourcefile dependencies right away, see track_includes().
         includeslist = self.directory.get_the(includelist_class, self.name)
         macros.switch_part(self.name)
         mddict = self.render(content.value, render_mode)
         html, includes, self.termrefs = (mddict['html'], mddict['includefiles'], mddict['termrefs'])
         self.handle_value_and_state(html)
         includeslist.handle_value_and_state(includes)
+        self.track_includes(includes)
+
+    def track_includes(self, includes: set[str]):
+        """
+        Make the files included by the rendering just done our dependencies (and those no longer
+        included no longer), so that a later build in the same process reacts to changes of exactly these.
+        New Sourcefiles get recorded in the cache now, so the next run finds them AS_BEFORE.
+        """
+        index = self.directory.includeindex
+        old_includes = index.includes_of(self.cache_key) or set()
+        if includes == old_includes:
+            return
+        dropped = old_includes - includes
+        self.dependencies = [dep for dep in self.dependencies
+                             if not (isinstance(dep, Sourcefile) and dep.name in dropped)]
+        for fname in sorted(includes - old_includes):
+            self.make_or_get_dependency(Sourcefile, name=fname, posthoc=True)
+        index.set_includes(self.cache_key, includes)
 
     def render(self, content: str, render_mode: b.Mode) -> dict:
-        return md.render_markdown(self.sourcefile, self.name, content, render_mode,
-                                  self.course.blockmacro_topmatter)
+        if self.prerendered:
+            future, self.prerendered = self.prerendered, None
+            result = md.use_worker_result(future.result())
+            result['span'].category = f"{self.__class__.__name__} (worker)"  # our own span lacks this time
+            result['span'].set(built=True)
+            self.directory.tracer.add(result['span'])
+            return result
+        return md.render_markdown(*self.render_args(content, render_mode))
+
+    def render_args(self, content: str, render_mode: b.Mode) -> tuple:
+        """Arguments for md.render_markdown(), also used for rendering in a worker process."""
+        return (self.sourcefile, self.name, content, render_mode, self.course.blockmacro_topmatter)
+
+    def prerender_args(self) -> tuple:
+        """render_args() as do_build() will need them."""
+        content = self.directory.get_the(Content, self.name)
+        return self.render_args(content.value, self.RENDER_MODE)
+
 
 class Body_s(Body):
     """Student HTML page text content.  Byproducts: IncludeList_s, Termreflist."""
+    RENDER_MODE = b.Mode.STUDENT
+
     def do_build(self):
-        self.do_do_build(IncludeList_s, b.Mode.STUDENT)
+        self.do_do_build(IncludeList_s, self.RENDER_MODE)
         # --- build byproduct termreflist (body_i.termrefs ought to be identical to self.termrefs):
         termreflist = self.directory.get_the(TermrefList, self.name)
         termreflist.handle_value_and_state(self.termrefs)
@@ -336,8 +459,10 @@ class Body_s(Body):
 
 class Body_i(Body):
     """Instructor HTML page text content.  Byproduct: IncludeList_i."""
+    RENDER_MODE = b.Mode.INSTRUCTOR
+
     def do_build(self):
-        self.do_do_build(IncludeList_i, b.Mode.INSTRUCTOR)
+        self.do_do_build(IncludeList_i, self.RENDER_MODE)
 
 
 class Glossarybody(Body):
@@ -350,8 +475,12 @@ class Glossarybody(Body):
         # All Parts must have been created before, or this will do nothing:
         for termreflist in self.directory.get_all(TermrefList):
             self.add_dependency(termreflist)
-        for topmatter in self.directory.get_all(Topmatter):
-            self.add_dependency(topmatter)
+        for termuse in self.directory.get_all(TermUse):
+            self.add_dependency(termuse)
+
+    def my_prerequisites(self) -> tg.Iterable[Element]:
+        # the Body_s produce our TermrefList dependencies:
+        return itertools.chain(super().my_prerequisites(), self.directory.get_all(Body_s))
 
     def do_build(self):
         self.switch_macros_op()
@@ -388,7 +517,8 @@ class Byproduct(Piece):  # abstract class
 
 class Content(Byproduct):
     """Markdown part of a Part sourcefile. Byproduct of Topmatter."""
-    pass
+    def my_prerequisites(self) -> list[Element]:
+        return [self.directory.get_the(Topmatter, self.name)]
 
 
 class IncludeList_s(Byproduct):
@@ -401,6 +531,58 @@ class IncludeList_i(Byproduct):
     CACHED_TYPE = 'set'  # which kind of value is in the cache
 
 
+class IncludeIndex:
+    """
+    Which files each Body (by cache_key) included when it was last rendered.
+    The IncludeLists know the same, but the index is one cache entry for all Bodies and
+    is up to date while the build runs: Bodies take their includefile Sourcefile dependencies
+    from here when they are created and update it whenever they are rendered
+    (see Body.track_includes()), so the dependencies are correct within the same build, not only in the next one.
+    """
+    CACHE_KEY = '_includeindex'
+    includes: dict[str, set[str]] | None  # Body cache_key -> includefiles; None: not yet read from cache
+    is_known: bool  # whether the cache has an index (older caches have only the IncludeLists)
+    is_modified: bool  # whether save() must write the index
+
+    def __init__(self, cache: c.SedrilaCache):
+        self.cache = cache
+        self.includes = None
+        self.is_known = self.is_modified = False
+
+    def load(self):
+        if self.includes is not None:
+            return
+        index, state = self.cache.cached_dict(self.CACHE_KEY)
+        self.is_known = state != c.State.MISSING
+        self.includes = {bodykey: set(fnames) for bodykey, fnames in index.items()}
+
+    def includes_of(self, bodykey: str) -> set[str] | None:
+        """The files the Body included when it was last rendered; None if unknown."""
+        self.load()
+        if not self.is_known and bodykey not in self.includes:
+            return None
+        return self.includes.get(bodykey, set())
+
+    def set_includes(self, bodykey: str, fnames: set[str]):
+        self.load()
+        if self.includes.get(bodykey) != fnames:
+            self.includes[bodykey] = set(fnames)
+            self.is_modified = True
+
+    def save(self, bodykeys: set[str]):
+        """Write the index to the cache if it has changed, leaving out Bodies other than bodykeys."""
+        if self.includes is None:
+            return  # not used in this build
+        gone = self.includes.keys() - bodykeys
+        if not (self.is_modified or gone or not self.is_known):
+            return
+        for bodykey in gone:
+            del self.includes[bodykey]
+        self.cache.write_dict(self.CACHE_KEY, {bodykey: sorted(fnames)
+                                               for bodykey, fnames in sorted(self.includes.items())})
+        self.is_known, self.is_modified = True, False
+
+
 class TermrefList(Byproduct):
     """
     List of names of terms TERMREF'd by Part or term self.name.
@@ -415,11 +597,11 @@ class FreshPiece(Piece):
     FRESH_ATTR = '?'  # attr of task that represents the piece's value
 
     def check_existing_resource(self):
-        cached_value, cached_state = self.READFUNC[self.CACHED_TYPE](self.cache, self.cache_key)
+        cached_state = self.cache.state(self.cache_key)
         self.value = getattr(self.part, self.FRESH_ATTR)  # in fact freshly built
-        if cached_value is None:
+        if cached_state == c.State.MISSING:
             self.state = c.State.MISSING
-        elif cached_value == self.value:
+        elif cached_state == c.State.AS_BEFORE and self.has_same_value_as_cache():
             self.state = c.State.AS_BEFORE
         else:
             self.state = c.State.HAS_CHANGED
@@ -435,6 +617,20 @@ class Toc(FreshPiece):
     FRESH_ATTR = 'toc'
 
 
+class TermUse(FreshPiece):
+    """
+    What the glossary needs to know about a Part apart from its TermrefList:
+    the terms it explains and whether it is skipped (see Glossary.explains(), Glossary.mentions()).
+    Unlike the Part's Topmatter, this does not change when e.g. its timevalue does.
+    """
+    CACHED_TYPE = 'dict'
+    FRESH_ATTR = 'term_use'
+
+    def my_prerequisites(self) -> tg.Iterable[Element]:
+        import sdrl.coursebuilder
+        return self.directory.get_all(sdrl.coursebuilder.MetadataDerivation)  # sets explains and stage
+
+
 class LinkslistBottom(FreshPiece):  # TODO 2: integrate in the build
     """HTML for the assumedBy/requiredBy links of a Task."""
     FRESH_ATTR = 'linkslist_bottom'
@@ -443,6 +639,7 @@ class LinkslistBottom(FreshPiece):  # TODO 2: integrate in the build
 class Topmatter(Piece):
     """Metadata from a Part file. Byproduct: Content."""
     CACHED_TYPE = 'dict'  # which kind of value is in the cache
+    PREFETCH = True  # MetadataDerivation reads all values
     
     def __init__(self, name: str, **kwargs):
         super().__init__(name, **kwargs)
@@ -491,18 +688,35 @@ class Outputfile(Product):  # abstract class
         else:
             self.state = c.State.AS_BEFORE
 
+    @property
+    def producer(self) -> str:
+        return f"{self.__class__.__name__}:{self.name}"  # as named in the manifest
+
+    def write_output(self, filename: str, content: str | bytes):
+        """Write content to filename, but leave the file alone if it has this content already."""
+        data = content.encode('utf8') if isinstance(content, str) else content
+        changed = b.spit_if_changed(filename, data)
+        self.directory.record_output(filename, manifest.Entry.of_bytes(filename, data, self.producer), changed)
+
+    def copy_output(self, sourcefile: str, filename: str):
+        """write_output() for a verbatim copy of sourcefile."""
+        changed = b.copy_if_changed(sourcefile, filename)
+        self.directory.record_output(filename, manifest.Entry.of_file(filename, self.producer), changed)
+
 
 class CopiedFile(Outputfile):
     """For resources which are copied verbatim. The data lives in the file system, hence no value."""
+    BUILD_IN_THREAD = True
+
     def __init__(self, name: str, **kwargs):
         super().__init__(name, **kwargs)
         self.add_dependency(self.directory.get_the(Sourcefile, self.sourcefile))
 
     def do_build(self):
         b.debug(f"copying '{self.sourcefile}'\t-> '{self.targetdir_s}'")
-        shutil.copy(self.sourcefile, self.outputfile_s)
+        self.copy_output(self.sourcefile, self.outputfile_s)
         b.debug(f"copying '{self.sourcefile}'\t-> '{self.targetdir_i}'")
-        shutil.copy(self.sourcefile, self.outputfile_i)
+        self.copy_output(self.sourcefile, self.outputfile_i)
 
 
 class TaskgroupDiagram(Outputfile):
@@ -518,7 +732,11 @@ class TaskgroupDiagram(Outputfile):
     Depends on the Topmatter of every task shown, so it rebuilds when a task's metadata
     (title, difficulty, assumes, requires, ...) changes. Task removal is covered by comparing
     the current node-name set against the cached one.
+    The SVG is kept in the memo under the DOT source of the graph, so a rebuild runs graphviz
+    only if the graph itself has changed, not merely some metadata of its tasks.
     """
+    BUILD_IN_THREAD = True  # graphviz runs as a separate process
+    MEMO_SALT = "TaskgroupDiagram 1"  # change this when the SVG postprocessing changes
     part: 'sdrl.course.Taskgroup'  # noqa
     grouptasks: list[str]  # names of the Taskgroup's own tasks
     externaltasks: list[str]  # names of the tasks outside the Taskgroup that grouptasks depend on
@@ -561,11 +779,15 @@ class TaskgroupDiagram(Outputfile):
             if cache_state == c.State.MISSING or set(old_names or []) != set(self.tasknames):
                 self.state = c.State.HAS_CHANGED
 
+    def my_prerequisites(self) -> tg.Iterable[Element]:
+        import sdrl.coursebuilder
+        return self.directory.get_all(sdrl.coursebuilder.MetadataDerivation)  # see class docstring
+
     def do_build(self):
         svg = self._render_svg()
         b.info(self.outputfile_s)
-        b.spit(self.outputfile_s, svg)
-        b.spit(self.outputfile_i, svg)
+        self.write_output(self.outputfile_s, svg)
+        self.write_output(self.outputfile_i, svg)
         self.cache.write_list(self.cache_key, self.tasknames)
 
     def _compute_tasksets(self):
@@ -609,6 +831,16 @@ class TaskgroupDiagram(Outputfile):
         return re.sub(r'<svg\b[^>]*>', fix_root_tag, svg, count=1)
 
     def _render_svg_via_graphviz(self) -> str:
+        """The SVG from the memo if this graph has been laid out before, else from graphviz."""
+        graph = self._make_graph()
+        key = memo.key_of(self.MEMO_SALT, graph.source)
+        svg = self.cache.memo.get(key)
+        if svg is None:
+            svg = graph.pipe(format='svg').decode('utf-8')
+            self.cache.memo.put(key, svg)
+        return svg
+
+    def _make_graph(self) -> graphviz.Digraph:
         # attribute list see https://www.graphviz.org/doc/info/attrs.html
         shown = set(self.tasknames)
         # ----- global attributes:
@@ -641,8 +873,7 @@ class TaskgroupDiagram(Outputfile):
             for required in task.requires:
                 if required in shown:
                     graph.edge(required, taskname, color="red", penwidth="2", **self._constraint(required))
-        # ----- generate SVG:
-        return graph.pipe(format='svg').decode('utf-8')
+        return graph
 
     def _add_node(self, graph: graphviz.Digraph, taskname: str):
         task = self.course.taskdict[taskname]
@@ -680,6 +911,25 @@ class TaskgroupDiagram(Outputfile):
                 f'{text_lines}</svg>\n')
 
 
+class TocScript(Outputfile):
+    """
+    The complete toc sidebar as a JavaScript file that all pages load (with 'author build --shared-toc'),
+    so that a changed toc entry changes this one file instead of every page.
+    sidebar.js inserts the toc into the page and collapses what is not on the path to the page.
+    """
+    part: 'sdrl.course.Course'  # noqa
+
+    def __init__(self, name: str, **kwargs):
+        super().__init__(name, **kwargs)
+        self.make_or_get_dependency(Toc, name=self.part.name, part=self.part)
+
+    def do_build(self):
+        toc = self.directory.get_the(Toc, self.part.name).value
+        script = f"var sedrila_toc = {json.dumps(toc)};\n"
+        self.write_output(self.outputfile_s, script)
+        self.write_output(self.outputfile_i, script)
+
+
 class ReportFile(Outputfile):
     """Maintainer report file as a build product.
     
@@ -723,7 +973,7 @@ class ReportFile(Outputfile):
     def do_build(self):
         """Write report content to targetdir_i only."""
         b.debug(f"generating report '{self.outputfile_i}'")
-        b.spit(self.outputfile_i, self.report_content)
+        self.write_output(self.outputfile_i, self.report_content)
 
 
 class Part(Outputfile):  # abstract class for Course, Chapter, Taskgroup, Task and their Builders, see course.py
@@ -783,6 +1033,7 @@ class Part(Outputfile):  # abstract class for Course, Chapter, Taskgroup, Task a
 
 class Zipfile(Part):
     """xy.zip Outputfiles that are named Parts, plus the exceptional case itree.zip."""
+    BUILD_IN_THREAD = True
     instructor_only: bool = False
     
     def __init__(self, name: str, **kwargs):
@@ -809,12 +1060,14 @@ class Zipfile(Part):
     def do_build(self):
         if self.instructor_only:  # suppress printing instructor file for the normal pairs
             b.info(self.outputfile_i)
-        with zipfile.ZipFile(self.outputfile_i, mode='w', 
+        zipbytes = io.BytesIO()  # the same files give the same bytes, so unchanged ZIPs need not be written
+        with zipfile.ZipFile(zipbytes, mode='w', 
                              compression=zipfile.ZIP_DEFLATED) as archive:  # prefer deflate for build speed
             self._zip_the_files(archive)
+        self.write_output(self.outputfile_i, zipbytes.getvalue())
         if not self.instructor_only:
             b.info(self.outputfile_s)
-            shutil.copy(self.outputfile_i, self.outputfile_s)
+            self.write_output(self.outputfile_s, zipbytes.getvalue())
     
     def _zip_the_files(self, archive: zipfile.ZipFile):
         assert os.path.exists(self.sourcefile), f"'{self.sourcefile}' is missing!"
@@ -835,6 +1088,7 @@ class Zipfile(Part):
 
 class TransformedFile(Outputfile):  # abstract class
     """An output derived by applying a transformation operation to a single sourcefile"""
+    BUILD_IN_THREAD = True  # the transformations encrypt via gpg
     transformation: tg.Callable[['TransformedFile'], None]  # function that generates the output
     
     def __init__(self, name: str, **kwargs):  
@@ -874,6 +1128,10 @@ class ProtFile(TransformedFile):
                 self.state = c.State.HAS_CHANGED
                 break
 
+    def my_prerequisites(self) -> tg.Iterable[Element]:
+        import sdrl.coursebuilder
+        return self.directory.get_all(sdrl.coursebuilder.MetadataDerivation)  # for the tasks' 'skipthis'
+
 
 class Source(Element):  # abstract class
     """
@@ -885,8 +1143,31 @@ class Source(Element):  # abstract class
         pass  # Sources need no building, only checking
 
 
+class Configelement(Source):
+    """
+    A Source that is a value supplied upon instantiation: a config setting (named like its key),
+    the version of sedrila itself (named VERSION), the names by which pages refer to the
+    baseresources (named RESOURCES), or whether pages share one toc (named SHARED_TOC).
+    The cache entry holds the value, so a changed value is recognized by its digest.
+    """
+    VERSION = '_sedrila_version'
+    RESOURCES = '_resources'
+    SHARED_TOC = '_shared_toc'
+    value: tg.Any  # anything JSON-serializable
+
+    def check_existing_resource(self):
+        text = json.dumps(self.value, sort_keys=True, default=str)
+        if (self.cache.state(self.cache_key) == c.State.AS_BEFORE and
+                self.cache.digest(self.cache_key) == self.cache.digest_of(text)):
+            self.state = c.State.AS_BEFORE
+        else:
+            self.cache.write_str(self.cache_key, text)
+            self.state = c.State.HAS_CHANGED
+
+
 class Sourcefile(Source):
     """A Source that consists of a single file. Its name is the sourcefile's full path."""
+    PREFETCH = True  # in hashmode, the cache entry holds the file's fingerprint (see SedrilaCache.has_changed())
     posthoc: bool  # flag "this object did not yet exist during the Sourcefile.build() phase" 
 
     def __init__(self, name, **kwargs):
@@ -919,22 +1200,19 @@ class Zipdir(Source):
         self.title = os.path.basename(zipdirpath)  # e.g. myzipdir.zip
 
     def check_existing_resource(self):
-        """HAS_CHANGED if any file in the tree is new or the set of filenames differs from cache."""
+        """HAS_CHANGED if any file in the tree has changed or the set of filenames differs from cache."""
         # ----- analyze Zipdir tree:
         current_filelist = []
-        new_file_found = False
         for dirpath, dirnames, filenames in os.walk(self.sourcefile):
-            for filename in sorted(filenames):
-                sourcename = f"{dirpath}/{filename}"
-                if self.cache.is_recent(sourcename):
-                    new_file_found = True
-                current_filelist.append(sourcename)
+            current_filelist.extend(f"{dirpath}/{filename}" for filename in sorted(filenames))
+        # in hashmode, the fingerprints of all files of the tree are kept in one entry:
+        new_file_found = self.cache.group_has_changed(current_filelist, f"{self.sourcefile}__zipdirfiles")
         current_fileset = set(current_filelist)
         # ----- determine state according to changes and cache:
         old_fileslist, cache_state = self.cache.cached_list(self.cache_key)
         old_fileset = set(old_fileslist or [])
         filesets_differ = old_fileset != current_fileset
-        if cache_state == c.State.MISSING or new_file_found or filesets_differ:
+        if cache_state != c.State.AS_BEFORE or new_file_found or filesets_differ:
             b.debug(f"Zipdir.check({self.name}): cache {cache_state}, new_file {new_file_found}, "
                     f"filesets differ {filesets_differ}")
             self.cache.write_list(self.cache_key, current_filelist)
@@ -49,7 +49,8 @@ class Glossary(sdrl.partbuilder.PartbuilderMixin, el.Part):
         self.make_dependency(el.Glossarybody, part=self, includelist_class=el.IncludeList_s,
                              switch_macros_op=self.register_macros_phase2,
                              expand_toc_op=self.replace_toc_pseudomacrocall)
-        self.make_dependency(el.Toc, part=self)
+        self.make_toc_dependency(self)
+        self.make_layout_dependencies()
 
     def check_existing_resource(self):
         super().check_existing_resource()
@@ -70,13 +71,7 @@ class Glossary(sdrl.partbuilder.PartbuilderMixin, el.Part):
     @property
     def toc(self) -> str:
         """Return a chapters-only table of contents for the glossary."""
-        result = ['']  # start with a newline
-        for chapter in self.course.chapters:  # noqa
-            if chapter.to_be_skipped:
-                continue
-            result.append(chapter.toc_entry)
-        result.append(self.toc_entry)
-        return "\n".join(result)
+        return self.course.structureindex.toc()
 
     @property
     def toc_link_text(self) -> str:
@@ -136,13 +131,23 @@ class Glossary(sdrl.partbuilder.PartbuilderMixin, el.Part):
                         file=self.sourcefile)
 
 
-    def register_macros_phase1(self):
-        macros.register_macro("TERMREF", 1, macros.MM.INNER, self._expand_termref)
-        macros.register_macro("TERMREF2", 2, macros.MM.INNER, self._expand_termref)
+    def reset(self):
+        super().reset()
+        self.explainedby = dict()
+        self.mentionedby = dict()
+        self.termdefs = set()
+        self.termref_usages = dict()
+        self.term_linkslist = None
+        self.rendered_content = ''
+        self.register_macros_phase1(redefine=True)  # undo phase 2
+
+    def register_macros_phase1(self, redefine=False):
+        macros.register_macro("TERMREF", 1, macros.MM.INNER, self._expand_termref, redefine=redefine)
+        macros.register_macro("TERMREF2", 2, macros.MM.INNER, self._expand_termref, redefine=redefine)
         # --- the following will be redefined in phase2:
-        macros.register_macro("TERM0", 1, macros.MM.INNER, self._complain_term)
-        macros.register_macro("TERM", 1, macros.MM.BLOCKSTART, self._complain_term)
-        macros.register_macro("ENDTERM", 0, macros.MM.BLOCKEND, self._ignore_endtermlong)
+        macros.register_macro("TERM0", 1, macros.MM.INNER, self._complain_term, redefine=redefine)
+        macros.register_macro("TERM", 1, macros.MM.BLOCKSTART, self._complain_term, redefine=redefine)
+        macros.register_macro("ENDTERM", 0, macros.MM.BLOCKEND, self._ignore_endtermlong, redefine=redefine)
 
     def register_macros_phase2(self):
         macros.register_macro("TERM0", 1, macros.MM.INNER, self._expand_term0, redefine=True)
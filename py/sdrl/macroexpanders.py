@@ -77,7 +77,7 @@ def expand_partref(course: sdrl.coursebuilder.Coursebuilder, macrocall: macros.M
 def expand_treeref(course: sdrl.coursebuilder.Coursebuilder, macrocall: macros.Macrocall) -> str:
     actualpath = includefile_path(course, macrocall, itree_mode=True)
     showpath = actualpath[len(course.itreedir)+1:]  # skip itreedir part of path
-    if not os.path.exists(actualpath):
+    if not course.files.exists(actualpath):
         b.warning(f"{macrocall.macrocall_text}: itreedir file '{actualpath}' not found",
                   file=macrocall.filename)
         showpath = "???"
@@ -134,10 +134,10 @@ def expand_prot(course: sdrl.course.Course, macrocall: macros.Macrocall) -> str:
         assert isinstance(course, sdrl.coursebuilder.Coursebuilder)
         path = includefile_path(course, macrocall, itree_mode=False)
         b.debug(f"expand_prot: resolved to {path}")
-    if not os.path.exists(path):
+    if not (course.files.exists(path) if author_mode else os.path.exists(path)):
         b.warning(f"{macrocall.macrocall_text}: file '{path}' not found", file=macrocall.filename)
         return f"\n<p>(('{path}' not found))</p>\n"
-    content = b.slurp(path)
+    content = course.files.read(path) if author_mode else b.slurp(path)
     macrocall.md.includefiles.add(path)  # record that we have included this file
     # In author mode, register encrypted version for instructor use
     if author_mode:
@@ -377,12 +377,11 @@ def expand_include(course: sdrl.coursebuilder.Coursebuilder, macrocall: macros.M
     """
     fullfilename = includefile_path(course, macrocall)
     # print(f"## fullfilename: {fullfilename} ({macrocall.filename})")
-    if not os.path.exists(fullfilename):
+    if not course.files.exists(fullfilename):
         msgfunc = macrocall.warning if macrocall.arg1.startswith(c.AUTHOR_ALTDIR_PREFIX) else macrocall.error
         msgfunc(f"file '{fullfilename}' does not exist")  # noqa
         return ""
-    with open(fullfilename, "rt", encoding='utf8') as f:
-        rawcontent = f.read()
+    rawcontent = course.files.read(fullfilename)
     macrocall.md.includefiles.add(fullfilename)  # record that we have included this file
     if fullfilename.endswith('.md'):
         return macros.expand_macros(md.md.context_sourcefile, md.md.partname, rawcontent)
@@ -114,55 +114,86 @@ macro_regexp = (r"(?P<ppre></?p>)?"
 # suppress matches on normal links: [TEXT](url)
 macros_off_regexp = r"<!--\s*sedrila:\s*macros\s*off\s*-->"  # marker for non-nestable block without macro expansion
 macros_on_regexp = r"<!--\s*sedrila:\s*macros\s*off\s*end\s*-->"  # end marker
+# for expand_macros():
+macrostart_re = re.compile(r"\[[A-Z]|<!--")  # where a macro call or a macros-off block may begin
+macrocall_re = re.compile(macro_regexp.removeprefix(r"(?P<ppre></?p>)?"))  # ppre gets checked separately
+macros_off_block_re = re.compile(f"(?P<off>{macros_off_regexp})(?P<offcontent>.*?)(?P<on>{macros_on_regexp})",
+                                 flags=re.DOTALL)
+# (ppre, ppost) of a block macro call -> what they become (see "Solution of the <p>-problem" above):
+p_repairs: dict[MM, dict[tuple[str, str], tuple[str, str]]] = {
+    MM.BLOCKSTART: {("", ""): ("", ""),  # Layout 1, must not be used
+                    ("<p>", ""): ("", "<p>"),  # Layout 2: shift <p> from front to back
+                    ("", "</p>"): ("", ""),  # Layout 3: remove
+                    ("<p>", "</p>"): ("", "")},  # Layout 4: remove
+    MM.BLOCKEND: {("", ""): ("", ""),  # Layout 1, warned about at BLOCKSTART
+                  ("", "</p>"): ("</p>", ""),  # Layout 2: shift </p> from back to front
+                  ("<p>", ""): ("", ""),  # Layout 3: remove
+                  ("<p>", "</p>"): ("", "")},  # Layout 4: remove
+}
 
 
 def expand_macros(sourcefile: str, partname: str, markup: str, is_early_phase=False) -> str:
-    """Apply matching macrodefs, report errors for non-matching macro calls."""
-    def my_expand_macro(mm: re.Match) -> str:
-        return expand_macro(sourcefile, partname, mm, is_early_phase)
-
-    def extract_block(mm: re.Match) -> str:
-        # keep markers on first pass, remove them on second pass:
-        if is_early_phase:
-            # Normalize to multi-line form: if content is inline (no leading newline),
-            # add newlines around it. Otherwise Markdown moves same-line post-block
-            # content inside the block, hiding it from late-phase macro expansion.
-            content = mm.group(2).strip('\n')
-            blocks.append(f"{mm.group(1)}\n{content}\n{mm.group(3)}")
-        else:
-            blocks.append(mm.group(2))
-        return mm.group(1) + mm.group(3)
-
-    # Extract content of macros-off blocks, leaving only the adjacent markers:
-    blocks: list[str] = []
-    combined_regexp = f"({macros_off_regexp})(.*?)({macros_on_regexp})"
-    markup = re.sub(combined_regexp, extract_block, markup, flags=re.DOTALL)
-    # Expand macros in the remaining markup (block contents are absent):
-    markup = re.sub(macro_regexp, my_expand_macro, markup)
-    # Restore block contents in place of each adjacent marker pair:
-    block_iter = iter(blocks)
-    combined_markers_regexp = f"({macros_off_regexp})({macros_on_regexp})"
-    markup = re.sub(combined_markers_regexp, lambda mm: next(block_iter), markup)
-    return markup
-
-
-def expand_macro(sourcefile: str, partname: str, mm: re.Match, is_early_phase=False) -> str:
-    """Apply matching macrodef or report error or wait for late phase to report it then."""
-    global macrodefs_early, macrodefs_late
+    """
+    Apply matching macrodefs, report errors for non-matching macro calls.
+    Works in a single sweep over markup that jumps from one potential macro call or macros-off block
+    to the next, so most of the markup is only looked at by macrostart_re.
+    """
     import sdrl.markdown
+    md = sdrl.markdown.md
     macrodefs = (macrodefs_early if is_early_phase else macrodefs_late)
-    ppre, call, ppost = mm.group('ppre'), mm.group('macrocall'), mm.group('ppost')
+    pieces = []  # of the result
+    done = pos = 0  # markup[:done] is handled, markup[pos:] is still to be searched
+    while (start := macrostart_re.search(markup, pos)) is not None:
+        pos = start.start()
+        if markup.startswith("<!--", pos):
+            mm = macros_off_block_re.match(markup, pos)
+            if not mm:
+                pos += 4
+                continue
+            pieces.append(markup[done:pos])
+            if is_early_phase:  # keep markers
+                # Normalize to multi-line form: if content is inline (no leading newline),
+                # add newlines around it. Otherwise Markdown moves same-line post-block
+                # content inside the block, hiding it from late-phase macro expansion.
+                content = mm.group('offcontent').strip('\n')
+                pieces.append(f"{mm.group('off')}\n{content}\n{mm.group('on')}")
+            else:  # remove markers
+                pieces.append(mm.group('offcontent'))
+        else:
+            mm = macrocall_re.match(markup, pos)
+            if not mm:
+                pos += 1
+                continue
+            ppre = ""  # a <p> or </p> right before the call that no previous call has taken as its ppost
+            for tag in ("<p>", "</p>"):
+                if pos - len(tag) >= done and markup.startswith(tag, pos - len(tag)):
+                    ppre = tag
+            pieces.append(markup[done:pos - len(ppre)])
+            pieces.append(expand_macro(sourcefile, partname, ppre, mm, is_early_phase, macrodefs, md))
+        done = pos = mm.end()
+    pieces.append(markup[done:])
+    return "".join(pieces)
+
+
+def expand_macro(sourcefile: str, partname: str, ppre: str, mm: re.Match, is_early_phase: bool,
+                 macrodefs: dict[str, Macrodef], md: 'SedrilaMarkdown') -> str:  # noqa
+    """
+    Apply matching macrodef or report error or wait for late phase to report it then.
+    mm is a macrocall_re match, ppre is the <p> or </p> (or nothing) before it.
+    """
+    call, ppost = mm.group('macrocall'), mm.group('ppost')
     macroname, arg1, arg2 = mm.group('name'), mm.group('arg1'), mm.group('arg2')
-    macrocall = Macrocall(md=sdrl.markdown.md, filename=sourcefile, partname=partname,
+    macrocall = Macrocall(md=md, filename=sourcefile, partname=partname,
                           macrocall_text=call,
                           macroname=macroname, arg1=arg1, arg2=arg2)
     my_numargs = (arg1 is not None) + (arg2 is not None)
     # ----- check name:
-    if macroname not in macrodefs:
+    macrodef = macrodefs.get(macroname)
+    if macrodef is None:
         if not is_early_phase:  # so we do not complain twice
             macrocall.error(f"Macro '{macroname}' is not defined")
         return call  # unexpanded version helps the user most
-    numargs, mode, expander, switcher = macrodefs[macroname]
+    numargs, mode, expander, switcher = macrodef
     # ----- check args:
     if my_numargs != numargs:
         if not is_early_phase:  # so we do not complain twice
@@ -175,45 +206,15 @@ def expand_macro(sourcefile: str, partname: str, mm: re.Match, is_early_phase=Fa
     # b.debug(f"expanding {macrocall.macrocall_text}")
     expansion = expander(macrocall)
     # ----- handle ppre and ppost:
-    ppre = ppre if ppre else ""  # fill in "" for None
-    ppost = ppost if ppost else ""
-    if mode == MM.EARLY:
-        pass  # use ppre, ppost verbatim
-    elif mode == MM.INNER:
-        pass  # ditto
-    elif mode == MM.BLOCK:
-        pass  # ditto
-    elif mode == MM.BLOCKSTART:
-        if not ppre and not ppost:  # Layout 1
+    ppost = ppost or ""  # fill in "" for None
+    repairs = p_repairs.get(mode)
+    if repairs:  # a block macro
+        if not ppre and not ppost and mode == MM.BLOCKSTART:  # Layout 1
             macrocall.warning("blockmacro blocks must have an empty line before and after")
-        elif ppre == '<p>' and not ppost:  # Layout 2
-            ppost = ppre  # shift <p> from front to back
-            ppre = ""
-        elif not ppre and ppost == '</p>':  # Layout 3
-            ppost = ""  # remove
-        elif ppre == '<p>' and ppost == '</p>':  # Layout 4
-            ppre = ""  # remove
-            ppost = ""  # remove
-        else:
-            assert False
-    elif mode == MM.BLOCKEND:
-        if not ppre and not ppost:  # Layout 1
-            pass  # warn at BLOCKSTART
-        elif not ppre and ppost == '</p>':  # Layout 2
-            ppre = ppost  # shift </p> from back to front
-            ppost = ""
-        elif ppre == '<p>' and not ppost:  # Layout 3
-            ppre = ""  # remove
-        elif ppre == '<p>' and ppost == '</p>':  # Layout 4
-            ppre = ""  # remove
-            ppost = ""  # remove
-        else:
-            assert False, mm.group()
-    else:
-        assert False    
+        assert (ppre, ppost) in repairs, mm.group()
+        ppre, ppost = repairs[(ppre, ppost)]
     # return f"pre<{ppre}>exp<{expansion}>post<{ppost}>"
-    result = f"{ppre}{expansion}{ppost}"
-    return result
+    return f"{ppre}{expansion}{ppost}"
 
 
 def get_state(namespace: str) -> tg.Any:
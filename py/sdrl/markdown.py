@@ -1,24 +1,44 @@
 """
 Markdown rendering with sedrila-specific bells and/or whistles.
 """
+import os
 import re
+import time
 import typing as tg
 from typing import TYPE_CHECKING
 
 import markdown
 import markdown.extensions as mde
+import markdown.extensions.attr_list as mdattrlist
+import markdown.extensions.codehilite as mdcodehilite
+import markdown.extensions.fenced_code as mdfenced
 import markdown.preprocessors as mdpre
 import markdown.postprocessors as mdpost
+import markdown.serializers as mdserializers
+import pygments
 
 import base as b
+import memo
 import sdrl.macros as macros
 import sdrl.replacements as replacements
+import tracing
 
 # a ```mermaid ... ``` fenced block (fence lines may carry trailing whitespace):
 mermaid_fence_re = re.compile(r"^```mermaid[^\S\n]*\n(.*?)\n^```[^\S\n]*$",
                               flags=re.DOTALL | re.MULTILINE)
 MERMAID_DIV_START = '<div class="mermaid">'  # what a mermaid fence turns into
 
+# what makes split_blocks() give up, because it affects the rendering of other blocks:
+wholedoc_re = re.compile(r"^ {0,3}\[[^\[\]\n]*\]:|\[TOC\]", flags=re.MULTILINE)  # link reference definition
+# the opening line of a fenced code block, as in markdown.extensions.fenced_code:
+fence_start_re = re.compile(r"""^(`{3,}|~{3,})[ ]*(\{[^\n]*\}|(\.?[\w#.+-]*[ ]*)?(hl_lines=("|').*?\5[ ]*)?)$""")
+html_start_re = re.compile(r"^ {0,3}<([A-Za-z][A-Za-z0-9-]*)", flags=re.MULTILINE)  # perhaps a raw HTML block
+attached_start_re = re.compile(r"^([ \t]|[*+>-]|\d+[.)]([ \t]|$))")  # indented, list item, blockquote
+BLOCK_SENTINEL = "SEDRILABLOCKSENTINEL"  # see convert_block()
+id_re = re.compile(r'\sid="([^"]*)"')
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source',
+                 'track', 'wbr'}
+
 
 def uses_mermaid(html: str) -> bool:
     """Whether rendered page content contains a mermaid diagram and hence needs mermaid.js loaded."""
@@ -79,18 +99,132 @@ class SedrilaPostprocessor(mdpost.Postprocessor):
         return text
 
 
+class MemoizingCodeHilite(mdcodehilite.CodeHilite):
+    """
+    CodeHilite that takes the HTML from the memo of its Markdown instance if the same code has been
+    highlighted with the same settings before (e.g. an [INCLUDE]d file in another task), because Pygments is slow.
+    """
+    def __init__(self, src: str, markdown_instance: markdown.Markdown, **options):
+        super().__init__(src, **options)
+        self.memo = getattr(markdown_instance, 'memo', None)
+
+    def hilite(self, shebang: bool = True) -> str:
+        if not self.memo:
+            return super().hilite(shebang)
+        settings = (self.lang, self.guess_lang, self.use_pygments, self.lang_prefix, self.pygments_formatter,
+                    sorted(self.options.items()), shebang)
+        key = memo.key_of(MEMO_SALT, "hilite", repr(settings), self.src)
+        html = self.memo.get(key)
+        if html is None:
+            html = super().hilite(shebang)
+            self.memo.put(key, html)
+        return html
+
+
+class MemoizingHiliteTreeprocessor(mdcodehilite.HiliteTreeprocessor):
+    """HiliteTreeprocessor.run() of Python-Markdown 3.7, but with MemoizingCodeHilite."""
+    def run(self, root):
+        for block in root.iter('pre'):
+            if len(block) == 1 and block[0].tag == 'code':
+                local_config = self.config.copy()
+                text = block[0].text
+                if text is None:
+                    continue
+                code = MemoizingCodeHilite(self.code_unescape(text), self.md, tab_length=self.md.tab_length,
+                                           style=local_config.pop('pygments_style', 'default'), **local_config)
+                placeholder = self.md.htmlStash.store(code.hilite())
+                block.clear()  # turn the block into a paragraph that will be replaced by the stashed html
+                block.tag = 'p'
+                block.text = placeholder
+
+
+class MemoizingFencedBlockPreprocessor(mdfenced.FencedBlockPreprocessor):
+    """FencedBlockPreprocessor.run() of Python-Markdown 3.7, but with MemoizingCodeHilite."""
+    def run(self, lines: list[str]) -> list[str]:
+        if not self.checked_for_deps:
+            for ext in self.md.registeredExtensions:
+                if isinstance(ext, mdcodehilite.CodeHiliteExtension):
+                    self.codehilite_conf = ext.getConfigs()
+                if isinstance(ext, mdattrlist.AttrListExtension):
+                    self.use_attr_list = True
+            self.checked_for_deps = True
+        text = "\n".join(lines)
+        index = 0
+        while mm := self.FENCED_BLOCK_RE.search(text, index):
+            lang, id, classes, config = None, '', [], {}
+            if mm.group('attrs'):
+                attrs, remainder = mdattrlist.get_attrs_and_remainder(mm.group('attrs'))
+                if remainder:  # unmatched curly braces: not a fenced block
+                    index = mm.end('attrs')
+                    continue
+                id, classes, config = self.handle_attrs(attrs)
+                if classes:
+                    lang = classes.pop(0)
+            else:
+                lang = mm.group('lang') or None
+                if mm.group('hl_lines'):
+                    config['hl_lines'] = mdcodehilite.parse_hl_lines(mm.group('hl_lines'))
+            if self.codehilite_conf and self.codehilite_conf['use_pygments'] and config.get('use_pygments', True):
+                local_config = self.codehilite_conf.copy()
+                local_config.update(config)
+                if classes:  # Pygments may append a suffix to css_class, so it goes last
+                    local_config['css_class'] = f"{' '.join(classes)} {local_config['css_class']}"
+                hiliter = MemoizingCodeHilite(mm.group('code'), self.md, lang=lang,
+                                              style=local_config.pop('pygments_style', 'default'), **local_config)
+                code = hiliter.hilite(shebang=False)
+            else:
+                code = self.plain_code(mm.group('code'), lang, id, classes, config)
+            placeholder = self.md.htmlStash.store(code)
+            text = f'{text[:mm.start()]}\n{placeholder}\n{text[mm.end():]}'
+            index = mm.start() + 1 + len(placeholder)
+        return text.split("\n")
+
+    def plain_code(self, code: str, lang: str | None, id: str, classes: list[str], config: dict) -> str:
+        """The <pre><code> for a fenced block that Pygments does not highlight."""
+        escape = mdserializers._escape_attrib_html
+        id_attr = lang_attr = class_attr = kv_pairs = ''
+        if lang:
+            lang_attr = f' class="{self.config.get("lang_prefix", "language-")}{escape(lang)}"'
+        if classes:
+            class_attr = f' class="{escape(" ".join(classes))}"'
+        if id:
+            id_attr = f' id="{escape(id)}"'
+        if self.use_attr_list and config and not config.get('use_pygments', False):
+            kv_pairs = ''.join(f' {k}="{escape(v)}"' for k, v in config.items() if k != 'use_pygments')
+        return f'<pre{id_attr}{class_attr}><code{lang_attr}{kv_pairs}>{self._escape(code)}</code></pre>'
+
+
+class MemoizingCodeHiliteExtension(mdcodehilite.CodeHiliteExtension):
+    """codehilite with the memo of the Markdown instance, if it has one. See MemoizingCodeHilite."""
+    def extendMarkdown(self, md: markdown.Markdown):
+        super().extendMarkdown(md)
+        hiliter = MemoizingHiliteTreeprocessor(md)
+        hiliter.config = self.getConfigs()
+        md.treeprocessors.register(hiliter, 'hilite', 30)  # replaces the plain one
+
+
+class MemoizingFencedCodeExtension(mdfenced.FencedCodeExtension):
+    """fenced_code with the memo of the Markdown instance, if it has one. See MemoizingCodeHilite."""
+    def extendMarkdown(self, md: markdown.Markdown):
+        super().extendMarkdown(md)
+        md.preprocessors.register(MemoizingFencedBlockPreprocessor(md, self.getConfigs()),
+                                  'fenced_code_block', 25)  # replaces the plain one
+
+
 class SedrilaMarkdown(markdown.Markdown):
+    memo: tg.Optional[memo.Memo]  # rendered blocks and highlighted code, see convert_block()
     mode: macros.MM
     context_sourcefile: str
     partname: str
     blockmacro_topmatter: dict[str, str]
-    course: tg.Optional['sdrl.coursebuilder.Coursebuilder']  # For accessing chapterdir/altdir
+    course: tg.Optional['sdrl.coursebuilder.Coursebuilder']  # For accessing chapterdir/altdir and files
     includefiles: set[str]  # [INCLUDE::...], [PROT::...] will add a filename here
     termrefs: set[str]  # [TERMREF::...] will add a term alias here
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.course = None
+        self.memo = None
 
 
 def render_markdown(context_sourcefile: str, partname: str, markdown_markup: str, 
@@ -105,10 +239,144 @@ def render_markdown(context_sourcefile: str, partname: str, markdown_markup: str
     md.blockmacro_topmatter = blockmacro_topmatter
     md.includefiles = set()
     md.termrefs = set()
-    html = md.reset().convert(markdown_markup)
+    md.reset()
+    if markdown_markup.strip():  # the same steps as md.convert(), except for the blockwise middle part
+        lines = md.preprocessors['sedrila_preprocessor'].run(markdown_markup.split("\n"))
+        html = convert_blocks("\n".join(lines)).strip()
+        html = md.postprocessors['sedrila_postprocessor'].run(html).strip()
+    else:
+        html = ""
     return dict(html=html, includefiles=md.includefiles, termrefs=md.termrefs)
 
 
+def convert_blocks(markup: str) -> str:
+    """
+    Plain Markdown-to-HTML conversion of markup (whose sedrila macros are expanded as far as EARLY goes),
+    one split_blocks() block at a time, so that the HTML of unchanged blocks can come from md.memo.
+    """
+    blocks = split_blocks(markup)
+    html = "\n".join(convert_block(block) for block in blocks)
+    if len(blocks) > 1:
+        ids = id_re.findall(html)
+        if len(ids) != len(set(ids)):  # the toc extension makes heading ids unique only within a block
+            html = convert_block(markup)
+    return html
+
+
+def convert_block(markup: str) -> str:
+    key = memo.key_of(MEMO_SALT, markup)
+    html = md.memo.get(key) if md.memo else None
+    if html is None:
+        plain_md.memo = md.memo  # for highlighting
+        # Markdown strips the end of its output, so we convert with a sentinel paragraph behind the block 
+        # to get the block's HTML as it would be in the middle of a document:
+        html = plain_md.reset().convert(f"{markup}\n\n{BLOCK_SENTINEL}")
+        sentinel_html = f"\n<p>{BLOCK_SENTINEL}</p>"
+        if html.endswith(sentinel_html):
+            html = html.removesuffix(sentinel_html)
+        else:  # the block has swallowed the sentinel
+            html = plain_md.reset().convert(markup)
+        if md.memo:
+            md.memo.put(key, html)
+    return html
+
+
+def split_blocks(markup: str) -> list[str]:
+    """
+    Cut markup at blank lines into blocks that Markdown renders independently of each other.
+    No block ends within a fenced code block or an open raw HTML element (or comment), and a chunk 
+    that Markdown may attach to what precedes it (indented text, list item, blockquote) stays with that.
+    Link reference definitions and [TOC] work across blocks, so markup with them becomes a single block.
+    """
+    if wholedoc_re.search(markup):
+        return [markup]
+    blocks: list[tuple[list[str], list[str]]] = []  # the lines of each block, and those not in fenced code
+    separator, lines, plain = [], [], []  # blank lines before the current chunk, its lines, its non-code lines
+    fence = None  # when in a fenced code block: the closing fence
+    
+    def end_chunk():
+        if not lines:
+            return
+        if blocks and (attached_start_re.match(lines[0]) or has_open_html(blocks[-1][1])):
+            blocks[-1][0].extend(separator + lines)
+            blocks[-1][1].extend(plain)
+        else:
+            blocks.append((lines.copy(), plain.copy()))
+        separator.clear()
+        lines.clear()
+        plain.clear()
+
+    for line in markup.split("\n"):
+        if fence is None and not line.strip(" \t\r"):  # a blank line
+            end_chunk()
+            if blocks:
+                separator.append(line)
+            continue
+        lines.append(line)
+        if fence is not None:
+            if line.rstrip(" ") == fence:
+                fence = None
+        elif mm := fence_start_re.match(line):
+            fence = mm.group(1)
+        else:
+            plain.append(line)
+    end_chunk()
+    return ["\n".join(blocklines) for blocklines, _ in blocks]
+
+
+def has_open_html(lines: list[str]) -> bool:
+    """Whether lines begin a raw HTML element or comment that they do not end."""
+    text = "\n".join(lines)
+    if text.count("<!--") > text.count("-->"):
+        return True
+    for tag in {mm.group(1).lower() for mm in html_start_re.finditer(text)} - VOID_ELEMENTS:
+        opened = len(re.findall(f"<{tag}(?=[\\s/>])", text, flags=re.IGNORECASE))
+        closed = len(re.findall(f"</{tag}\\s*>", text, flags=re.IGNORECASE))
+        if opened > closed:
+            return True
+    return False
+
+
+def render_markdown_in_worker(args: tuple) -> b.StrAnyDict:
+    """
+    render_markdown(*args) in a worker process forked from the build process (see Directory.build()).
+    The fork has its own copy of md and of the macro registry, so both need no setup here.
+    Messages and dirty files are not printed/registered but returned, for use_worker_result(),
+    and so is the timing of the rendering, as a tracing.Span whose thread is the worker's process id.
+    """
+    span = tracing.Span("", args[1], start=time.perf_counter(), thread=os.getpid())
+    cpustart = time.thread_time()
+    msgs, dirtyfiles = [], []
+    b.collect_msgs(msgs)
+    b.set_register_files_callback(dirtyfiles.append)
+    partname = args[1]
+    macros.switch_part(partname)
+    try:
+        result = render_markdown(*args)
+    except b.CritialError as exc:
+        result = dict(critical=str(exc))
+    span.duration = time.perf_counter() - span.start
+    span.cputime = time.thread_time() - cpustart
+    result.update(msgs=msgs, dirtyfiles=dirtyfiles, memonews=md.memo.take_news() if md.memo else None,
+                  filestats=md.course.files.take_stats() if md.course else None, span=span)
+    return result
+
+
+def use_worker_result(result: b.StrAnyDict) -> b.StrAnyDict:
+    """Replay the messages and dirty files of a render_markdown_in_worker() result in the build process."""
+    for filename in result['dirtyfiles']:
+        b.register_files_callback(filename)
+    for msg, tag, count in result['msgs']:
+        b.rich_print(msg, tag, count)
+    if result['memonews'] and md.memo:
+        md.memo.add_news(result['memonews'])
+    if result['filestats'] and md.course:
+        md.course.files.add_stats(result['filestats'])
+    if 'critical' in result:
+        raise b.CritialError(result['critical'])
+    return result
+
+
 def render_plain_markdown(markdown_markup: str) -> str:
     """Markdown-to-HTML rendering without sedrila macros (etc.)"""
     my_extensions = extensions[1:]  # all except SedrilaExtension
@@ -119,7 +387,7 @@ def render_plain_markdown(markdown_markup: str) -> str:
 # ######### initialization:
 
 extensions = [SedrilaExtension(), # must be first, see render_plain_markdown()
-              'attr_list', 'codehilite', 'fenced_code',
+              'attr_list', MemoizingCodeHiliteExtension(linenums=True), MemoizingFencedCodeExtension(),
               'sane_lists', 'tables', 'toc', 'smarty',
               ]
 # https://python-markdown.github.io/extensions/attr_list/
@@ -135,14 +403,16 @@ extension_configs = {
     'toc': {
         # 'slugify':  perhaps replace with numbering-aware version 
     },
-    'codehilite': {
-        'linenums': True
-    },
     'smarty': {
         'smart_quotes': False
     }
 }
 
 md = SedrilaMarkdown(extensions=extensions, extension_configs=extension_configs)
+plain_md = markdown.Markdown(extensions=extensions[1:], extension_configs=extension_configs)  # see convert_block()
+plain_md.memo = None
+MEMO_SALT = repr((markdown.__version__, pygments.__version__, 
+                  [ext if isinstance(ext, str) else (type(ext).__name__, ext.getConfigs()) for ext in extensions[1:]],
+                  extension_configs))
 # '[TOC]' is Markdown, but looks syntactically like a macro call, so make 'TOC' a macro:
 macros.register_macro('TOC', 0, macros.MM.INNER, lambda mc: f"[{mc.macroname}]")
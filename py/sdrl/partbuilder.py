@@ -1,10 +1,12 @@
 """Helper functionality extracted from Parts and Pieces to make them lighter."""
+import functools
 import glob
 import os
 import re
 import typing as tg
 
 import jinja2
+import jinja2.meta
 import yaml
 
 import base as b
@@ -17,6 +19,7 @@ import sdrl.markdown as md
 
 class PartbuilderMixin:  # to be mixed into a Part class
     TEMPLATENAME = "??.html"  # defined by each partbuilder class
+    CONFIGKEYS = ('title',)  # config settings that render_structure() reads
 
     directory: dir.Directory
     metadata_text: str  # the YAML front matter character stream
@@ -35,6 +38,13 @@ class PartbuilderMixin:  # to be mixed into a Part class
     def to_be_skipped(self) -> bool:
         return False  # redefined in concrete part classes
 
+    @property
+    def term_use(self) -> b.StrAnyDict:
+        """The value of our el.TermUse."""
+        if self.to_be_skipped:
+            return dict(skipped=True)
+        return dict(explains=sorted(set(getattr(self, 'explains', []))))
+
     @property
     def toc_entry(self) -> str:
         classes = f"stage-{self.stage}" if self.stage else "no-stage"
@@ -63,6 +73,18 @@ class PartbuilderMixin:  # to be mixed into a Part class
     def as_json(self) -> b.StrAnyDict:
         return dict(title=self.title)  # noqa
 
+    def reset(self):
+        """Also forget the values of cached_properties such as toc: they derive from the topmatter."""
+        super().reset()  # noqa
+        for cls in type(self).__mro__:
+            for name, attr in vars(cls).items():
+                if isinstance(attr, functools.cached_property):
+                    self.__dict__.pop(name, None)
+
+    def my_prerequisites(self) -> tg.Iterable[el.Element]:
+        import sdrl.coursebuilder
+        return self.directory.get_all(sdrl.coursebuilder.MetadataDerivation)  # it sets our attributes
+
     def evaluate_stage(self, context: str, course) -> None:
         """
         Cut the 'stage' attribute down to its first word, check it against course.stages, report violations.
@@ -106,7 +128,22 @@ class PartbuilderMixin:  # to be mixed into a Part class
         self.make_dependency(el.Body_s, part=self, includelist_class=el.IncludeList_s)
         self.make_dependency(el.Body_i, part=self, includelist_class=el.IncludeList_i)
         self.make_dependency(el.TermrefList, part=self)
-        self.make_or_get_dependency(el.Toc, name=use_toc_of.name, part=use_toc_of)
+        self.directory.make_the(el.TermUse, self.name, part=self)  # for the glossary
+        self.make_toc_dependency(use_toc_of)
+        self.make_layout_dependencies()
+
+    def make_toc_dependency(self, use_toc_of: el.Part):
+        """Depend on the toc the page embeds; with a shared toc, the page contains none."""
+        if not self.course.shared_toc:  # noqa
+            self.make_or_get_dependency(el.Toc, name=use_toc_of.name, part=use_toc_of)  # noqa
+
+    def make_layout_dependencies(self):
+        """Depend on the templates and config settings render_structure() uses, but not on those of the Body."""
+        for configname in (el.Configelement.VERSION, el.Configelement.RESOURCES, el.Configelement.SHARED_TOC,
+                           *self.CONFIGKEYS):
+            self.add_dependency(self.directory.get_the(el.Configelement, configname))  # noqa
+        for templatefile in template_files(self.course.templatedir, self.TEMPLATENAME):  # noqa
+            self.make_or_get_dependency(el.Sourcefile, name=templatefile)  # noqa
 
     def process_topmatter(self, sourcefile: str, topmatter: b.StrAnyDict, course):
         assert False  # must be defined in concrete classes
@@ -132,20 +169,18 @@ class PartbuilderMixin:  # to be mixed into a Part class
             self.metadata = dict()  # use empty metadata as a weak replacement
 
     def render_structure(self, course, part: el.Part, body: str, targetdir: str, info=True):
-        env = jinja2.Environment(loader=jinja2.FileSystemLoader(course.templatedir), autoescape=False)
-        template = env.get_template(self.TEMPLATENAME)  # noqa
-        output = template.render(sitetitle=course.title,
-                                 breadcrumb=h.breadcrumb(*self.structure_path()[::-1]),
+        template = course.template(self.TEMPLATENAME)
+        output = template.render(breadcrumb=h.breadcrumb(*self.structure_path()[::-1]),
                                  title=part.title,
                                  linkslist_top=getattr(part, 'linkslist_top', ""),
                                  linkslist_bottom=getattr(part, 'linkslist_bottom', ""),
                                  taskgroup_diagram_file=getattr(part, 'diagram_filename', ""),
                                  taskgroup_diagram_style=getattr(part, 'diagram_style', ""),
                                  part=self,
-                                 toc=part.toc,
+                                 toc="" if course.shared_toc else part.toc,
                                  uses_mermaid=md.uses_mermaid(body),
                                  content=body)
-        b.spit(f"{targetdir}/{self.outputfile}", output)  # noqa
+        self.write_output(f"{targetdir}/{self.outputfile}", output)  # noqa
         if info:
             b.info(f"{targetdir}/{self.outputfile}")  # noqa
 
@@ -171,28 +206,103 @@ class PartbuilderMixin:  # to be mixed into a Part class
 
 
 def toc(structure: el.Part) -> str:
-    """Return a table-of-contents HTML fragment for the given structure via structural recursion."""
+    """Return a table-of-contents HTML fragment for the given structure, expanded along its structure_path()."""
     import sdrl.coursebuilder
     parts = structure.structure_path()
-    fulltoc = len(parts) == 1  # path only contains course
     assert isinstance(parts[-1], sdrl.coursebuilder.Coursebuilder)
     course = tg.cast(sdrl.coursebuilder.Coursebuilder, parts[-1])
-    result = ['']  # start with a newline
-    for chapter in course.chapters:  # noqa
-        if chapter.to_be_skipped:
-            continue
-        result.append(chapter.toc_entry)
-        if not fulltoc and chapter not in parts:
-            continue
-        for taskgroup in chapter.taskgroups:
-            effective_tasklist = [t for t in course.taskorder 
-                                  if t in taskgroup.tasks and not t.to_be_skipped]
-            if taskgroup.to_be_skipped or not effective_tasklist:
-                continue
-            result.append(taskgroup.toc_entry)
-            if not fulltoc and taskgroup not in parts:
-                continue
-            for task in effective_tasklist:
-                result.append(task.toc_entry)
-    result.append(course.glossary.toc_entry)
-    return "\n".join(result)
+    if len(parts) == 1:  # path only contains course
+        return course.structureindex.toc(full=True)
+    chapter = next((part for part in parts if isinstance(part, sdrl.coursebuilder.Chapter)), None)
+    taskgroup = next((part for part in parts if isinstance(part, sdrl.coursebuilder.Taskgroup)), None)
+    return course.structureindex.toc(chapter, taskgroup)
+
+
+class Structureindex:
+    """
+    The parts that tocs show, in toc order, computed once per build after MetadataDerivation:
+    the chapters not to be skipped, their taskgroups that have tasks, and those tasks in course.taskorder.
+    Toc entries and tocs are memoized, as many parts share the same toc.
+    """
+    chapters: list[el.Part]
+    taskgroups: dict[el.Part, list[el.Part]]  # chapter -> taskgroups
+    tasks: dict[el.Part, list[el.Part]]  # taskgroup -> tasks
+
+    def __init__(self, course):
+        self.course = course
+        self.chapters = [chapter for chapter in course.chapters if not chapter.to_be_skipped]
+        self.taskgroups = dict()
+        self.tasks = dict()
+        position = {task: i for i, task in enumerate(course.taskorder)}
+        for chapter in self.chapters:
+            self.taskgroups[chapter] = []
+            for taskgroup in chapter.taskgroups:
+                tasks = sorted((task for task in taskgroup.tasks if task in position and not task.to_be_skipped),
+                               key=position.get)
+                if taskgroup.to_be_skipped or not tasks:
+                    continue
+                self.taskgroups[chapter].append(taskgroup)
+                self.tasks[taskgroup] = tasks
+        self._entries = dict()  # part -> toc_entry
+        self._tocs = dict()  # (chapter, taskgroup, full) -> toc
+
+    def toc_entry(self, part: el.Part) -> str:
+        if part not in self._entries:
+            self._entries[part] = part.toc_entry  # noqa
+        return self._entries[part]
+
+    def toc(self, chapter: el.Part | None = None, taskgroup: el.Part | None = None, full=False) -> str:
+        """
+        Toc listing all chapters plus the glossary. Taskgroups are listed for chapter (or all chapters if full),
+        tasks for taskgroup (or all taskgroups if full).
+        """
+        key = (chapter, taskgroup, full)
+        if key not in self._tocs:
+            result = ['']  # start with a newline
+            for ch in self.chapters:
+                result.append(self.toc_entry(ch))
+                if not full and ch is not chapter:
+                    continue
+                for group in self.taskgroups[ch]:
+                    result.append(self.toc_entry(group))
+                    if not full and group is not taskgroup:
+                        continue
+                    result.extend(self.toc_entry(task) for task in self.tasks[group])
+            result.append(self.toc_entry(self.course.glossary))
+            self._tocs[key] = "\n".join(result)
+        return self._tocs[key]
+
+
+@functools.cache
+def template_files(templatedir: str, templatename: str) -> tuple[str, ...]:
+    """Paths of the existing files of templatename and of the templates it extends, includes, or imports."""
+    path = os.path.join(templatedir, templatename)
+    if not os.path.exists(path):
+        return ()  # render_structure() will complain
+    result = [path]
+    ast = jinja2.Environment().parse(b.slurp(path))
+    for name in jinja2.meta.find_referenced_templates(ast):
+        if name:  # None for computed names
+            result.extend(f for f in template_files(templatedir, name) if f not in result)
+    return tuple(result)
+
+
+def references_new_templates(templatedir: str, templatefile: str, known: set[str]) -> bool:
+    """Whether templatefile now extends, includes, or imports (perhaps indirectly) existing files not in known."""
+    template_files.cache_clear()  # templates may have changed since
+    try:
+        files = template_files(templatedir, os.path.relpath(templatefile, templatedir))
+    except jinja2.TemplateError:
+        return False  # render_structure() will complain
+    return any(os.path.normpath(f) not in known for f in files)
+
+
+def template_environment(templatedir: str, bytecodedir: str) -> jinja2.Environment:
+    """
+    Jinja2 Environment for the templates in templatedir, to be shared by all pages of a build.
+    Compiled templates are kept in memory by the Environment and on disk in bytecodedir,
+    where Jinja2 keys them by a checksum of the template source.
+    """
+    os.makedirs(bytecodedir, exist_ok=True)
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(templatedir), autoescape=False,
+                              bytecode_cache=jinja2.FileSystemBytecodeCache(bytecodedir))
@@ -7,6 +7,7 @@ import base as b
 import sdrl.html as h
 
 if tg.TYPE_CHECKING:
+    import tracing
     import sdrl.course
     import sdrl.course_si
     import sdrl.participant
@@ -123,6 +124,24 @@ def print_author_volume_report(course: 'sdrl.course.Course'):
         b.rich_print(table)  # noqa
 
 
+def print_build_profile(tracer: 'tracing.Tracer'):
+    """Show count, builds, and time per Element type, most expensive first (see Directory.tracer)."""
+    table = b.Table()
+    table.add_column("Element type")
+    for head in ("#Elements", "#Built", "#Reused", "Wall s", "CPU s"):
+        table.add_column(head, justify="right")
+    total = None
+    for category, count, built, duration, cputime in tracer.summary():
+        if category == "Directory":  # the span of the entire Directory.build()
+            total = (duration, cputime)
+            continue
+        table.add_row(category, str(count), str(built), str(count - built),
+                      "%7.2f" % duration, "%7.2f" % cputime)
+    if total:
+        table.add_row("[b]=TOTAL", "", "", "", "[b]%7.2f" % total[0], "[b]%7.2f" % total[1])
+    b.rich_print(table)  # noqa
+
+
 def print_si_volume_report(student: 'sdrl.participant.Student'):
     """Show worktime, accepted, and rejected timevalues per difficulty and chapter."""
     import sdrl.course_si
@@ -8,11 +8,12 @@ import re
 from typing import Callable, Optional
 
 import base as b
+import filecache
 import sdrl.constants as c
 import sdrl.macros as macros
 
 IDENTIFIER_RE = re.compile(r'^[A-Za-z0-9_]+$')
-_snippet_cache: dict[str, list['CodeSnippet']] = {}
+_files = filecache.FileCache()  # for courses that have no FileCache, see _files_of()
 
 
 @dataclasses.dataclass
@@ -353,12 +354,14 @@ def _display_snippet_path(filespec: str | None, fullpath: str, course) -> str:
         return fullpath
 
 
-def _get_snippets_cached(filepath: str) -> list[CodeSnippet]:
-    """Return all snippets from filepath, reading and caching on first access."""
-    canonical = os.path.realpath(filepath)
-    if canonical not in _snippet_cache:
-        _snippet_cache[canonical] = SnippetExtractor().extract_snippets_from_file(filepath)
-    return _snippet_cache[canonical]
+def _files_of(course) -> filecache.FileCache:
+    """The FileCache of an author-mode course, else one shared by all other callers."""
+    return getattr(course, 'files', None) or _files
+
+
+def _get_snippets_cached(filepath: str, files: filecache.FileCache) -> list[CodeSnippet]:
+    """Return all snippets from filepath, reading it only if it is new or has changed."""
+    return files.derived(filepath, 'snippets', SnippetExtractor().extract_snippets_from_file)
 
 
 def _load_snippet(
@@ -374,10 +377,11 @@ def _load_snippet(
     except ValueError as exc:
         notify_error(str(exc))
         return None, None
-    if not os.path.exists(fullpath):
+    files = _files_of(course)
+    if not files.exists(fullpath):
         notify_error(f"File not found: {_display_snippet_path(filespec, fullpath, course)}")
         return None, None
-    snippets = _get_snippets_cached(fullpath)
+    snippets = _get_snippets_cached(fullpath, files)
     for snippet in snippets:
         if snippet.snippet_id == snippet_id:
             return snippet, fullpath
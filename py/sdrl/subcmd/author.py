@@ -6,18 +6,25 @@ import argparse
 import json
 import os
 import os.path
+import re
+import sys
 import typing as tg
 
 import click
 
 import base as b
 import cache
+import filewatch
+import manifest
+import precompress
+import tracing
 import sdrl.constants as c
 import sdrl.course
 import sdrl.coursebuilder
 import sdrl.elements as el
 import sdrl.directory as dir
 import sdrl.macroexpanders as macroexpanders
+import sdrl.partbuilder
 import sdrl.rename
 import sdrl.report
 
@@ -42,19 +49,60 @@ def author_command():
     "--config", type=str, default=c.AUTHOR_CONFIG_FILENAME,
     help="SeDriLa configuration description YAML file"
 )
+@click.option("--jobs", type=click.IntRange(min=1), default=1,
+              help="number of processes for rendering Markdown and of threads for other outputs")
+@click.option("--hashes", default=False, is_flag=True,
+              help="detect changed files by content hash instead of modification time")
+@click.option("--profile", type=click.Path(), default="", metavar="TRACEFILE",
+              help="print build time per element type and write a Chrome trace JSON file of all element builds")
+@click.option("--compress", default=False, is_flag=True,
+              help="also write precompressed .gz (and .br) files for the web server")
+@click.option("--compress-best", default=False, is_flag=True,
+              help="like --compress, but with the strongest and much slower compression")
+@click.option("--fingerprint", default=False, is_flag=True,
+              help="refer to baseresources by content-hash names that browsers may cache forever")
+@click.option("--shared-toc", default=False, is_flag=True,
+              help="write the table of contents once into toc.js instead of into every page")
 def build_command(
     targetdir: str, print_status: bool,
-    include_stage: str, config: str,
+    include_stage: str, config: str, jobs: int, hashes: bool, profile: str, compress: bool, compress_best: bool,
+    fingerprint: bool, shared_toc: bool,
 ):
     """Build the SeDriLa course"""
     targetdir_s = targetdir
     targetdir_i = _targetdir_i(targetdir)
     prepare_directories(targetdir_s, targetdir_i)
-    create_and_build_course2(dict(config=config, include_stage=include_stage, sums=print_status), 
+    create_and_build_course2(dict(config=config, include_stage=include_stage, sums=print_status, jobs=jobs,
+                                  hashes=hashes, profile=profile, compress=compress, compress_best=compress_best,
+                                  fingerprint=fingerprint, shared_toc=shared_toc),
                              targetdir_i, targetdir_s)
     b.finalmessage()
 
 
+@author_command.command(name="watch")
+@click.argument("targetdir", type=click.Path())
+@click.option(
+    "--include-stage", type=str, default="",
+    help="include parts with this and higher 'stage:'"
+)
+@click.option(
+    "--config", type=str, default=c.AUTHOR_CONFIG_FILENAME,
+    help="SeDriLa configuration description YAML file"
+)
+@click.option("--jobs", type=click.IntRange(min=1), default=1,
+              help="number of processes for rendering Markdown and of threads for other outputs")
+@click.option("--hashes", default=False, is_flag=True,
+              help="detect changed files by content hash instead of modification time")
+def watch_command(targetdir: str, include_stage: str, config: str, jobs: int, hashes: bool):
+    """Build the SeDriLa course, then rebuild it whenever source files change"""
+    targetdir_s = targetdir
+    targetdir_i = _targetdir_i(targetdir)
+    prepare_directories(targetdir_s, targetdir_i)
+    watch_and_build(dict(config=config, include_stage=include_stage, sums=False, jobs=jobs, hashes=hashes,
+                         profile="", fingerprint=False, shared_toc=False),
+                    targetdir_i, targetdir_s)
+
+
 @author_command.command(name="rename")
 @click.option(
     "--config", type=str, default=c.AUTHOR_CONFIG_FILENAME,
@@ -76,6 +124,15 @@ def clear_cache_command(targetdir: str):
     delete_cache(targetdir_i)
 
 
+@author_command.command(name="changed-files")
+@click.argument("targetdir", type=click.Path(exists=True))
+@click.option("--since", type=click.Path(exists=True), default="", metavar="MANIFEST",
+              help="manifest of the deployed state, a copy of the one from an earlier build (default: none)")
+def changed_files_command(targetdir: str, since: str):
+    """List output files added (A), changed (M), or deleted (D) since MANIFEST"""
+    print_changed_files(targetdir, since)
+
+
 @author_command.command(name="status")
 def status_command():
     """[NOT IMPLEMENTED] use sedrila author build --print-status"""
@@ -84,30 +141,195 @@ def status_command():
 
 
 def delete_cache(targetdir_i: str):
-    p = os.path.join(targetdir_i, c.CACHE_FILENAME)
-    if os.path.exists(p): os.remove(p)
+    cache.remove_cachefiles(os.path.join(targetdir_i, c.CACHE_FILENAME))
 
 def create_and_build_course2(args, targetdir_i, targetdir_s) -> sdrl.coursebuilder.Coursebuilder:
-    # ----- prepare build:
-    the_cache = cache.SedrilaCache(os.path.join(targetdir_i, c.CACHE_FILENAME), start_clean=False)
+    the_course = create_course2(args, targetdir_i, targetdir_s)
+    build_course(the_course, args["sums"], args["profile"], args["compress"], args["compress_best"])
+    the_course.directory.cache.close()  # write back changes
+    return the_course
+
+
+def create_course2(args, targetdir_i, targetdir_s) -> sdrl.coursebuilder.Coursebuilder:
+    """Prepare the build: cache, Directory, and Coursebuilder with its parts."""
+    the_cache = cache.SedrilaCache(os.path.join(targetdir_i, c.CACHE_FILENAME), start_clean=False,
+                                   hashmode=args["hashes"])
     b.set_register_files_callback(the_cache.set_file_dirty)
-    directory = dir.Directory(the_cache)
+    directory = dir.Directory(the_cache, jobs=args["jobs"], tracer=tracing.Tracer(enabled=bool(args["profile"])))
     the_course = sdrl.coursebuilder.Coursebuilder(
         configfile=args["config"], context=args["config"], include_stage=args["include_stage"],
-        targetdir_s=targetdir_s, targetdir_i=targetdir_i, directory=directory)
-    # ----- perform main part of build:
+        targetdir_s=targetdir_s, targetdir_i=targetdir_i, directory=directory,
+        fingerprint=args["fingerprint"], shared_toc=args["shared_toc"])
     prepare_itree_zip(the_course)
     macroexpanders.register_macros(the_course)
-    directory.build()
+    return the_course
+
+
+def build_course(the_course: sdrl.coursebuilder.Coursebuilder, print_sums: bool, tracefile: str = "",
+                 compress=False, compress_best=False):
+    """Perform the build proper. Leaves the cache open. With tracefile, the Directory's tracer must be enabled."""
+    compress = compress or compress_best
+    # ----- perform main part of build:
+    the_course.files.new_build()
+    the_course.directory.build()
     # ----- build special files:
-    b.spit(os.path.join(targetdir_s, c.METADATA_FILE), json.dumps(the_course.as_json(), indent=2))
-    generate_htaccess(the_course)
-    # ----- clean up and report:
-    purge_leftover_outputfiles(directory, targetdir_s, targetdir_i)
-    if args["sums"]:
+    b.spit_if_changed(os.path.join(the_course.targetdir_s, c.METADATA_FILE),
+                      json.dumps(the_course.as_json(), indent=2))
+    generate_htaccess(the_course, compress, the_course.fingerprint)
+    # ----- clean up, compress, and report:
+    purge_leftover_outputfiles(the_course.directory, the_course.targetdir_s, the_course.targetdir_i,
+                               compress, the_course.fingerprint)
+    if compress:
+        compressed = precompress.compress_tree(the_course.targetdir_s, is_website_file, the_course.directory.jobs,
+                                               best=compress_best)
+        b.info(f"{compressed} file{b.plural_s(compressed)} precompressed")
+    update_manifest(the_course)
+    the_memo = the_course.directory.cache.memo
+    b.debug(f"memo: {the_memo.hitcount} of {the_memo.hitcount + the_memo.misscount} lookups found "
+            "rendered Markdown blocks, highlighted code, or diagrams")
+    b.info(the_course.files.hitrate_msg())
+    changed = the_course.directory.changed_outputs
+    b.info(f"{changed} output file{b.plural_s(changed)} changed")
+    if print_sums:
         sdrl.report.print_author_volume_report(the_course)
-    the_cache.close()  # write back changes
-    return the_course
+    if tracefile:
+        the_course.directory.tracer.write_trace(tracefile)
+        sdrl.report.print_build_profile(the_course.directory.tracer)
+
+
+def update_manifest(the_course: sdrl.coursebuilder.Coursebuilder):
+    """
+    Bring the manifest of all files in the build directory up to date.
+    Entries for files built in this build come from their Outputfiles, files nobody has touched
+    keep their previous entry, and only the remaining ones (e.g. after clear-cache) get hashed.
+    """
+    targetdir_s = the_course.targetdir_s
+    manifestfile = os.path.join(the_course.targetdir_i, c.MANIFEST_FILENAME)
+    old = manifest.Manifest.read(manifestfile)
+    new = manifest.Manifest()
+    built = the_course.directory.outputs
+    producers = None  # path -> Outputfile producer, computed only if needed
+    for dirpath, dirnames, filenames in os.walk(targetdir_s):
+        dirnames[:] = filter(is_website_file, dirnames)
+        for filename in filter(is_website_file, filenames):
+            path = os.path.normpath(os.path.join(dirpath, filename))
+            relpath = os.path.relpath(path, targetdir_s).replace(os.sep, '/')
+            oldentry = old.entries.get(relpath)
+            if path in built:
+                entry = built[path]
+            elif oldentry and oldentry.is_current_for(path):
+                entry = oldentry
+            else:
+                if producers is None:
+                    producers = {os.path.normpath(path): of.producer
+                                 for of in the_course.directory.get_all_outputfiles()
+                                 for path in (of.outputfile_s, of.outputfile_i)}
+                entry = manifest.Entry.of_file(path, producers.get(path, ""))
+            new.put(relpath, entry)
+    new.write(manifestfile)
+
+
+def is_website_file(name: str) -> bool:
+    """Whether a file or directory in the build directory is part of the website (rather than of the cache)."""
+    return not name.startswith(c.CACHE_FILENAME)
+
+
+def print_changed_files(targetdir_s: str, since: str):
+    """Print the delta between manifest file since (none if empty) and the build directory's manifest."""
+    manifestfile = os.path.join(_targetdir_i(targetdir_s), c.MANIFEST_FILENAME)
+    if not os.path.exists(manifestfile):
+        b.critical(f"'{manifestfile}' does not exist; run 'sedrila author build {targetdir_s}' first")
+    current = manifest.Manifest.read(manifestfile)
+    old = manifest.Manifest.read(since) if since else manifest.Manifest()
+    for line in current.delta_since(old).lines():
+        print(line)
+
+
+def rebuild_course(the_course: sdrl.coursebuilder.Coursebuilder, changed_files: tg.Optional[set[str]]):
+    """
+    Build the_course again in the same process, after a build_course() and cache.finish_run().
+    changed_files are the source files that may have changed since; None means: check all.
+    The set of parts must be the same as before.
+    """
+    the_course.directory.cache.start_run(changed_files)
+    the_course.directory.reset()
+    b.reset_msgs()
+    build_course(the_course, print_sums=False)
+
+
+def watch_and_build(args, targetdir_i, targetdir_s):
+    """
+    Build the course, then rebuild it whenever source files change, until Ctrl-C.
+    Course, Directory, macros, and cache stay in memory, so a rebuild only needs to look at the
+    changed files and what depends on them.
+    Changes of the course structure (config file changed, *.md file or directory added or removed,
+    template referring to a further template) restart the process,
+    because the Directory must then be constructed anew.
+    """
+    the_course = create_course2(args, targetdir_i, targetdir_s)
+    the_cache = the_course.directory.cache
+    watcher = filewatch.make_watcher(watched_dirs(the_course), [args["config"]])
+    is_first_build = True
+    changed_files = None  # files changed since the last successful build; None: unknown
+    try:
+        while True:
+            # ----- build:
+            try:
+                if is_first_build:
+                    is_first_build = False
+                    build_course(the_course, print_sums=False)
+                else:
+                    rebuild_course(the_course, changed_files)
+                the_cache.finish_run()
+                changed_files = set()
+                b.finalmessage()
+            except b.CritialError:
+                pass  # message has been printed; changed_files remain to be built next time
+            # ----- wait for changes:
+            b.info("watching for changes (press Ctrl-C to stop)")
+            changes = watcher.wait()
+            if needs_restart(the_course, args["config"], changes):
+                b.info("course structure has changed, restarting")
+                the_cache.close(finished=False)
+                watcher.close()
+                os.execv(sys.executable, [sys.executable] + sys.argv)
+            if changed_files is not None:
+                changed_files |= changes.files
+    except KeyboardInterrupt:
+        the_cache.close(finished=False)  # a build may have been interrupted
+        watcher.close()
+
+
+def watched_dirs(the_course: sdrl.coursebuilder.Coursebuilder) -> list[str]:
+    dirs = [the_course.chapterdir, the_course.altdir, the_course.templatedir]
+    if the_course.itreedir:
+        dirs.append(the_course.itreedir)
+    return dirs
+
+
+def needs_restart(the_course: sdrl.coursebuilder.Coursebuilder, configfile: str,
+                  changes: filewatch.Changes) -> bool:
+    """
+    Whether changes may have modified the set of parts (as opposed to only their content)
+    or the set of templates a part depends on (a new {% include %} etc.; see template_files()).
+    Editors often save a file by writing a new one and renaming it; hence a *.md file is only
+    considered added or removed if it was unknown to the course before or does not exist now.
+    """
+    if changes.overflow or os.path.normpath(configfile) in changes.files:
+        return True
+    itreedir = the_course.itreedir and os.path.normpath(the_course.itreedir)
+    def in_itree(path: str) -> bool:  # itree.zip is rebuilt as a whole anyway
+        return bool(itreedir) and path.startswith(itreedir + os.sep)
+    known = {os.path.normpath(sourcefile.name) for sourcefile in the_course.directory.get_all(el.Sourcefile)}
+    added = {path for path in changes.added if path.endswith(".md") and path not in known}
+    removed = {path for path in changes.removed if path.endswith(".md") and not os.path.exists(path)}
+    templatedir = os.path.normpath(the_course.templatedir)
+    def uses_new_templates(path: str) -> bool:  # template dependencies are made only once per process
+        return (path in known and path.startswith(templatedir + os.sep) and
+                sdrl.partbuilder.references_new_templates(templatedir, path, known))
+    return (any(not in_itree(path) for path in added | removed | changes.dirs) or
+            any(uses_new_templates(path) for path in changes.files))
+
 
 # legacy ui
 meaning = """Creates and renders an instance of a SeDriLa course with incremental build.
@@ -127,6 +349,27 @@ def add_arguments(subparser: argparse.ArgumentParser):
                            help="Print task volume reports")
     subparser.add_argument('--clean', action='store_const', const=True, default=False,
                            help="purge cache and perform a complete build")
+    subparser.add_argument('--jobs', metavar="N", type=int, default=1,
+                           help="number of processes for rendering Markdown and of threads for other outputs (default: 1)")
+    subparser.add_argument('--hashes', action='store_const', const=True, default=False,
+                           help="detect changed files by content hash instead of modification time, "
+                                "e.g. for builds from a fresh clone with a restored cache")
+    subparser.add_argument('--profile', metavar="tracefile", default="",
+                           help="print build time per element type and write a Chrome trace JSON file "
+                                "of all element builds to tracefile")
+    subparser.add_argument('--compress', action='store_const', const=True, default=False,
+                           help="also write precompressed .gz (and .br) files for the web server")
+    subparser.add_argument('--compress_best', action='store_const', const=True, default=False,
+                           help="like --compress, but with the strongest and much slower compression")
+    subparser.add_argument('--fingerprint', action='store_const', const=True, default=False,
+                           help="refer to baseresources by content-hash names that browsers may cache forever")
+    subparser.add_argument('--shared_toc', action='store_const', const=True, default=False,
+                           help="write the table of contents once into toc.js instead of into every page")
+    subparser.add_argument('--watch', action='store_const', const=True, default=False,
+                           help="after building, rebuild whenever source files change, until Ctrl-C")
+    subparser.add_argument('--changed_since', metavar="manifest", default=None,
+                           help="list output files added (A), changed (M), or deleted (D) since the build that "
+                                "produced this copy of targetdir/instructor/" + c.MANIFEST_FILENAME + ", then stop")
     subparser.add_argument('--rename', nargs=2, metavar=("partname", "new_partname"),
                            help="Rename files of part, macro calls in *.md. and part mentions in *.prot, then stop.")
     subparser.add_argument('targetdir',
@@ -139,10 +382,20 @@ def execute(pargs: argparse.Namespace):
         b.suppress_msg_duplicates(False)
         do_rename(pargs.config, pargs.rename[0], pargs.rename[1])
         return
+    if pargs.changed_since is not None:
+        print_changed_files(pargs.targetdir, pargs.changed_since)
+        return
     b.suppress_msg_duplicates(True)
     targetdir_s = pargs.targetdir
     targetdir_i = _targetdir_i(pargs.targetdir)
     prepare_directories(targetdir_s, targetdir_i)
+    if pargs.watch:
+        if pargs.clean:
+            delete_cache(targetdir_i)
+        watch_and_build(dict(config=pargs.config, include_stage=pargs.include_stage, sums=False,
+                             jobs=pargs.jobs, hashes=pargs.hashes, profile="", fingerprint=False, shared_toc=False),
+                        targetdir_i, targetdir_s)
+        return
     the_course = create_and_build_course(pargs, targetdir_i, targetdir_s)
     b.finalmessage()
 
@@ -155,36 +408,57 @@ def do_rename(configfile: str, old_partname: str, new_partname: str):
     
 def create_and_build_course(pargs, targetdir_i, targetdir_s) -> sdrl.coursebuilder.Coursebuilder:
     # ----- prepare build:
-    the_cache = cache.SedrilaCache(os.path.join(targetdir_i, c.CACHE_FILENAME), start_clean=pargs.clean)
+    the_cache = cache.SedrilaCache(os.path.join(targetdir_i, c.CACHE_FILENAME), start_clean=pargs.clean,
+                                   hashmode=pargs.hashes)
     b.set_register_files_callback(the_cache.set_file_dirty)
-    directory = dir.Directory(the_cache)
+    directory = dir.Directory(the_cache, jobs=pargs.jobs, tracer=tracing.Tracer(enabled=bool(pargs.profile)))
     the_course = sdrl.coursebuilder.Coursebuilder(
         configfile=pargs.config, context=pargs.config, include_stage=pargs.include_stage,
-        targetdir_s=targetdir_s, targetdir_i=targetdir_i, directory=directory)
-    # ----- perform main part of build:
+        targetdir_s=targetdir_s, targetdir_i=targetdir_i, directory=directory,
+        fingerprint=pargs.fingerprint, shared_toc=pargs.shared_toc)
     prepare_itree_zip(the_course)
     macroexpanders.register_macros(the_course)
-    directory.build()
-    # ----- build special files:
-    b.spit(os.path.join(targetdir_s, c.METADATA_FILE), json.dumps(the_course.as_json(), indent=2))
-    generate_htaccess(the_course)
-    # ----- clean up and report:
-    purge_leftover_outputfiles(directory, targetdir_s, targetdir_i)
-    if pargs.sums:
-        sdrl.report.print_author_volume_report(the_course)
+    # ----- build:
+    build_course(the_course, pargs.sums, pargs.profile, pargs.compress, pargs.compress_best)
     the_cache.close()  # write back changes
     return the_course
 
 
-def generate_htaccess(course: sdrl.coursebuilder.Coursebuilder):
-    if not course.htaccess_template:
+def generate_htaccess(course: sdrl.coursebuilder.Coursebuilder, compress=False, fingerprint=False):
+    """
+    The instructor .htaccess from htaccess_template.
+    Both get rules for precompressed files with compress and for caching baseresources with fingerprint.
+    Like Outputfiles, they are written only if their content changes and count as output files.
+    """
+    def write(filename: str, content: str):  # see Outputfile.write_output()
+        changed = b.spit_if_changed(filename, content)
+        course.directory.record_output(filename, manifest.Entry.of_bytes(filename, content.encode('utf8'), ""),
+                                       changed)
+
+    rules = ((precompress.htaccess_rules() if compress else "") +
+             (fingerprint_htaccess_rules(course) if fingerprint else ""))
+    if rules:
+        write(os.path.join(course.targetdir_s, c.HTACCESS_FILE), rules)
+        rules = "\n" + rules
+    elif not course.htaccess_template:
         return  # nothing to do
     userlist = [u['webaccount'] for u in course.instructors]
-    htaccess_txt = (course.htaccess_template.format(
+    htaccess_txt = (course.htaccess_template or "").format(
                        userlist_commas=",".join(userlist),
                        userlist_spaces = " ".join(userlist),
-                       userlist_quotes_spaces = " ".join((f'"{u}"' for u in userlist))))
-    b.spit(os.path.join(course.targetdir_i, c.HTACCESS_FILE), htaccess_txt)
+                       userlist_quotes_spaces = " ".join((f'"{u}"' for u in userlist)))
+    write(os.path.join(course.targetdir_i, c.HTACCESS_FILE), htaccess_txt + rules)
+
+
+def fingerprint_htaccess_rules(course: sdrl.coursebuilder.Coursebuilder) -> str:
+    """Apache httpd configuration that lets clients cache the content-hash-named baseresources forever."""
+    names = "|".join(re.escape(name) for plainname, name in sorted(course.resources.items()) if name != plainname)
+    return ("# files named by content hash by 'sedrila author build --fingerprint' never change:\n"
+            "<IfModule mod_headers.c>\n"
+            f'  <FilesMatch "^({names})(\\.br|\\.gz)?$">\n'
+            '    Header set Cache-Control "public, max-age=31536000, immutable"\n'
+            "  </FilesMatch>\n"
+            "</IfModule>\n")
 
 
 def prepare_directories(targetdir_s: str, targetdir_i: str):
@@ -211,16 +485,21 @@ def prepare_itree_zip(the_course: sdrl.coursebuilder.Coursebuilder):
                                   sourcefile=the_course.itreedir, instructor_only=True)
 
 
-def purge_leftover_outputfiles(directory: dir.Directory, targetdir_s: str, targetdir_i: str):
+def purge_leftover_outputfiles(directory: dir.Directory, targetdir_s: str, targetdir_i: str,
+                               compress=False, fingerprint=False):
     def keep(outputfile: el.Outputfile) -> bool:
         # Parts and TaskgroupDiagrams can be skipped, all other Outputfiles are always built:
         return not getattr(outputfile, 'to_be_skipped', False)
 
+    def with_siblings(files: set[str]) -> set[str]:  # precompressed files are kept only with compress
+        return files | {f"{file}{suffix}" for file in files for suffix in precompress.ENCODINGS} if compress else files
+
     expected_files = set([of.outputfile for of in directory.get_all_outputfiles() if keep(of)])
     additions_s = {c.AUTHOR_OUTPUT_INSTRUCTORS_DEFAULT_SUBDIR, c.METADATA_FILE}
+    additions_s |= {c.HTACCESS_FILE} if compress or fingerprint else set()
     additions_i = {c.HTACCESS_FILE}
-    purge_all_but(targetdir_s, expected_files | additions_s)
-    purge_all_but(targetdir_i, expected_files | additions_i, exception=c.CACHE_FILENAME)
+    purge_all_but(targetdir_s, with_siblings(expected_files | additions_s))
+    purge_all_but(targetdir_i, with_siblings(expected_files | additions_i), exception=c.CACHE_FILENAME)
 
 
 def purge_all_but(dir: str, files: set[str], exception: tg.Optional[str] = None):
@@ -37,6 +37,9 @@ def test_add_arguments_defaults():
     assert args.sums is False
     assert args.clean is False
     assert args.rename is None
+    assert args.jobs == 1
+    assert args.hashes is False
+    assert args.changed_since is None
     assert args.targetdir == "mydir"
 
 
@@ -60,6 +63,31 @@ def test_add_arguments_include_stage():
     assert args.include_stage == "beta"
 
 
+def test_add_arguments_jobs():
+    args = _make_subparser().parse_args(["--jobs", "4", "mydir"])
+    assert args.jobs == 4
+
+
+def test_add_arguments_hashes_flag():
+    args = _make_subparser().parse_args(["--hashes", "mydir"])
+    assert args.hashes is True
+
+
+def test_add_arguments_fingerprint_flag():
+    args = _make_subparser().parse_args(["--fingerprint", "mydir"])
+    assert args.fingerprint is True
+
+
+def test_add_arguments_shared_toc_flag():
+    args = _make_subparser().parse_args(["--shared_toc", "mydir"])
+    assert args.shared_toc is True
+
+
+def test_add_arguments_changed_since():
+    args = _make_subparser().parse_args(["--changed_since", "deployed.json", "mydir"])
+    assert args.changed_since == "deployed.json"
+
+
 # ── _targetdir_i ──────────────────────────────────────────────────────────────
 
 def test_targetdir_i_appends_instructor_subdir():
@@ -77,14 +105,14 @@ def test_targetdir_i_nested_path():
 
 def test_generate_htaccess_no_template_returns_early():
     course = types.SimpleNamespace(htaccess_template=None)
-    with mock.patch("base.spit") as m:
+    with mock.patch("base.spit_if_changed") as m:
         author.generate_htaccess(course)
         m.assert_not_called()
 
 
 def test_generate_htaccess_empty_template_string_returns_early():
     course = types.SimpleNamespace(htaccess_template="")
-    with mock.patch("base.spit") as m:
+    with mock.patch("base.spit_if_changed") as m:
         author.generate_htaccess(course)
         m.assert_not_called()
 
@@ -94,8 +122,9 @@ def test_generate_htaccess_formats_userlist_commas():
         htaccess_template="{userlist_commas}|{userlist_spaces}|{userlist_quotes_spaces}",
         instructors=[{"webaccount": "alice"}, {"webaccount": "bob"}],
         targetdir_i="/build/instructor",
+        directory=mock.MagicMock(),
     )
-    with mock.patch("base.spit") as m:
+    with mock.patch("base.spit_if_changed") as m, mock.patch("manifest.Entry.of_bytes"):
         author.generate_htaccess(course)
         content = m.call_args[0][1]
     assert "alice,bob" in content
@@ -106,8 +135,9 @@ def test_generate_htaccess_formats_userlist_spaces():
         htaccess_template="{userlist_commas}|{userlist_spaces}|{userlist_quotes_spaces}",
         instructors=[{"webaccount": "alice"}, {"webaccount": "bob"}],
         targetdir_i="/build/instructor",
+        directory=mock.MagicMock(),
     )
-    with mock.patch("base.spit") as m:
+    with mock.patch("base.spit_if_changed") as m, mock.patch("manifest.Entry.of_bytes"):
         author.generate_htaccess(course)
         content = m.call_args[0][1]
     assert "alice bob" in content
@@ -118,8 +148,9 @@ def test_generate_htaccess_formats_quoted_spaces():
         htaccess_template="{userlist_commas}|{userlist_spaces}|{userlist_quotes_spaces}",
         instructors=[{"webaccount": "alice"}, {"webaccount": "bob"}],
         targetdir_i="/build/instructor",
+        directory=mock.MagicMock(),
     )
-    with mock.patch("base.spit") as m:
+    with mock.patch("base.spit_if_changed") as m, mock.patch("manifest.Entry.of_bytes"):
         author.generate_htaccess(course)
         content = m.call_args[0][1]
     assert '"alice"' in content
@@ -131,11 +162,13 @@ def test_generate_htaccess_writes_to_targetdir_i():
         htaccess_template="{userlist_commas}|{userlist_spaces}|{userlist_quotes_spaces}",
         instructors=[{"webaccount": "alice"}],
         targetdir_i="/build/instructor",
+        directory=mock.MagicMock(),
     )
-    with mock.patch("base.spit") as m:
+    with mock.patch("base.spit_if_changed") as m, mock.patch("manifest.Entry.of_bytes"):
         author.generate_htaccess(course)
         filepath = m.call_args[0][0]
     assert filepath == os.path.join("/build/instructor", c.HTACCESS_FILE)
+    course.directory.record_output.assert_called_once()  # counts in the changed-outputs report
 
 
 # ── prepare_itree_zip ─────────────────────────────────────────────────────────
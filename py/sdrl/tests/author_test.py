@@ -2,19 +2,28 @@
 import argparse
 import contextlib
 import glob
+import gzip
+import json
 import os.path
 import re
 import shutil
 import time
+import typing as tg
 import zipfile
 
 import bs4
+import pytest
 
 import base as b
+import cache
+import filewatch
+import manifest
 import mycrypt
 import sdrl.constants as c
 import sdrl.course as course
 import sdrl.coursebuilder as coursebuilder
+import sdrl.directory as dir
+import sdrl.elements as el
 import sdrl.macros as macros
 import sdrl.subcmd.author as author
 
@@ -43,6 +52,8 @@ File 'ch/ch1/tg11/task111r+a.md':
    [TERMREF::Concept 4 undefined] references undefined glossary term 'Concept 4 undefined' (file 'ch/ch1/tg11/task111r+a.md' in part 'task111r+a')
 File 'ch/glossary.md':
    Term 'Concept 2 undefined' is used in 'explains:' field (in task111r+a) but lacks a glossary definition
+file cache: ...
+40 output files changed
 """
 
 expected_output2 = """File 'ch/ch1/tg11/task111r+a.md':
@@ -54,11 +65,15 @@ File 'ch/ch1/tg11/task111r+a.md':
    [TERMREF::Concept 4 undefined] references undefined glossary term 'Concept 4 undefined' (file 'ch/ch1/tg11/task111r+a.md' in part 'task111r+a')
 File 'ch/glossary.md':
    Term 'Concept 2 undefined' is used in 'explains:' field (in task111r+a) but lacks a glossary definition
+file cache: ...
+0 output files changed
 """
 
 expected_output3 = """../out/instructor/itree.zip
 ../out/task111r+a.html
 ../out/glossary.html
+file cache: ...
+5 output files changed
 """
 
 expected_output4 = """../out/tg12-overview.svg
@@ -66,12 +81,18 @@ expected_output4 = """../out/tg12-overview.svg
 ../out/tg12.html
 ../out/task121.html
 ../out/task122.html
+file cache: ...
+8 output files changed
 """
 
 expected_output5 = """../out/instructor/task121.html
+file cache: ...
+1 output file changed
 """
 
 expected_output6 = """../out/instructor/task121.html
+file cache: ...
+1 output file changed
 """
 
 expected_output7 = """../out/tg12-overview.svg
@@ -81,15 +102,21 @@ expected_output7 = """../out/tg12-overview.svg
 ../out/task122.html
 deleted: ../out/task121.html
 deleted: ../out/instructor/task121.html
+file cache: ...
+8 output files changed
 """
 
 expected_output8 = """../out/task121new.html
 ../out/glossary.html
+file cache: ...
+4 output files changed
 """
 
 expected_out9 = """../out/tg12-overview.svg
 ../out/task121new.html
 ../out/glossary.html
+file cache: ...
+2 output files changed
 """
 
 expected_filelist1 = [
@@ -247,7 +274,8 @@ class Catcher:
         regexp = f"{re.escape(self.BEGIN % marker)}\\n(.*){re.escape(self.END % marker)}"
         mm = re.search(regexp, actual_output, re.DOTALL)
         assert mm, f"marker '{marker}' not found"
-        return mm.group(1)
+        return re.sub(r"^file cache: .*$", "file cache: ...", mm.group(1),  # counts vary with --jobs etc.
+                      flags=re.MULTILINE)
 
 
 def test_sedrila_author(capfd):
@@ -342,10 +370,325 @@ def test_sedrila_author(capfd):
         # TODO 3: check bottomlinkslist
 
 
-def call_sedrila_author(step: str, outputdir: str, catcher, start_clean=False) -> tuple[coursebuilder.Coursebuilder, str]:
+def test_sedrila_author_parallel(coursecopy, tmp_path):
+    """Rendering Markdown in worker processes produces the same files and messages as a sequential build."""
+    course1, output1 = call_sedrila_author("sequential build", "../out1", coursecopy)
+    errors1 = b.num_errors
+    course2, output2 = call_sedrila_author("parallel build", "../out2", coursecopy, jobs=3)
+    assert b.num_errors == errors1
+    _compare_line_by_line(output2.replace("../out2", "../out1"), output1)
+    files1 = sorted(os.path.relpath(f, tmp_path / "out1") for f in glob.glob(f"{tmp_path}/out1/**", recursive=True))
+    files2 = sorted(os.path.relpath(f, tmp_path / "out2") for f in glob.glob(f"{tmp_path}/out2/**", recursive=True))
+    assert files1 == files2
+    for file in files1:
+        path1, path2 = tmp_path / "out1" / file, tmp_path / "out2" / file
+        if file.endswith(".html"):
+            assert path1.read_text(encoding='utf8') == path2.read_text(encoding='utf8'), file
+
+
+def test_sedrila_author_hashes(coursecopy):
+    """With content hashes, a build after touching all source files rebuilds no more than a plain rebuild."""
+    call_sedrila_author("first build", "../out", coursecopy, hashes=True)
+    future = time.time() + 10
+    for path in glob.glob("**", recursive=True):
+        os.utime(path, (future, future))
+    course, output = call_sedrila_author("build after touch", "../out", coursecopy, hashes=True)
+    check_output2(course, output, expected_output2, errors=3)
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_sedrila_author_profile(coursecopy, tmp_path, jobs):
+    """--profile reports every Element build in the trace file and prints a summary."""
+    tracefile = os.path.join(tmp_path, "trace.json")
+    the_course, output = call_sedrila_author("profiled build", "../out", coursecopy, profile=tracefile, jobs=jobs)
+    events = json.loads(b.slurp(tracefile))['traceEvents']
+    numelements = sum(len(the_course.directory.get_all(t)) for t in the_course.directory.managed_types)
+    elementevents = [event for event in events if event['cat'] != "Directory" and "(worker)" not in event['cat']]
+    assert numelements >= len(elementevents) > 0  # Elements registered under several types are built once
+    body = [event for event in events if event['cat'] == "Body_s" and event['name'] == "task112"][0]
+    assert body['args']['found'] == "MISSING" and body['args']['built'] is True
+    assert body['args']['state'] == "HAS_CHANGED"
+    workerbodies = [event for event in events if event['cat'] == "Body_s (worker)"]
+    if jobs > 1:  # the rendering happens in worker processes and gets its own spans
+        assert any(event['name'] == "task112" and event['dur'] > 0 for event in workerbodies)
+    else:
+        assert not workerbodies
+    assert re.search(r"Body_s .* \d+ .* \d+ .* \d+", output)  # a summary row
+    assert "=TOTAL" in output
+
+
+def test_sedrila_author_layout_inputs(coursecopy, tmp_path):
+    """Template edits re-render the pages that use the template; config edits re-render the affected Bodies."""
+    tracefile = os.path.join(tmp_path, "trace.json")
+
+    def built(category: str) -> set[str]:
+        events = json.loads(b.slurp(tracefile))['traceEvents']
+        return {event['name'] for event in events if event['cat'] == category and event['args']['built']}
+
+    shutil.copytree(coursebuilder.Coursebuilder.templatedir, "templates")
+    b.spit(c.AUTHOR_CONFIG_FILENAME, b.slurp(c.AUTHOR_CONFIG_FILENAME) + "templatedir: templates\n")
+    call_sedrila_author("layout step 1: full build", "../out", coursecopy)
+    # --- template edit: all task pages, but no bodies and no other pages:
+    b.spit("templates/task.html", b.slurp("templates/task.html").replace('id="taskbody"', 'id="taskbody" edited'))
+    future = time.time() + 1
+    os.utime("templates/task.html", (future, future))
+    the_course, output = call_sedrila_author("layout step 2: template edit", "../out", coursecopy,
+                                             profile=tracefile)
+    assert built("Taskbuilder") == set(the_course.taskdict)
+    assert not built("Coursebuilder") and "task112" not in built("Body_s")
+    assert 'id="taskbody" edited' in b.slurp("../out/task112.html")
+    # --- config edit: bodies using blockmacro_topmatter are rebuilt:
+    b.spit(c.AUTHOR_CONFIG_FILENAME,
+           b.slurp(c.AUTHOR_CONFIG_FILENAME).replace("<h2>Section_Background</h2>", "<h2>Background</h2>"))
+    call_sedrila_author("layout step 3: config edit", "../out", coursecopy, profile=tracefile)
+    assert "task112" in built("Body_s")
+
+
+def test_sedrila_author_changed_files(coursecopy, capfd, tmp_path):
+    """The manifest of the build directory tells which files a deployment must transfer."""
+    deployed = os.path.join(tmp_path, "deployed-manifest.json")
+    call_sedrila_author("manifest step 1: full build", "../out", coursecopy)
+    manifestfile = os.path.join("../out/instructor", c.MANIFEST_FILENAME)
+    entries = manifest.Manifest.read(manifestfile).entries
+    assert entries["task112.html"].producer == "Taskbuilder:task112"
+    assert entries["instructor/itree.zip"].producer == "Zipfile:itree.zip"
+    assert "course.json" in entries and not any(c.CACHE_FILENAME in path for path in entries)
+    shutil.copy(manifestfile, deployed)
+    # --- modify task121 body:
+    b.spit("ch/ch1/tg12/task121.md",
+           b.slurp("ch/ch1/tg12/task121.md").replace("Body of Task 1.2.1", "New body of Task 1.2.1"))
+    time.sleep(1)
+    call_sedrila_author("manifest step 2: modify task121 body", "../out", coursecopy)
+    capfd.readouterr()
+    author.print_changed_files("../out", deployed)
+    assert capfd.readouterr().out == "M\tinstructor/task121.html\nM\ttask121.html\n"
+    os.rename("ch/ch1/tg12/task122.md", "ch/ch1/tg12/task122new.md")
+    time.sleep(1)
+    call_sedrila_author("manifest step 3: rename task122", "../out", coursecopy)
+    capfd.readouterr()
+    author.print_changed_files("../out", deployed)
+    lines = capfd.readouterr().out.splitlines()
+    assert {"A\ttask122new.html", "D\ttask122.html", "D\tinstructor/task122.html",
+            "M\ttask121.html"} <= set(lines)
+
+
+def test_sedrila_author_compress(coursecopy):
+    """--compress writes .gz siblings for text outputs, refreshes them only for changed outputs, purges them without."""
+    course, output = call_sedrila_author("compress step 1: full build", "../out", coursecopy, compress=True)
+    assert gzip.decompress(b.slurp_bytes("../out/task112.html.gz")) == b.slurp_bytes("../out/task112.html")
+    assert os.path.exists("../out/instructor/task112.html.gz") and os.path.exists("../out/sedrila.css.gz")
+    assert not os.path.exists("../out/favicon-32x32.png.gz")  # not a text file
+    for htaccess in ("../out/.htaccess", "../out/instructor/.htaccess"):
+        assert "RewriteCond \"%{REQUEST_FILENAME}.gz\" -s" in b.slurp(htaccess)
+    untouched = os.stat("../out/task113.html.gz").st_mtime_ns
+    # --- modify task112 body: only its pages get compressed again:
+    b.spit("ch/ch1/tg11/task112.md", b.slurp("ch/ch1/tg11/task112.md") + "\nOne more sentence.\n")
+    time.sleep(1)
+    course, output = call_sedrila_author("compress step 2: modify task112", "../out", coursecopy, compress=True)
+    assert "2 files precompressed" in output
+    assert b"One more sentence." in gzip.decompress(b.slurp_bytes("../out/task112.html.gz"))
+    assert os.stat("../out/task113.html.gz").st_mtime_ns == untouched
+    # --- build without compress removes what compress has written:
+    course, output = call_sedrila_author("compress step 3: no compress", "../out", coursecopy)
+    assert not glob.glob("../out/**/*.gz", recursive=True) and not os.path.exists("../out/.htaccess")
+
+
+def test_sedrila_author_fingerprint(coursecopy):
+    """--fingerprint copies baseresources also under content-hash names, which pages use and .htaccess caches."""
+    course, output = call_sedrila_author("fingerprint step 1: full build", "../out", coursecopy, fingerprint=True)
+    cssname = course.resources['sedrila.css']
+    assert re.fullmatch(r"sedrila\.[0-9a-f]{10}\.css", cssname)
+    assert b.slurp(f"../out/{cssname}") == b.slurp("../out/sedrila.css")  # plain name stays, e.g. for webapp
+    assert os.path.exists(f"../out/instructor/{cssname}")
+    assert f'href="{cssname}"' in b.slurp("../out/task112.html")
+    assert 'href="codehilite.css"' in b.slurp("../out/task112.html")  # not a baseresource
+    for htaccess in ("../out/.htaccess", "../out/instructor/.htaccess"):
+        assert cssname.replace(".", "\\.") in b.slurp(htaccess) and "immutable" in b.slurp(htaccess)
+    # --- build without fingerprint refers to plain names again and removes the hashed ones:
+    course, output = call_sedrila_author("fingerprint step 2: no fingerprint", "../out", coursecopy)
+    assert 'href="sedrila.css"' in b.slurp("../out/task112.html")
+    assert not os.path.exists(f"../out/{cssname}") and not os.path.exists("../out/.htaccess")
+
+
+def test_sedrila_author_shared_toc(coursecopy):
+    """--shared-toc writes the toc into toc.js only, so a changed title does not rewrite the other pages."""
+    course, output = call_sedrila_author("shared toc step 1: full build", "../out", coursecopy, shared_toc=True)
+    page = bs4.BeautifulSoup(b.slurp("../out/task112.html"), "html.parser")
+    assert not page.find(id="sidebar").find_all("div")
+    assert page.find("script", src=c.TOCSCRIPT_FILE)
+    for tocscript in ("../out/toc.js", "../out/instructor/toc.js"):
+        assert "task113.html" in b.slurp(tocscript) and "glossary.html" in b.slurp(tocscript)
+    untouched = os.stat("../out/task113.html").st_mtime_ns
+    # --- modify task112 title: toc.js and task112 change, task113 need not:
+    b.spit("ch/ch1/tg11/task112.md", b.slurp("ch/ch1/tg11/task112.md").replace("Task 1.1.2", "Task 1.1.2b"))
+    time.sleep(1)
+    course, output = call_sedrila_author("shared toc step 2: modify title", "../out", coursecopy, shared_toc=True)
+    assert "Task 1.1.2b" in b.slurp("../out/toc.js")
+    assert os.stat("../out/task113.html").st_mtime_ns == untouched
+    # --- build without shared toc embeds the toc again and removes toc.js:
+    course, output = call_sedrila_author("shared toc step 3: no shared toc", "../out", coursecopy)
+    assert bs4.BeautifulSoup(b.slurp("../out/task113.html"), "html.parser").find(id="sidebar").find_all("div")
+    assert not os.path.exists("../out/toc.js")
+
+
+def test_structureindex(coursecopy):
+    """The tocs come from the Structureindex: parts in taskorder, one shared toc per expansion context."""
+    the_course, output = call_sedrila_author("structureindex: full build", "../out", coursecopy)
+    index = the_course.structureindex
+    tg11 = the_course.get_part("", "tg11")
+    assert index.tasks[tg11] == [task for task in the_course.taskorder if task in tg11.tasks]
+    assert the_course.get_part("", "task112").toc is the_course.get_part("", "task113").toc
+    for task in the_course.taskorder:
+        if not task.to_be_skipped:
+            assert f"href='{task.outputfile}'" in the_course.toc
+    assert "tg11.html" not in the_course.glossary.toc
+
+
+def test_sedrila_author_hot_rebuild(coursecopy, monkeypatch):
+    """Rebuilds in the same process (as in watch mode) given the changed files produce what fresh builds do."""
+    the_course = call_hot_build("../out")
+    templates = the_course.templates  # compiled once, also into the on-disk bytecode cache:
+    assert os.listdir(os.path.join(author._targetdir_i("../out"), c.TEMPLATECACHE_DIRNAME))
+    # --- step 2: nothing changed:
+    output = call_rebuild_course("hot step 2: identical rebuild", the_course, set(), coursecopy)
+    check_output2(the_course, output, expected_output2, errors=3)
+    # --- step 3: repair errors (no sleep needed, the changed files are known):
+    b.spit("ch/glossary.md",
+           b.slurp("ch/glossary.md").replace("[TERM0::Concept 3|Concept 3b]",
+                                             "[TERM0::Concept 3b|Concept 2 undefined|Concept 4 undefined]"))
+    b.spit("itree.zip/nonexisting.txt", "now it exists!")
+    output = call_rebuild_course("hot step 3: repair errors", the_course,
+                                 {"ch/glossary.md", "itree.zip/nonexisting.txt"}, coursecopy)
+    check_output2(the_course, output, expected_output3)
+    # --- step 4: modify task121 topmatter (irrelevant for the glossary):
+    glossarybody_builds = []
+    glossarybody_do_build = el.Glossarybody.do_build
+    def do_build(self):
+        glossarybody_builds.append(self.name)
+        glossarybody_do_build(self)
+    monkeypatch.setattr(el.Glossarybody, 'do_build', do_build)
+    b.spit("ch/ch1/tg12/task121.md",
+           b.slurp("ch/ch1/tg12/task121.md").replace("timevalue: 2.5", "timevalue: 3.0"))
+    output = call_rebuild_course("hot step 4: modify task121 topmatter", the_course,
+                                 {"ch/ch1/tg12/task121.md"}, coursecopy)
+    check_output2(the_course, output, expected_output4)
+    assert glossarybody_builds == []
+    # --- step 5: task121 explains a term (relevant for the glossary):
+    b.spit("ch/ch1/tg12/task121.md",
+           b.slurp("ch/ch1/tg12/task121.md").replace("timevalue: 3.0", "timevalue: 3.0\nexplains: Concept 1"))
+    call_rebuild_course("hot step 5: task121 explains a term", the_course, {"ch/ch1/tg12/task121.md"}, coursecopy)
+    assert glossarybody_builds == ["glossary"]
+    assert "task121.html" in the_course.directory.get_the(el.Glossarybody, "glossary").value
+    assert the_course.templates is templates
+    the_course.directory.cache.close()
+
+
+def test_sedrila_author_new_include_hot_rebuild(coursecopy):
+    """An INCLUDE added during watch is a dependency from that rebuild on, one that is dropped is not."""
+    the_course = call_hot_build("../out")
+    bodykeys = sorted(body.cache_key for body in the_course.directory.get_all_bodies())
+    def includers(index: el.IncludeIndex) -> list[str]:
+        return [bodykey for bodykey in bodykeys if "ch/include.md" in index.includes_of(bodykey)]
+    index = the_course.directory.includeindex
+    assert includers(index) == ["task121__body_i"]  # within [INSTRUCTOR]
+    # --- task122 starts including ch/include.md, task121 stops:
+    b.spit("ch/ch1/tg12/task122.md", b.slurp("ch/ch1/tg12/task122.md") + "\n[INCLUDE::/include.md]\n")
+    b.spit("ch/ch1/tg12/task121.md", b.slurp("ch/ch1/tg12/task121.md").replace("[INCLUDE::/include.md]\n", ""))
+    call_rebuild_course("include step 1: move INCLUDE", the_course,
+                        {"ch/ch1/tg12/task121.md", "ch/ch1/tg12/task122.md"}, coursecopy)
+    assert includers(index) == ["task122__body_i", "task122__body_s"]
+    # --- changing the includefile rebuilds exactly its new includers:
+    b.spit("ch/include.md", b.slurp("ch/include.md") + "\nOne more line.\n")
+    output = call_rebuild_course("include step 2: modify includefile", the_course,
+                                 {"ch/include.md"}, coursecopy)
+    built = [line for line in output.split("\n") if line.startswith("../out/") or "changed" in line]
+    assert built == ["../out/task122.html", "../out/glossary.html", "2 output files changed"]
+    the_course.directory.cache.close()
+    # --- the index is in the cache for the next process:
+    the_cache = cache.SedrilaCache(os.path.join(author._targetdir_i("../out"), c.CACHE_FILENAME),
+                                   start_clean=False)
+    assert includers(el.IncludeIndex(the_cache)) == ["task122__body_i", "task122__body_s"]
+    the_cache.close()
+
+
+def test_needs_restart(tmp_path):
+    with contextlib.chdir(tmp_path):
+        os.makedirs("ch/ch1")
+        os.makedirs("templates")
+        b.spit("ch/ch1/task1.md", "")
+        b.spit("templates/task.html", "{% extends 'base.html' %}")
+        b.spit("templates/base.html", "")
+        b.spit("templates/unused.html", "{% include 'header.html' %}")
+        directory = dir.Directory(cache.SedrilaCache("", start_clean=False))
+        for sourcefile in ("ch/ch1/task1.md", "templates/task.html", "templates/base.html"):
+            directory.make_the(el.Sourcefile, sourcefile)
+        the_course = argparse.Namespace(itreedir="itree.zip", templatedir="templates", directory=directory)
+        def needs_restart(**kwargs) -> bool:
+            return author.needs_restart(the_course, "sedrila.yaml", filewatch.Changes(**kwargs))
+        assert not needs_restart(modified={"ch/ch1/task1.md", "sedrila.yaml.bak"})
+        assert not needs_restart(added={"ch/ch1/task1.md", "ch/ch1/include.prot"}, 
+                                 removed={"ch/ch1/task1.md~", "itree.zip/d/old.md"})
+        assert not needs_restart(dirs={"itree.zip/newdir"})
+        assert needs_restart(modified={"sedrila.yaml"})
+        assert needs_restart(added={"ch/ch1/task2.md"})
+        assert needs_restart(removed={"ch/ch1/task0.md"})
+        assert needs_restart(dirs={"ch/ch2"})
+        assert needs_restart(overflow=True)
+        b.spit("templates/header.html", "")
+        assert not needs_restart(added={"templates/header.html"}, modified={"templates/unused.html"})
+        b.spit("templates/base.html", "{% include 'header.html' %}")
+        assert needs_restart(modified={"templates/base.html"})
+        b.spit("templates/base.html", "{% include 'header.html' ")  # incomplete edit
+        assert not needs_restart(modified={"templates/base.html"})
+
+
+def call_hot_build(outputdir: str) -> coursebuilder.Coursebuilder:
+    """The first build of a course that then gets rebuilt in the same process (see call_rebuild_course())."""
+    b._testmode_reset()  # noqa
+    b.set_loglevel("INFO")
+    macros._testmode_reset()  # noqa
+    author.prepare_directories(outputdir, author._targetdir_i(outputdir))
+    the_course = author.create_course2(dict(config=c.AUTHOR_CONFIG_FILENAME, include_stage="alpha",
+                                            jobs=1, hashes=False, profile="", fingerprint=False,
+                                            shared_toc=False),
+                                       author._targetdir_i(outputdir), outputdir)
+    author.build_course(the_course, print_sums=False)
+    the_course.directory.cache.finish_run()
+    return the_course
+
+
+def call_rebuild_course(step: str, the_course: coursebuilder.Coursebuilder, changed_files: set[str], 
+                        catcher) -> str:
+    catcher.print_begin(step)
+    author.rebuild_course(the_course, changed_files)
+    the_course.directory.cache.finish_run()
+    catcher.print_end(step)
+    return catcher.get_block(step)
+
+
+@pytest.fixture
+def coursecopy(capfd, tmp_path) -> tg.Iterator[Catcher]:
+    """A modifiable copy of the test course in tmp_path/in as the current directory; yields the Catcher for builds."""
+    myinputdir = os.path.join(tmp_path, "in")
+    shutil.copytree(INPUTDIR, myinputdir)
+    with contextlib.chdir(myinputdir):
+        b.suppress_msg_duplicates(True)
+        yield Catcher(capfd)
+
+
+def call_sedrila_author(step: str, outputdir: str, catcher, start_clean=False,
+                        jobs=1, hashes=False, profile="", compress=False, compress_best=False,
+                        fingerprint=False, shared_toc=False) -> tuple[coursebuilder.Coursebuilder, str]:
     pargs = argparse.Namespace()
     pargs.config = c.AUTHOR_CONFIG_FILENAME
     pargs.clean = start_clean
+    pargs.jobs = jobs
+    pargs.hashes = hashes
+    pargs.profile = profile
+    pargs.compress = compress
+    pargs.compress_best = compress_best
+    pargs.fingerprint = fingerprint
+    pargs.shared_toc = shared_toc
     pargs.sums = False
     pargs.include_stage = "alpha"
     pargs.log = "INFO" if not step.startswith("step X:") else "DEBUG"  # report built files or help debug
@@ -0,0 +1,279 @@
+"""
+Benchmark for `sedrila author` builds on a synthetic course.
+Generates a course of configurable size that uses the expensive features
+(INCLUDE, SNIPPET, TERMREF, zipdirs, mermaid, glossary, task dependencies),
+times cold and warm builds as well as the macro expansion on the largest task files,
+and writes the results as JSON for comparison over time.
+Usage (from the repo's top directory):
+    PYTHONPATH=py python -m sdrl.tests.benchmark --tasks 10 results.json
+"""
+import argparse
+import contextlib
+import datetime as dt
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import typing as tg
+
+import base as b
+import sdrl.constants as c
+import sdrl.macros as macros
+import sdrl.markdown as md
+import sdrl.subcmd.author as author
+
+SCENARIOS = ("cold", "noop", "task_edit", "glossary_edit", "expand_macros")
+
+CONFIG_TEMPLATE = """title: Synthetic benchmark course
+name: Benchmark
+chapterdir: ch
+altdir: alt
+itreedir: itree.zip
+stages: [draft, alpha, beta]
+blockmacro_topmatter:
+  section_background: "<h2>Background</h2>"
+  section_background_default: ""
+  section_instructions: "<h2>Instructions</h2>"
+  section_instructions_detailed: ""
+  hint: "<strong>Hint: {{arg1}}</strong> "
+  NOTICE: "<strong>Note:</strong> "
+  INSTRUCTOR: "<h2>Instructor: {{arg1}}</h2>"
+instructors:
+  - nameish: Ann Instructor
+    email: a.instructor@example.org
+    gitaccount: ainstr
+    webaccount: ainstr
+    keyfingerprint: ABCDEF0123
+    pubkey: .
+startdate: 2025-01-01
+enddate: 2025-12-31
+allowed_attempts: "2 + 0.5/h"
+chapters:
+{chapters}
+"""
+
+SNIPPETFILE_TEMPLATE = '''"""Example program for taskgroup {tg}."""
+
+# SNIPPET::setup
+import os
+import sys
+# ENDSNIPPET
+
+# SNIPPET::compute
+def compute(values: list[int]) -> int:
+    """Sum of squares, the slow way."""
+    result = 0
+    for value in values:
+        result += value * value
+    return result
+# ENDSNIPPET
+
+
+if __name__ == "__main__":
+    print(compute([int(arg) for arg in sys.argv[1:]]))
+'''
+
+
+def generate_course(rootdir: str, chapters=3, taskgroups=4, tasks=8, terms=40):
+    """Write a synthetic course with chapters*taskgroups*tasks tasks plus sedrila.yaml to rootdir."""
+    def write(path: str, content: str):
+        path = os.path.join(rootdir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        b.spit(path, content)
+
+    def term(i: int) -> str:
+        return f"Concept {i}"
+
+    chapterlines = []
+    write("ch/index.md", "title: Synthetic course\n---\nThis course exists for benchmarking only.\n")
+    write("ch/glossary.md", glossary_markup(term, terms))
+    write("itree.zip/README.txt", "Instructor tree.\n")
+    for ch in range(1, chapters + 1):
+        chname = f"ch{ch}"
+        chapterlines.append(f"  - name: {chname}\n    taskgroups:")
+        write(f"ch/{chname}/index.md", f"title: Chapter {ch}\n---\nIntroduction to chapter {ch}.\n")
+        write(f"ch/{chname}/files{ch}.zip/README.txt", f"Files for chapter {ch}.\n")
+        write(f"ch/{chname}/files{ch}.zip/data/values.csv", "a,b\n1,2\n3,4\n")
+        for tg in range(1, taskgroups + 1):
+            tgname = f"tg{ch}{tg}"
+            tgdir = f"ch/{chname}/{tgname}"
+            chapterlines.append(f"      - name: {tgname}")
+            write(f"{tgdir}/index.md", f"title: Taskgroup {ch}.{tg}\n---\nThe tasks of taskgroup {ch}.{tg}.\n")
+            write(f"{tgdir}/include/example.py", SNIPPETFILE_TEMPLATE.format(tg=tgname))
+            write(f"itree.zip/{chname}/{tgname}/solution.py", SNIPPETFILE_TEMPLATE.format(tg=tgname))
+            for t in range(1, tasks + 1):
+                taskname = f"task{ch}{tg}_{t}"
+                previous = f"task{ch}{tg}_{t-1}" if t > 1 else None
+                write(f"{tgdir}/{taskname}.md",
+                      task_markup(taskname, previous, [term((ch * tg * t + i) % terms) for i in range(3)],
+                                  with_mermaid=(t % 4 == 0), chname=chname, tgname=tgname))
+                write(f"alt/{chname}/{tgname}/{taskname}.md", f"Solution notes for {taskname}.\n")
+    write(c.AUTHOR_CONFIG_FILENAME, CONFIG_TEMPLATE.format(chapters="\n".join(chapterlines)))
+
+
+def glossary_markup(term: tg.Callable[[int], str], terms: int) -> str:
+    parts = ["title: Glossary\n---\nTerms used throughout the course.\n"]
+    for i in range(terms):
+        parts.append(f"[TERM::{term(i)}|{term(i)}s]\n"
+                     f"Definition of {term(i)}, see also [TERMREF::{term((i + 1) % terms)}].\n"
+                     f"[ENDTERM]\n")
+    return "\n".join(parts)
+
+
+def task_markup(taskname: str, previous: str | None, termrefs: list[str], with_mermaid: bool,
+                chname: str, tgname: str) -> str:
+    assumes = f"assumes: {previous}\n" if previous else ""
+    termref_calls = ", ".join(f"[TERMREF::{t}]" for t in termrefs)
+    mermaid = ("\n```mermaid\ngraph LR\n  A[input] --> B[compute]\n  B --> C[output]\n```\n"
+               if with_mermaid else "")
+    paragraphs = "\n\n".join(f"Paragraph {i} of {taskname} explains *one* more aspect of {termrefs[i % 3]} "
+                             f"in some detail, with `inline code` and a [link](https://example.org/{i})."
+                             for i in range(6))
+    return f"""title: Task {taskname}
+timevalue: 1.5
+difficulty: {len(taskname) % 4 + 1}
+explains: {termrefs[0]}
+{assumes}---
+[SECTION::background::default]
+
+This task builds on {termref_calls}.
+
+{paragraphs}
+{mermaid}
+[ENDSECTION]
+
+[SECTION::instructions::detailed]
+
+[NOTICE]
+Steps: [EC] prepare, [EC] compute, [EC] check.
+[ENDNOTICE]
+
+```python
+[SNIPPET::include/example.py::setup]
+[SNIPPET::include/example.py::compute]
+```
+
+The entire program:
+
+```python
+[INCLUDE::include/example.py]
+```
+
+[HINT::Where to look]
+See [TREEREF::/{chname}/{tgname}/solution.py] and [PARTREF::{tgname}].
+[ENDHINT]
+
+[ENDSECTION]
+
+[INSTRUCTOR::Checking]
+[INCLUDE::ALT:]
+[ENDINSTRUCTOR]
+"""
+
+
+def build(targetdir: str, jobs: int) -> float:
+    """One `sedrila author build`, akin to sdrl.subcmd.author.execute(). Returns the duration in seconds."""
+    pargs = argparse.Namespace(config=c.AUTHOR_CONFIG_FILENAME, include_stage="", clean=False, jobs=jobs,
+                               hashes=False, sums=False, profile="", compress=False, compress_best=False,
+                               fingerprint=False, shared_toc=False, targetdir=targetdir)
+    b._testmode_reset()  # noqa
+    macros._testmode_reset()  # noqa
+    targetdir_i = author._targetdir_i(targetdir)
+    author.prepare_directories(targetdir, targetdir_i)
+    start = time.perf_counter()
+    author.create_and_build_course(pargs, targetdir_i, targetdir)
+    duration = time.perf_counter() - start
+    if b.num_errors:
+        b.critical(f"benchmark course produced {b.num_errors} errors")
+    return duration
+
+
+def expand_macros(largest=5, rounds=20) -> float:
+    """
+    Expand the macros of the largest task files rounds times as render_markdown() does:
+    EARLY on the Markdown, LATE on the resulting HTML. Uses the macros registered by the preceding build.
+    Returns the duration in seconds.
+    """
+    topmatter = b.slurp_yaml(c.AUTHOR_CONFIG_FILENAME)['blockmacro_topmatter']
+    taskfiles = sorted(glob.glob("ch/*/*/task*.md"), key=os.path.getsize)[-largest:]
+    inputs = []
+    for taskfile in taskfiles:  # prepare the inputs of the LATE phase and check that all is well
+        partname = os.path.basename(taskfile)[:-3]
+        markup = b.slurp(taskfile).split("---\n", 1)[1]  # without the topmatter
+        macros.switch_part(partname)
+        md.render_markdown(taskfile, partname, markup, b.Mode.INSTRUCTOR, topmatter)
+        html = md.convert_blocks(macros.expand_macros(taskfile, partname, markup, is_early_phase=True))
+        inputs.append((taskfile, partname, markup, html))
+    if b.num_errors:
+        b.critical(f"macro expansion produced {b.num_errors} errors")
+    start = time.perf_counter()
+    for i in range(rounds):
+        for taskfile, partname, markup, html in inputs:
+            macros.switch_part(partname)
+            macros.expand_macros(taskfile, partname, markup, is_early_phase=True)
+            macros.expand_macros(taskfile, partname, html)
+    return time.perf_counter() - start
+
+
+def append_to(path: str, text: str):
+    time.sleep(0.01)  # so the change is younger than the previous build's start
+    b.spit(path, b.slurp(path) + text)
+
+
+def run_benchmark(workdir: str, jobs=1, repeat=1, **sizes) -> b.StrAnyDict:
+    """Time each of SCENARIOS repeat times on a fresh synthetic course in workdir; return the results."""
+    timings = {scenario: [] for scenario in SCENARIOS}
+    for i in range(repeat):
+        rundir = os.path.join(workdir, f"run{i}")
+        generate_course(os.path.join(rundir, "in"), **sizes)
+        with contextlib.chdir(os.path.join(rundir, "in")):
+            outdir = os.path.join("..", "out")
+            timings["cold"].append(build(outdir, jobs))
+            timings["noop"].append(build(outdir, jobs))
+            append_to("ch/ch1/tg11/task11_1.md", "\nOne more sentence.\n")
+            timings["task_edit"].append(build(outdir, jobs))
+            append_to("ch/glossary.md", "\n[TERM::Concept extra]\nOne more term.\n[ENDTERM]\n")
+            timings["glossary_edit"].append(build(outdir, jobs))
+            timings["expand_macros"].append(expand_macros())
+        shutil.rmtree(rundir)
+    return dict(
+        timestamp=dt.datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(), platform=platform.platform(),
+        course=dict(sizes, numtasks=sizes['chapters'] * sizes['taskgroups'] * sizes['tasks']),
+        jobs=jobs, repeat=repeat,
+        results={scenario: dict(seconds_min=round(min(times), 4),
+                                seconds_median=round(statistics.median(times), 4),
+                                seconds_all=[round(t, 4) for t in times])
+                 for scenario, times in timings.items()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--chapters', type=int, default=3)
+    parser.add_argument('--taskgroups', type=int, default=4, help="per chapter")
+    parser.add_argument('--tasks', type=int, default=8, help="per taskgroup")
+    parser.add_argument('--terms', type=int, default=40, help="in glossary")
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('resultfile', help="JSON file to write the results to ('-' for stdout)")
+    pargs = parser.parse_args()
+    b.set_loglevel("WARNING")  # no list of written files
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmark(workdir, jobs=pargs.jobs, repeat=pargs.repeat, chapters=pargs.chapters,
+                                taskgroups=pargs.taskgroups, tasks=pargs.tasks, terms=pargs.terms)
+    resultjson = json.dumps(results, indent=2)
+    if pargs.resultfile == "-":
+        print(resultjson)
+    else:
+        b.spit(pargs.resultfile, resultjson + "\n")
+    for scenario, result in results['results'].items():
+        print(f"{scenario:15} {result['seconds_median']:8.3f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
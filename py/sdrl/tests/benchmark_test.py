@@ -0,0 +1,14 @@
+# pytest tests
+import json
+
+import sdrl.tests.benchmark as benchmark
+
+
+def test_benchmark_on_tiny_course(tmp_path):
+    """The synthetic course builds without errors and each scenario gets timed."""
+    results = benchmark.run_benchmark(str(tmp_path), chapters=1, taskgroups=2, tasks=2, terms=5)
+    assert results['course']['numtasks'] == 4
+    assert set(results['results']) == set(benchmark.SCENARIOS)
+    for scenario, result in results['results'].items():
+        assert len(result['seconds_all']) == 1 and result['seconds_min'] > 0, scenario
+    json.dumps(results)  # must be serializable
@@ -2,6 +2,8 @@
 import logging
 import unittest.mock as mock
 
+import pytest
+
 import base as b
 from sdrl.directory import Directory
 
@@ -184,3 +186,74 @@ def test_build_calls_build_on_all_elements():
     d.build()
     e1.build.assert_called_once()
     e2.build.assert_called_once()
+
+
+class _OrderedElem:
+    """Fake element that records when it gets built and may have dependencies/prerequisites."""
+    BUILD_IN_THREAD = False
+
+    def __init__(self, name, log: list, deps=(), prereqs=()):
+        self.name = name
+        self.log = log
+        self.deps = list(deps)
+        self.prereqs = list(prereqs)
+
+    def my_dependencies(self):
+        return self.deps
+
+    def my_prerequisites(self):
+        return self.prereqs
+
+    def build(self):
+        b.info(f"built {self.name}")
+        self.log.append(self.name)
+
+
+class _ThreadedElem(_OrderedElem):
+    BUILD_IN_THREAD = True
+
+
+def test_build_follows_managed_types_order_for_independent_elements():
+    d = _make_directory()
+    log = []
+    d.take_the(_FakeElem2, "late", _OrderedElem("late", log))
+    d.take_the(_FakeElem, "early", _OrderedElem("early", log))
+    d.build()
+    assert log == ["early", "late"]
+
+
+def test_build_puts_dependencies_and_prerequisites_first():
+    d = _make_directory()
+    log = []
+    late = _OrderedElem("late", log)
+    middle = _OrderedElem("middle", log, prereqs=[late])
+    d.take_the(_FakeElem, "early", _OrderedElem("early", log, deps=[middle]))
+    d.take_the(_FakeElem, "middle", middle)
+    d.take_the(_FakeElem2, "late", late)
+    d.build()
+    assert log == ["late", "middle", "early"]
+
+
+def test_build_in_threads_keeps_message_order(capsys):
+    b.loglevel = logging.INFO
+    log = []
+    d = _make_directory()
+    d.jobs = 3
+    for name in ("t1", "t2", "t3"):
+        d.take_the(_FakeElem2, name, _ThreadedElem(name, log))
+    d.take_the(_FakeElem, "serial", _OrderedElem("serial", log))
+    d.build()
+    assert sorted(log) == ["serial", "t1", "t2", "t3"]
+    assert capsys.readouterr().out.split("\n") == ["built serial", "built t1", "built t2", "built t3", ""]
+
+
+def test_build_in_thread_reraises_in_main_thread():
+    class _FailingElem(_ThreadedElem):
+        def build(self):
+            raise ValueError(self.name)
+    d = _make_directory()
+    d.jobs = 2
+    d.take_the(_FakeElem, "bad", _FailingElem("bad", []))
+    with pytest.raises(ValueError, match="bad"):
+        d.build()
+    d.cache.commit.assert_called_once()  # what was built so far is kept
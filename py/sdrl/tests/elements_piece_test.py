@@ -0,0 +1,87 @@
+"""Unit tests for how sdrl.elements.Piece uses the cache."""
+import logging
+import os
+import tempfile
+
+import base as b
+import cache as c
+import sdrl.constants as const
+import sdrl.directory as dir
+import sdrl.elements as el
+
+
+def setup_function():
+    b._testmode_reset()  # noqa
+    b.loglevel = logging.ERROR
+
+
+def _count_decompress(monkeypatch) -> list[bytes]:
+    """Make the cache record each decompression in the list returned."""
+    calls = []
+    original_decompress = c._decompress
+    def counting_decompress(data: bytes) -> str:
+        calls.append(data)
+        return original_decompress(data)
+    monkeypatch.setattr(c, '_decompress', counting_decompress)
+    return calls
+
+
+class _Piece(el.Piece):
+    """Concrete Piece without the construction requirements of the real ones."""
+    pass
+
+
+# ── lazy value ────────────────────────────────────────────────────────────────
+
+def test_piece_value_is_read_upon_first_access_only(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, const.CACHE_FILENAME)
+        # ----- first run builds the piece:
+        the_cache = c.SedrilaCache(cachefile, start_clean=False)
+        piece = _Piece("mypart", directory=dir.Directory(the_cache))
+        piece.check_existing_resource()
+        assert piece.state == c.State.MISSING and not piece.has_value()
+        piece.handle_value_and_state("some content " * 10)
+        assert piece.state == c.State.HAS_CHANGED
+        the_cache.close()
+        # ----- second run finds the piece without reading it:
+        the_cache = c.SedrilaCache(cachefile, start_clean=False)
+        piece = _Piece("mypart", directory=dir.Directory(the_cache))
+        decompressed = _count_decompress(monkeypatch)
+        piece.check_existing_resource()
+        assert piece.state == c.State.AS_BEFORE and piece.has_value()
+        assert decompressed == []
+        assert piece.value == "some content " * 10
+        assert piece.value == "some content " * 10
+        assert len(decompressed) == 1
+        the_cache.close()
+
+
+def test_piece_missing_value_of_collection_type_is_empty():
+    the_cache = c.SedrilaCache("", start_clean=False)
+    piece = el.IncludeList_s("mypart", directory=dir.Directory(the_cache))
+    piece.check_existing_resource()
+    assert piece.state == c.State.MISSING
+    assert piece.value == set()
+
+
+# ── digest comparison ─────────────────────────────────────────────────────────
+
+def test_piece_rebuilt_with_same_value_is_as_before_without_reading_cache(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, const.CACHE_FILENAME)
+        the_cache = c.SedrilaCache(cachefile, start_clean=False)
+        _Piece("same", directory=dir.Directory(the_cache)).handle_value_and_state("old value " * 10)
+        _Piece("other", directory=dir.Directory(the_cache)).handle_value_and_state("old value " * 10)
+        the_cache.close()
+        the_cache = c.SedrilaCache(cachefile, start_clean=False)
+        decompressed = _count_decompress(monkeypatch)
+        same = _Piece("same", directory=dir.Directory(the_cache))
+        same.handle_value_and_state("old value " * 10)
+        assert same.state == c.State.AS_BEFORE
+        other = _Piece("other", directory=dir.Directory(the_cache))
+        other.handle_value_and_state("new value " * 10)
+        assert other.state == c.State.HAS_CHANGED
+        assert decompressed == []
+        assert the_cache.cached_str(other.cache_key) == ("new value " * 10, c.State.HAS_CHANGED)
+        the_cache.close()
@@ -191,6 +191,26 @@ def test_rebuild_when_an_external_topmatter_dependency_has_changed():
         mock_do_build.assert_called_once()
 
 
+def test_rebuild_of_an_unchanged_graph_does_not_run_graphviz():
+    fake_svg = '<svg width="10pt" height="10pt" viewBox="0 0 10 10">t1 t2</svg>'
+    with mock.patch.object(el.graphviz.Digraph, "pipe", return_value=fake_svg.encode()) as mock_pipe:
+        cache1, diagram1 = _setup(start_clean=True, tasks=[_FakeTask("t1"), _FakeTask("t2")])
+        diagram1.build()
+        cache1.close()
+        # ----- run 2: t2's topmatter has changed, but not in a way the diagram shows:
+        cache2, diagram2 = _setup(start_clean=False, tasks=[_FakeTask("t1"), _FakeTask("t2")],
+                                  topmatter_states=dict(t2=c.State.HAS_CHANGED))
+        diagram2.build()
+        assert mock_pipe.call_count == 1  # the SVG came from the memo
+        assert b.slurp(diagram2.outputfile_s) == diagram2._make_scalable(fake_svg)  # noqa
+        cache2.close()
+        # ----- run 3: t2's difficulty has changed, which the diagram shows:
+        cache3, diagram3 = _setup(start_clean=False, tasks=[_FakeTask("t1"), _FakeTask("t2", difficulty=3)],
+                                  topmatter_states=dict(t2=c.State.HAS_CHANGED))
+        diagram3.build()
+        assert mock_pipe.call_count == 2
+
+
 # ── rebuild on task removal (node-set diffing, not covered by plain dependency propagation) ──
 
 def test_rebuild_when_a_task_is_removed_from_the_taskgroup():
@@ -20,6 +20,18 @@ def test_expand_macros():
                                 "a [MA], b [MB::argb], c [MC::c1::c2], d") == "a MA(None,None), b MB(argb,None), c MC(c1,c2), d" 
     
 
+def test_expand_adjacent_blockmacros():
+    """A <p> or </p> belongs to the first call that can take it, like with a single regexp substitution."""
+    b._testmode_reset()
+    macros._testmode_reset()
+    macros.register_macro('START', 0, macros.MM.BLOCKSTART, expander)
+    macros.register_macro('END', 0, macros.MM.BLOCKEND, expander)
+    assert macros.expand_macros("-", "-", "<p>[END]</p><p>[START]</p>") == "END(None,None)START(None,None)"
+    assert (macros.expand_macros("-", "-", "<p>a\n[END]</p>\n<p>[START]\nb</p>") ==
+            "<p>a\n</p>END(None,None)\nSTART(None,None)<p>\nb</p>")
+    assert macros.expand_macros("-", "-", "<p>a [LINK](url) b</p>") == "<p>a [LINK](url) b</p>"  # no call
+
+
 def test_expand_nonexisting_macro(capsys):
     b._testmode_reset()
     macros._testmode_reset()
@@ -2,6 +2,7 @@
 import pytest
 
 import base as b
+import memo
 import sdrl.markdown as md
 import sdrl.macros as macros
 
@@ -28,6 +29,11 @@ def render(markup: str) -> str:
     return md.md.reset().convert(markup)
 
 
+def render_blockwise(markup: str) -> str:
+    """Like render(), but the way render_markdown() does it."""
+    return md.render_markdown("nofile", "nopart", markup, b.Mode.INSTRUCTOR, dict())['html']
+
+
 def test_perhaps_suppress_instructorinfo():
     md.md.mode = b.Mode.STUDENT  # turns on the suppression
     markup = "one [INSTRUCTOR::my heading] two [ENDINSTRUCTOR] three"
@@ -79,6 +85,7 @@ def test_macrocall(layout, markup, output):
     print("    should out:\n", output, sep="")
     print("    actual out:\n", rendered, sep="")
     assert rendered == output
+    assert render_blockwise(markup) == output
 
 
 def test_html_charescapes_and_free_ampersands():
@@ -91,6 +98,7 @@ def test_mermaid_fence():
     rendered = render(mermaid_markup_in)
     print(rendered); 
     assert rendered == mermaid_markup_out
+    assert render_blockwise(mermaid_markup_in) == mermaid_markup_out
 
 
 def test_mermaid_fence_unclosed(capsys):
@@ -105,3 +113,54 @@ def test_uses_mermaid():
     """mermaid.js must be pulled into a page only if that page has a diagram on it."""
     assert md.uses_mermaid(render(mermaid_markup_in))
     assert not md.uses_mermaid(render("before\n\n```python\nA --> B\n```\n\nafter"))
+
+
+def test_split_blocks():
+    markup = ("para 1\n\n"
+              "```\ncode\n\nwith blank line\n```\n\n"
+              "- item 1\n\n- item 2\n\n    more of item 2\n\n"
+              "<div>\n\nraw\n\n</div>\n\n"
+              "<!-- comment\n\nmore comment -->\n\n\n"
+              "para 2")
+    assert md.split_blocks(markup) == [
+        "para 1", 
+        "```\ncode\n\nwith blank line\n```\n\n- item 1\n\n- item 2\n\n    more of item 2",  # list items attach
+        "<div>\n\nraw\n\n</div>", "<!-- comment\n\nmore comment -->", "para 2"]
+    assert md.split_blocks("a [link][ref]\n\n[ref]: https://example.org") == [
+        "a [link][ref]\n\n[ref]: https://example.org"]  # definitions apply across blocks
+    assert md.split_blocks("para\n\n```python,unknown\nnot a fence\n\n```") == [
+        "para", "```python,unknown\nnot a fence", "```"]  # as Markdown sees it
+
+
+def test_render_markdown_blockwise():
+    markup = ("# Heading\n\nPara with *emphasis*.\n\n"
+              "```python\nx = 1\n\ny = 2\n```\n\n"
+              "1. one\n\n2. two\n\n"
+              "# Heading\n\nlast")  # duplicate heading id
+    assert render_blockwise(markup) == render(markup)
+    md.md.memo = memo.Memo("")
+    try:
+        assert render_blockwise(markup) == render(markup)  # fills the memo
+        assert render_blockwise(markup) == render(markup)  # uses the memo
+        assert md.md.memo.hitcount > 0
+    finally:
+        md.md.memo = None
+
+
+@pytest.mark.parametrize("code", [
+    "```python\ndef f(x):\n    return x\n```",  # FencedBlockPreprocessor
+    "``` { .python #fid hl_lines=\"2\" }\ndef f(x):\n    return x\n```",  # ditto, with attrs
+    "    :::python\n    def f(x):\n        return x",  # HiliteTreeprocessor
+])
+def test_highlighting_uses_memo(code):
+    unmemoized = md.render_plain_markdown(code)
+    md.md.memo = memo.Memo("")
+    try:
+        assert md.convert_block(code).strip() == unmemoized  # fills the memo
+        assert md.md.memo.hitcount == 0
+        assert md.convert_block(f"Other text\n\n{code}").strip().endswith(unmemoized)  # highlights from memo
+        assert md.md.memo.hitcount == 1
+        assert md.render_plain_markdown(f"More text\n\n{code}").endswith(unmemoized)
+        assert md.md.memo.hitcount == 1  # other Markdown instances do not use md's memo
+    finally:
+        md.md.memo = None
@@ -1,4 +1,5 @@
 import logging
+import os
 
 import pytest
 
@@ -98,6 +99,22 @@ def test_expandvars():
     assert exc_info.value.missing == ["NOPE"]
 
 
+# ── spit_if_changed, copy_if_changed ─────────────────────────────────────────
+
+def test_spit_if_changed(tmp_path):
+    path = str(tmp_path / "out.html")
+    assert b.spit_if_changed(path, "content")
+    os.utime(path, ns=(0, 0))
+    assert not b.spit_if_changed(path, "content")
+    assert os.stat(path).st_mtime_ns == 0  # untouched
+    assert b.spit_if_changed(path, "contenT")  # same size, different content
+    assert b.slurp(path) == "contenT"
+    assert b.spit_if_changed(path, b"bytes")
+    assert b.copy_if_changed(path, path + "2")
+    assert not b.copy_if_changed(path, path + "2")
+    assert sorted(os.listdir(tmp_path)) == ["out.html", "out.html2"]  # no leftover temporary files
+
+
 # ── as_fingerprint ────────────────────────────────────────────────────────────
 
 def test_as_fingerprint_removes_spaces_and_lowercases():
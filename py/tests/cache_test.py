@@ -1,4 +1,6 @@
+import concurrent.futures
 import os
+import sqlite3
 import tempfile
 
 import pytest
@@ -61,9 +63,268 @@ def test_sedrilacache():
         # assert ca.filestate(f_new, ck(f_new)) == S.HAS_CHANGED
 
 
-def make_and_record_file(ca, filename):
-    with open(filename, mode='w'):
-        pass  # just create the file
+def test_sedrilacache_hashmode(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        S = cache.State
+        f_touched = os.path.join(tmpdir, "f_touched")
+        f_edited = os.path.join(tmpdir, "f_edited")
+        f_untouched = os.path.join(tmpdir, "f_untouched")
+        # ----- Phase 1: record files in hashmode
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=True)
+        for filename in (f_touched, f_edited, f_untouched):
+            make_and_record_file(ca, filename, content="same content")
+        assert ca.filestate(f_edited, ck(f_edited)) == S.HAS_CHANGED  # was written in this run
+        ca.close()
+        # ----- Phase 2: make all files look new, change one of them
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=True)
+        future = ca.mtime + 10
+        os.utime(f_touched, (future, future))
+        with open(f_edited, 'w') as f:
+            f.write("other content")
+        os.utime(f_edited, (future, future))
+        ca.timestamp_cached = 0  # kludge! make all files look new, like after a fresh clone
+        # ----- Phase 3: only content changes count; unchanged stat data avoids hashing
+        hashed = []
+        original_file_digest = cache.hashlib.file_digest
+        def counting_file_digest(f, digest):
+            hashed.append(f.name)
+            return original_file_digest(f, digest)
+        monkeypatch.setattr(cache.hashlib, 'file_digest', counting_file_digest)
+        assert ca.filestate(f_untouched, ck(f_untouched)) == S.AS_BEFORE
+        assert ca.filestate(f_touched, ck(f_touched)) == S.AS_BEFORE
+        assert ca.filestate(f_edited, ck(f_edited)) == S.HAS_CHANGED
+        assert hashed == [f_touched, f_edited]
+        assert ca.state(ck(f_untouched)) == S.AS_BEFORE
+        assert ca.state(ck(f_touched)) == S.AS_BEFORE  # the refreshed fingerprint does not count as a change
+        assert ca.state(ck(f_edited)) == S.HAS_CHANGED
+        ca.close()
+        # ----- Phase 4: the new fingerprints were stored, so nothing gets hashed anymore
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=True)
+        ca.timestamp_cached = 0
+        hashed.clear()
+        assert ca.filestate(f_touched, ck(f_touched)) == S.AS_BEFORE
+        assert ca.filestate(f_edited, ck(f_edited)) == S.AS_BEFORE
+        assert hashed == []
+        ca.close()
+
+
+def test_sedrilacache_hashmode_commit_within_run():
+    """A commit() in the middle of a run must not make a file's new fingerprint look like the previous one."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        f = os.path.join(tmpdir, "f")
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=True)
+        make_and_record_file(ca, f, content="old content")
+        ca.close()
+        with open(f, 'w') as fh:
+            fh.write("new content")
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=True)
+        ca.record_file(f, ck(f))  # as a posthoc Sourcefile does
+        ca.commit()  # as _put() may do at any time
+        assert ca.filestate(f, ck(f)) == cache.State.HAS_CHANGED
+        ca.close()
+
+
+
+@pytest.mark.parametrize("hashmode", [False, True])
+def test_sedrilacache_file_checks_need_no_single_queries(hashmode):
+    """Checking unchanged files reads their entries in bulk (prefetch()) or, if empty, not at all."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        files = [os.path.join(tmpdir, f"f{i}") for i in range(5)]
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=hashmode)
+        for f in files:
+            make_and_record_file(ca, f, content=f)
+            os.utime(f, (1, 1))  # older than the cache
+        ca.close()
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=hashmode)
+        queries = []
+        ca.db.conn.set_trace_callback(queries.append)
+        ca.prefetch([ck(f) for f in files])  # as Directory does for Sourcefiles
+        assert all(ca.filestate(f, ck(f)) == cache.State.AS_BEFORE for f in files)
+        assert len(queries) == (1 if hashmode else 0)
+        ca.close()
+
+
+def test_sedrilacache_group_has_changed():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        f1, f2, f3 = (os.path.join(tmpdir, name) for name in ("f1", "f2", "f3"))
+        for f in (f1, f2, f3):
+            with open(f, 'w') as fh:
+                fh.write(f)
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=True)
+        assert ca.group_has_changed([f1, f2, f3], "group")  # all files are new
+        ca.close()
+        # ----- touching does not count, editing does, and a removed file leaves no fingerprint behind:
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=True)
+        os.utime(f1, (1, 1))
+        assert not ca.group_has_changed([f1, f2, f3], "group")
+        assert ca.state("group") == cache.State.AS_BEFORE
+        os.remove(f3)
+        assert not ca.group_has_changed([f1, f2], "group")
+        ca.close()
+        ca = cache.SedrilaCache(cachefile, start_clean=False, hashmode=True)
+        assert set(ca["group"]) == {f1, f2}
+        with open(f2, 'w') as fh:
+            fh.write("new content")
+        assert ca.group_has_changed([f1, f2], "group")
+        assert ca.state("group") == cache.State.HAS_CHANGED
+        ca.close()
+
+
+def test_sedrilacache_sqlite():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        S = cache.State
+        # ----- entries carry their type and are read back by prefetch or individually:
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        ca.write_str("s", "value s" * 20)
+        ca.write_list("l", ["a", "b"])
+        ca.write_set("st", {"x"})
+        ca.write_dict("d", dict(a=1))
+        ca.close()
+        with sqlite3.connect(cachefile) as conn:
+            types = dict(conn.execute("SELECT key, type FROM entries"))
+        assert types["s"] == "str" and types["l"] == "list" and types["st"] == "set" and types["d"] == "dict"
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        ca.prefetch(["s", "l", "nonexisting"])
+        assert set(ca.db.prefetched) == {"s", "l"}
+        assert ca.cached_str("s") == ("value s" * 20, S.AS_BEFORE)
+        assert ca["l"] == ["a", "b"] and ca["st"] == {"x"} and ca["d"] == dict(a=1)
+        assert ca.cached_dict("d") == (dict(a=1), S.AS_BEFORE)
+        ca.close()
+        # ----- start_clean empties the cache:
+        ca = cache.SedrilaCache(cachefile, start_clean=True)
+        assert ca.cached_str("s") == (None, S.MISSING)
+        ca.close()
+
+
+
+
+def test_sedrilacache_digest():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        # ----- equal values have equal digests, regardless of set and dict order:
+        assert ca.digest_of({"a", "b", "c"}) == ca.digest_of({"c", "b", "a"})
+        assert ca.digest_of(dict(a=1, b=2)) == ca.digest_of(dict(b=2, a=1))
+        assert ca.digest_of(["a", "b"]) != ca.digest_of(["b", "a"])
+        assert ca.digest_of("a") != ca.digest_of("b")
+        # ----- digests are available for pending and committed entries alike:
+        assert ca.digest("s") is None
+        ca.write_str("s", "value s")
+        ca.write_set("st", {"x", "y"})
+        assert ca.digest("s") == ca.digest_of("value s")
+        ca.commit()
+        assert ca.digest("s") == ca.digest_of("value s")
+        ca.close()
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        assert ca.digest("st") == ca.digest_of({"y", "x"})
+        ca.close()
+
+
+def test_sedrilacache_streaming():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        S = cache.State
+        f = os.path.join(tmpdir, "f")
+        # ----- Phase 1: writes get committed in batches, written only knows the types:
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        ca.PENDING_LIMIT = 100
+        ca.write_str("small", "s")
+        assert "small" in ca.pending
+        ca.write_str("big", "".join(str(i) for i in range(1000)))  # exceeds PENDING_LIMIT
+        assert not ca.pending and ca.pending_size == 0
+        assert ca.written == dict(small='str', big='str')
+        with sqlite3.connect(cachefile) as conn:
+            assert conn.execute("SELECT count(*) FROM entries WHERE key = 'small'").fetchone()[0] == 1
+        conn.close()
+        assert ca.cached_str("small") == ("s", S.HAS_CHANGED)
+        ca.write_list("l", ["a"])
+        make_and_record_file(ca, f)
+        ca.commit()
+        ca.db.close()  # simulate an interrupted build: no close()
+        # ----- Phase 2: the entries of the interrupted build are there, but count as changed:
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        assert ca.recovered == {"small", "big", "l", ck(f)}
+        assert ca.cached_str("small") == ("s", S.HAS_CHANGED)
+        assert ca.cached_list("l") == (["a"], S.HAS_CHANGED)
+        assert ca.filestate(f, ck(f)) == S.HAS_CHANGED
+        ca.close()
+        # ----- Phase 3: after a finished build, they are normal entries:
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        assert ca.recovered == set()
+        assert ca.cached_str("small") == ("s", S.AS_BEFORE)
+        assert ca.filestate(f, ck(f)) == S.AS_BEFORE
+        ca.close()
+
+
+def test_sedrilacache_threads():
+    """Threads of Directory.build() write (and thus commit()) and read concurrently via one connection."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        for i in range(100):
+            ca.write_str(f"old{i}", f"old value {i}" * 20)
+        ca.close()
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        ca.COMMIT_INTERVAL = 0.0  # every write commits
+
+        def work(t: int):
+            for i in range(100):
+                ca.write_str(f"t{t}_{i}", f"value {t} {i}" * 20)
+                assert ca.cached_str(f"old{i}")[0] == f"old value {i}" * 20
+                ca.prefetch([f"old{(i + 1) % 100}"])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(work, range(8)))  # re-raises what the threads raised
+        ca.close()
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        assert all(ca.cached_str(f"t{t}_99")[0] == f"value {t} 99" * 20 for t in range(8))
+        ca.close()
+
+
+def test_sedrilacache_replaces_foreign_file():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        # ----- a non-SQLite file (e.g. an old dbm cache) gets replaced:
+        with open(cachefile, 'wb') as f:
+            f.write(b"this is no database" * 100)
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        assert "s" not in ca
+        ca.write_str("s", "v")
+        ca.close()
+        # ----- a different format version gets discarded:
+        with sqlite3.connect(cachefile) as conn:
+            conn.execute("PRAGMA user_version = 0")
+        conn.close()
+        ca = cache.SedrilaCache(cachefile, start_clean=False)
+        assert "s" not in ca
+        ca.close()
+        # ----- remove_cachefiles() removes companion files and directories, too:
+        open(cachefile + "-wal", 'w').close()
+        os.makedirs(os.path.join(cachefile + "-templates", "sub"))
+        cache.remove_cachefiles(cachefile)
+        assert os.listdir(tmpdir) == []
+
+
+def test_sedrilacache_dbm_backend():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachefile = os.path.join(tmpdir, c.CACHE_FILENAME)
+        ca = cache.SedrilaCache(cachefile, start_clean=False, backend=cache.DbmBackend)
+        ca.write_list("l", ["a", "b"])
+        ca.close()
+        ca = cache.SedrilaCache(cachefile, start_clean=False, backend=cache.DbmBackend)
+        assert ca.cached_list("l") == (["a", "b"], cache.State.AS_BEFORE)
+        assert ca["l"] == ["a", "b"]
+        ca.close()
+
+
+def make_and_record_file(ca, filename, content=""):
+    with open(filename, mode='w') as f:
+        f.write(content)
     ca.record_file(filename, ck(filename))
         
         
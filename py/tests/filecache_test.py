@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+
+import filecache
+
+
+_files: filecache.FileCache  # for _worker_read()
+
+
+def _worker_read(path: str) -> tuple[str, filecache.Stats]:
+    """Runs in a forked process."""
+    return _files.read(path), _files.take_stats()
+
+
+def test_filecache(tmp_path):
+    path = str(tmp_path / "a.txt")
+    missing = str(tmp_path / "missing.txt")
+    (tmp_path / "a.txt").write_text("AAA")
+    calls = []
+
+    def count_lines(p: str) -> int:
+        calls.append(p)
+        with open(p) as fp:
+            return len(fp.readlines())
+
+    files = filecache.FileCache()
+    # ----- stat results are memoized per build, under the normalized path:
+    assert files.exists(path)
+    assert files.exists(str(tmp_path / "sub" / ".." / "a.txt"))
+    assert not files.exists(missing)
+    assert (files.hits, files.misses) == (1, 2)
+    (tmp_path / "missing.txt").write_text("M")
+    assert not files.exists(missing)  # still the same build
+    files.new_build()
+    assert files.exists(missing)
+    assert (files.hits, files.misses) == (0, 1)
+    # ----- contents and derived values stay valid while mtime and size stay the same:
+    assert files.read(path) == "AAA"
+    assert files.read(path) == "AAA"
+    assert files.derived(path, 'lines', count_lines) == 1
+    assert files.derived(path, 'lines', count_lines) == 1
+    assert len(calls) == 1
+    files.new_build()
+    assert files.read(path) == "AAA"  # survives new_build()
+    assert "hit" in files.hitrate_msg()
+    # ----- a changed file gets read anew:
+    (tmp_path / "a.txt").write_text("AAA\nBBBB")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    files.new_build()
+    assert files.read(path) == "AAA\nBBBB"
+    assert files.derived(path, 'lines', count_lines) == 2
+    assert len(calls) == 2
+
+
+def test_filecache_in_worker(tmp_path):
+    global _files
+    path = str(tmp_path / "a.txt")
+    (tmp_path / "a.txt").write_text("AAA")
+    _files = files = filecache.FileCache()
+    files.read(path)
+    context = multiprocessing.get_context('fork')
+    with context.Pool(1) as pool:
+        text, stats = pool.apply(_worker_read, (path,))
+    assert text == "AAA"
+    assert stats == (1, 0)  # contents inherited from the owner
+    files.add_stats(stats)
+    assert (files.hits, files.misses) == (1, 1)
+
+
+def test_filecache_counts_each_read_once(tmp_path):
+    path = str(tmp_path / "a.txt")
+    (tmp_path / "a.txt").write_text("AAA")
+    files = filecache.FileCache()
+    files.read(path)  # cold
+    assert (files.hits, files.misses) == (0, 1)
+    files.read(path)  # warm
+    assert (files.hits, files.misses) == (1, 1)
+    files.new_build()
+    files.read(path)  # contents survive new_build(), the stat result does not
+    assert (files.hits, files.misses) == (1, 0)
+    assert files.hitrate_msg() == "file cache: 1 of 1 lookup hit (100%)"
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import filewatch
+
+
+def _inotify_watcher(roots, files):
+    try:
+        return filewatch.InotifyWatcher(roots, files)
+    except OSError as exc:
+        pytest.skip(str(exc))
+
+
+@pytest.mark.parametrize("make", [_inotify_watcher, filewatch.PollingWatcher], ids=["inotify", "polling"])
+def test_watcher(tmp_path, make):
+    root = str(tmp_path / "src")
+    os.makedirs(os.path.join(root, "sub"))
+    old = os.path.join(root, "sub", "old.md")
+    config = str(tmp_path / "config.yaml")
+    sibling = str(tmp_path / "unwatched.txt")
+    for path in (old, config, sibling):
+        with open(path, "w") as f:
+            f.write("x")
+    watcher = make([root], [config])
+    try:
+        assert not watcher.wait(timeout=0.2)
+        # ----- modify:
+        os.utime(old, ns=(0, 0))  # make the change visible to polling regardless of mtime granularity
+        with open(old, "w") as f:
+            f.write("changed")
+        with open(sibling, "w") as f:
+            f.write("changed")
+        changes = watcher.wait(timeout=5)
+        assert changes.modified == {old}
+        assert not (changes.added or changes.removed or changes.dirs)
+        # ----- add, remove:
+        new = os.path.join(root, "sub", "new.md")
+        with open(new, "w") as f:
+            f.write("new")
+        os.remove(old)
+        changes = watcher.wait(timeout=5)
+        assert new in changes.added and changes.removed == {old}
+        # ----- new directory, file within it is watched afterwards:
+        newdir = os.path.join(root, "newdir")
+        os.mkdir(newdir)
+        assert watcher.wait(timeout=5).dirs == {newdir}
+        newfile = os.path.join(newdir, "f.md")
+        with open(newfile, "w") as f:
+            f.write("new")
+        assert newfile in watcher.wait(timeout=5).added
+        # ----- single file:
+        os.utime(config, ns=(0, 0))
+        with open(config, "w") as f:
+            f.write("changed")
+        assert watcher.wait(timeout=5).files == {config}
+    finally:
+        watcher.close()
+
+
+def test_make_watcher_ignores_missing_roots(tmp_path):
+    watcher = filewatch.make_watcher([str(tmp_path), str(tmp_path / "nonexisting")])
+    try:
+        assert not watcher.wait(timeout=0.2)
+    finally:
+        watcher.close()
@@ -0,0 +1,44 @@
+import os
+
+import manifest
+
+
+def test_manifest(tmp_path):
+    def make(name: str, content: bytes) -> str:
+        path = str(tmp_path / name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    manifestfile = str(tmp_path / "manifest.json")
+    assert manifest.Manifest.read(manifestfile).entries == {}  # no manifest yet
+    # ----- Entries from data and from file agree:
+    a = make("a.html", b"aaa")
+    entry = manifest.Entry.of_bytes(a, b"aaa", "Taskbuilder:a")
+    assert entry == manifest.Entry.of_file(a, "Taskbuilder:a")
+    assert entry.is_current_for(a)
+    os.utime(a, ns=(0, 0))
+    assert not entry.is_current_for(a)
+    # ----- write and read:
+    old = manifest.Manifest()
+    old.put("a.html", entry)
+    old.put("b.html", manifest.Entry.of_file(make("b.html", b"bbb"), "Taskbuilder:b"))
+    old.put("instructor/c.html", manifest.Entry.of_file(make("c.html", b"ccc"), "Taskbuilder:c"))
+    old.write(manifestfile)
+    assert manifest.Manifest.read(manifestfile).entries == old.entries
+    # ----- delta:
+    new = manifest.Manifest(dict(old.entries))
+    new.put("b.html", manifest.Entry.of_file(make("b.html", b"BBB"), "Taskbuilder:b"))
+    new.put("d.html", manifest.Entry.of_file(make("d.html", b"ddd"), "Taskbuilder:d"))
+    del new.entries["instructor/c.html"]
+    new.put("a.html", manifest.Entry.of_file(a, "Taskbuilder:a"))  # same content, other mtime
+    assert new.delta_since(old).lines() == ["A\td.html", "M\tb.html", "D\tinstructor/c.html"]
+    assert new.delta_since(manifest.Manifest()).added == ["a.html", "b.html", "d.html"]
+
+
+def test_unreadable_manifest_is_empty(tmp_path, capsys):
+    manifestfile = str(tmp_path / "manifest.json")
+    with open(manifestfile, 'w') as f:
+        f.write('{"format": 0, "files": {}}')
+    assert manifest.Manifest.read(manifestfile).entries == {}
+    assert "ignoring unreadable manifest" in capsys.readouterr().out
@@ -0,0 +1,78 @@
+import multiprocessing
+import time
+
+import memo
+
+
+_memo: memo.Memo  # for _worker_lookup()
+
+
+def _worker_lookup() -> tuple[str | None, str | None, memo.News]:
+    """Runs in a forked process."""
+    the_memo = _memo
+    found = (the_memo.get(memo.key_of("committed")), the_memo.get(memo.key_of("pending")))
+    the_memo.get(memo.key_of("new"))  # a miss
+    the_memo.put(memo.key_of("new"), "from worker")
+    return *found, the_memo.take_news()
+
+
+def test_memo(tmp_path):
+    filename = str(tmp_path / "memo")
+    key_a, key_b = memo.key_of("a"), memo.key_of("b")
+    assert memo.key_of("ab", "c") != memo.key_of("a", "bc")
+    # ----- values survive commit and reopening:
+    m = memo.Memo(filename)
+    assert m.get(key_a) is None
+    m.put(key_a, "AAA")
+    assert m.get(key_a) == "AAA"  # pending
+    m.close()
+    m = memo.Memo(filename)
+    assert m.get(key_a) == "AAA"
+    assert (m.hitcount, m.misscount) == (1, 0)
+    # ----- entries unused for too long disappear, used ones stay:
+    m.put(key_b, "BBB")
+    m.commit()
+    m.conn.execute("UPDATE memo SET used = ?", (time.time() - m.MAX_AGE - 1,))
+    m.get(key_b)
+    m.commit()
+    assert m.get(key_a) is None
+    assert m.get(key_b) == "BBB"
+    m.close()
+    # ----- start_clean:
+    m = memo.Memo(filename, start_clean=True)
+    assert m.get(key_b) is None
+    m.close()
+
+
+def test_memo_non_persistent():
+    m = memo.Memo("")
+    m.put(memo.key_of("x"), "X")
+    m.commit()
+    assert m.get(memo.key_of("x")) == "X"
+    m.close()
+
+
+def test_memo_unusable_file(tmp_path):
+    filename = tmp_path / "memo"
+    filename.write_text("this is no SQLite file, not at all, " * 10)
+    m = memo.Memo(str(filename))
+    m.put(memo.key_of("x"), "X")
+    m.close()
+    assert memo.Memo(str(filename)).get(memo.key_of("x")) == "X"
+
+
+def test_memo_in_worker(tmp_path):
+    global _memo
+    _memo = m = memo.Memo(str(tmp_path / "memo"))
+    m.put(memo.key_of("committed"), "C")
+    m.commit()
+    m.put(memo.key_of("pending"), "P")
+    context = multiprocessing.get_context('fork')
+    with context.Pool(1) as pool:
+        committed, pending, news = pool.apply(_worker_lookup)
+    assert (committed, pending) == ("C", "P")
+    assert news[0] == {memo.key_of("new"): "from worker"}
+    assert news[2:] == (2, 1)  # hitcount, misscount
+    m.add_news(news)
+    m.close()
+    assert memo.Memo(str(tmp_path / "memo")).get(memo.key_of("new")) == "from worker"
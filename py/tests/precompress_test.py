@@ -0,0 +1,41 @@
+import gzip
+import os
+
+import precompress
+
+
+def test_compress_tree(tmp_path):
+    page = tmp_path / "page.html"
+    page.write_text("<p>hello</p>" * 100)
+    (tmp_path / "image.png").write_bytes(b"\x89PNG")
+    (tmp_path / ".cache").mkdir()
+    (tmp_path / ".cache" / "skipped.html").write_text("x")
+    def is_included(name: str) -> bool:
+        return not name.startswith(".cache")
+
+    assert precompress.compress_tree(str(tmp_path), is_included) == 1
+    assert gzip.decompress((tmp_path / "page.html.gz").read_bytes()) == page.read_bytes()
+    assert not (tmp_path / "image.png.gz").exists() and not (tmp_path / ".cache" / "skipped.html.gz").exists()
+    assert os.stat(tmp_path / "page.html.gz").st_mtime_ns == os.stat(page).st_mtime_ns
+    assert (tmp_path / "page.html.br").exists() == bool(precompress.brotli)
+    # ----- siblings are renewed only when their source has changed:
+    assert precompress.compress_tree(str(tmp_path), is_included) == 0
+    page.write_text("<p>changed</p>")
+    assert precompress.compress_tree(str(tmp_path), is_included, jobs=2) == 1
+    assert gzip.decompress((tmp_path / "page.html.gz").read_bytes()) == b"<p>changed</p>"
+
+
+def test_compressors():
+    data = b"<p>hello</p>" * 1000
+    assert precompress.compressors()['.gz'](data) == gzip.compress(data, compresslevel=6, mtime=0)
+    assert precompress.compressors(best=True)['.gz'](data) == gzip.compress(data, compresslevel=9, mtime=0)
+    if precompress.brotli:
+        assert precompress.compressors()['.br'](data) == precompress.brotli.compress(data, quality=5)
+        assert precompress.brotli.decompress(precompress.compressors(best=True)['.br'](data)) == data
+
+
+def test_htaccess_rules():
+    rules = precompress.htaccess_rules()
+    assert '"$1.$2.gz" [L]' in rules and '"$1.$2.br" [L]' in rules
+    assert rules.index("Header set Content-Encoding br") < rules.index("Header set Content-Encoding gzip")
+    assert "T=text/css" in rules
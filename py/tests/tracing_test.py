@@ -0,0 +1,43 @@
+import json
+import threading
+
+import tracing
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = tracing.Tracer(enabled=False)
+    with tracer.span("Body_s", "task1") as span:
+        span.set(built=True)
+    assert tracer.spans == []
+
+
+def test_summary_and_trace(tmp_path):
+    tracer = tracing.Tracer()
+    def work(name: str, built: bool):
+        with tracer.span("Body_s", name) as span:
+            sum(range(10000))
+            span.set(built=built)
+    threads = [threading.Thread(target=work, args=(f"task{i}", i % 2 == 0)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        with tracer.span("Toc", "tg1"):
+            raise ValueError("oops")
+    except ValueError:
+        pass
+    # ----- summary:
+    summary = {row[0]: row[1:] for row in tracer.summary()}
+    count, built, duration, cputime = summary["Body_s"]
+    assert (count, built) == (4, 2) and duration > 0 and cputime >= 0
+    assert summary["Toc"][:2] == (1, 0)
+    # ----- trace file:
+    tracefile = tmp_path / "trace.json"
+    tracer.write_trace(str(tracefile))
+    events = json.loads(tracefile.read_text())['traceEvents']
+    assert len(events) == 5
+    assert all(event['ph'] == "X" and event['dur'] >= 0 for event in events)
+    assert {event['name'] for event in events if event['cat'] == "Body_s"} == {"task0", "task1", "task2", "task3"}
+    toc_event = [event for event in events if event['cat'] == "Toc"][0]
+    assert toc_event['name'] == "tg1" and toc_event['args']['exception'] == "ValueError"
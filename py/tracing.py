@@ -0,0 +1,116 @@
+"""
+Record how long which work items take, e.g. the Elements of a build.
+Produces a trace file in Chrome trace event format (viewable in https://ui.perfetto.dev or chrome://tracing)
+and a summary per category.
+A disabled Tracer costs next to nothing, so callers need not check whether tracing is on.
+"""
+import dataclasses
+import json
+import os
+import threading
+import time
+import typing as tg
+
+
+@dataclasses.dataclass
+class Span:
+    """One work item: a piece of work of some category (e.g. a class name) on some named object."""
+    category: str
+    name: str
+    start: float = 0.0  # time.perf_counter()
+    duration: float = 0.0  # wall time in seconds
+    cputime: float = 0.0  # CPU time of the thread in seconds
+    thread: int = 0
+    args: dict[str, tg.Any] = dataclasses.field(default_factory=dict)  # further facts, e.g. state
+
+    def set(self, **kwargs):
+        self.args.update(kwargs)
+
+
+class _NoSpan:
+    """What a disabled Tracer hands out: a Span lookalike that records nothing."""
+    def __enter__(self) -> '_NoSpan':
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **kwargs):
+        pass
+
+
+_NOSPAN = _NoSpan()
+
+
+class _ActiveSpan:
+    def __init__(self, tracer: 'Tracer', span: Span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self.span.thread = threading.get_ident()
+        self.cpustart = time.thread_time()
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.duration = time.perf_counter() - self.span.start
+        self.span.cputime = time.thread_time() - self.cpustart
+        if exc_type:
+            self.span.set(exception=exc_type.__name__)
+        self.tracer.add(self.span)
+        return False
+
+
+class Tracer:
+    enabled: bool
+    spans: list[Span]
+    t0: float  # time.perf_counter() at creation, the zero point of the trace
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.spans = []
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+
+    def span(self, category: str, name: str) -> tg.ContextManager:
+        """Context manager timing its body; set() further facts on what it returns."""
+        if not self.enabled:
+            return _NOSPAN
+        return _ActiveSpan(self, Span(category, name))
+
+    def add(self, span: Span):
+        """Record a finished span, e.g. one timed in a worker process (with the process id as its thread)."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.spans.append(span)
+
+    def summary(self) -> list[tuple[str, int, int, float, float]]:
+        """
+        Per category: number of spans, number of those with args['built'], total wall time, total CPU time.
+        Sorted by descending wall time.
+        """
+        sums = dict()  # category -> [count, built, duration, cputime]
+        for span in self.spans:
+            entry = sums.setdefault(span.category, [0, 0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += bool(span.args.get('built', False))
+            entry[2] += span.duration
+            entry[3] += span.cputime
+        result = [(category, *entry) for category, entry in sums.items()]
+        return sorted(result, key=lambda row: row[3], reverse=True)
+
+    def write_trace(self, filename: str):
+        """Write all spans as complete ('X') events in Chrome trace event format."""
+        pid = os.getpid()
+        threadnumbers = dict()  # thread ident -> small number, for readability
+        events = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            tid = threadnumbers.setdefault(span.thread, len(threadnumbers) + 1)
+            events.append(dict(name=span.name, cat=span.category, ph="X", pid=pid, tid=tid,
+                               ts=round((span.start - self.t0) * 1e6, 1),
+                               dur=round(span.duration * 1e6, 1),
+                               args=dict(cputime_ms=round(span.cputime * 1e3, 3), **span.args)))
+        with open(filename, 'wt', encoding='utf8') as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f, default=str)